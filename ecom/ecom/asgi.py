@@ -3,6 +3,10 @@ ASGI config for ecom project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The AI chat endpoint (``chat_send``) is an async view; serve the project with
+an ASGI server (e.g. ``uvicorn ecom.asgi:application``) so that chats waiting
+on the model do not each occupy a worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
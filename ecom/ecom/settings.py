@@ -60,6 +60,96 @@ STATICFILES_DIRS = [BASE_DIR / 'ecomApp/static']
 
 AUTH_USER_MODEL = 'ecomApp.CustomUser'
 
+# AI assistant backend: 'gemini', or 'local' for a deterministic offline provider
+# (used for benchmarks and load tests; latencies are simulated, in seconds).
+AI_PROVIDER = os.getenv('AI_PROVIDER', 'gemini')
+AI_PROVIDER_OPTIONS = {}
+if AI_PROVIDER == 'local':
+    AI_PROVIDER_OPTIONS = {
+        'embed_latency': float(os.getenv('AI_LOCAL_EMBED_LATENCY', '0')),
+        'generate_latency': float(os.getenv('AI_LOCAL_GENERATE_LATENCY', '0')),
+        'token_latency': float(os.getenv('AI_LOCAL_TOKEN_LATENCY', '0')),
+    }
+
+# Re-embed product profiles shortly after Product/Feedback writes. Edits arriving
+# within AI_INDEX_UPDATE_DELAY seconds of each other are coalesced into one update.
+AI_INDEX_AUTO_UPDATE = os.getenv('AI_INDEX_AUTO_UPDATE', '1') == '1'
+AI_INDEX_UPDATE_DELAY = float(os.getenv('AI_INDEX_UPDATE_DELAY', '2'))
+AI_INDEX_UPDATE_BATCH = int(os.getenv('AI_INDEX_UPDATE_BATCH', '256'))
+
+# Chat caches: query embeddings (LRU) and answers (TTL, keyed by index version).
+# The index version is re-read from Chroma at most every AI_INDEX_VERSION_REFRESH seconds.
+AI_QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('AI_QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+AI_ANSWER_CACHE_TTL = float(os.getenv('AI_ANSWER_CACHE_TTL', '300'))
+AI_ANSWER_CACHE_SIZE = int(os.getenv('AI_ANSWER_CACHE_SIZE', '1024'))
+AI_INDEX_VERSION_REFRESH = float(os.getenv('AI_INDEX_VERSION_REFRESH', '1'))
+# Semantic answer cache: a question whose embedding has cosine similarity of at least
+# AI_SEMANTIC_CACHE_THRESHOLD with a cached one (same filters) reuses its answer.
+AI_SEMANTIC_CACHE_THRESHOLD = float(os.getenv('AI_SEMANTIC_CACHE_THRESHOLD', '0.95'))
+AI_SEMANTIC_CACHE_SIZE = int(os.getenv('AI_SEMANTIC_CACHE_SIZE', '2048'))
+
+# Async chat endpoint: per-process cap on concurrent chats (extra requests wait up
+# to AI_CHAT_QUEUE_TIMEOUT seconds, then get a 503, or a busy message when streamed)
+# and threads for Chroma queries.
+AI_MAX_CONCURRENT_CHATS = int(os.getenv('AI_MAX_CONCURRENT_CHATS', '500'))
+AI_CHAT_QUEUE_TIMEOUT = float(os.getenv('AI_CHAT_QUEUE_TIMEOUT', '10'))
+AI_CHROMA_THREADS = int(os.getenv('AI_CHROMA_THREADS', '8'))
+# Query embeddings and searches requested within AI_BATCH_WINDOW seconds of each
+# other are sent together (at most AI_BATCH_MAX_SIZE per call).
+AI_BATCH_WINDOW = float(os.getenv('AI_BATCH_WINDOW', '0.005'))
+AI_BATCH_MAX_SIZE = int(os.getenv('AI_BATCH_MAX_SIZE', '64'))
+
+# RAG prompt context: review chunks kept per product and an overall size cap (tokens).
+AI_REVIEW_CHUNKS_PER_PRODUCT = int(os.getenv('AI_REVIEW_CHUNKS_PER_PRODUCT', '2'))
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv('AI_PROMPT_TOKEN_BUDGET', '1500'))
+
+# Chat memory: turns are saved in batches every AI_CHAT_WRITE_DELAY seconds; the
+# prompt gets the last AI_CHAT_HISTORY_TURNS turns plus a rolling summary of older
+# ones, refreshed once AI_CHAT_SUMMARY_EVERY turns have left the window.
+AI_CHAT_HISTORY_TURNS = int(os.getenv('AI_CHAT_HISTORY_TURNS', '6'))
+AI_CHAT_SUMMARY_EVERY = int(os.getenv('AI_CHAT_SUMMARY_EVERY', '10'))
+AI_CHAT_SUMMARY_CHARS = int(os.getenv('AI_CHAT_SUMMARY_CHARS', '1000'))
+AI_CHAT_WRITE_DELAY = float(os.getenv('AI_CHAT_WRITE_DELAY', '0.5'))
+AI_CHAT_WRITE_BATCH = int(os.getenv('AI_CHAT_WRITE_BATCH', '500'))
+
+# Retriever for chat answers: 'chroma', or 'numpy' for the memory-mapped index
+# exported by `manage.py build_numpy_index` (shared read-only across workers).
+# With AI_INDEX_AUTO_UPDATE, each batch of re-indexed products re-exports it.
+AI_RETRIEVER = os.getenv('AI_RETRIEVER', 'chroma')
+AI_NUMPY_INDEX_PATH = os.getenv('AI_NUMPY_INDEX_PATH', str(BASE_DIR.parent / 'numpy_index'))
+
+# Django cache. Worker processes must share it: the catalog caches rely on a product
+# write in one worker retiring the pages, price ranges and typeahead entries cached by
+# every other (see ecomApp/catalog_cache.py), so it is file based, under CACHE_DIR, by
+# default. CACHE_BACKEND=locmem keeps it in each process's memory instead. That is only
+# right for a single process, so catalog page caching is then off unless
+# CATALOG_CACHE_TIMEOUT is set explicitly.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'file')
+CACHE_DIR = os.getenv('CACHE_DIR', str(BASE_DIR.parent / 'django_cache'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    } if CACHE_BACKEND == 'locmem' else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+    },
+}
+CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000'))}
+
+# Rendered product cards and catalog result pages are cached for CATALOG_CACHE_TIMEOUT
+# seconds (0 disables it); writes invalidate them sooner (see ecomApp/catalog_cache.py).
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', '0' if CACHE_BACKEND == 'locmem' else '600'))
+
+# Search box suggestions come from an in-memory prefix index per process, updated by a
+# background thread. It picks up product changes within TYPEAHEAD_REFRESH_INTERVAL
+# seconds and is rebuilt every TYPEAHEAD_REBUILD_INTERVAL seconds.
+TYPEAHEAD_REFRESH_INTERVAL = float(os.getenv('TYPEAHEAD_REFRESH_INTERVAL', '5'))
+TYPEAHEAD_REBUILD_INTERVAL = float(os.getenv('TYPEAHEAD_REBUILD_INTERVAL', '600'))
+
+# Retailer catalog facet counts are computed once per catalog generation and
+# normalized search text, and cached for at most CATALOG_FACETS_TTL seconds.
+CATALOG_FACETS_TTL = int(os.getenv('CATALOG_FACETS_TTL', '120'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
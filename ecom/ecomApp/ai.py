@@ -0,0 +1,155 @@
+"""Lazily created, per-process AI resources.
+
+The provider, the retriever (Chroma or the NumPy index), the embedding cache
+and the Chroma query pool are expensive to create (importing chromadb alone takes
+about a second) and hold file handles, SQLite connections and threads that
+must not be shared across ``fork()``. Nothing is created at import time:
+``get_ai()`` builds them on the first AI request in each process, so a
+pre-forking server (gunicorn ``--preload``) can import the views in the master
+and each worker opens its own clients.
+
+Do not call ``get_ai()`` in a process that will fork workers: chromadb's native
+runtime does not survive ``fork()``, and a child of an initialised parent hangs
+on its first Chroma call.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+# Compute project root (two levels up from this file)
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+CHROMA_PATH = os.path.join(ROOT_DIR, "chroma_db")
+
+
+class AIResources:
+    """Everything the RAG views need that talks to disk, network or threads.
+
+    Retrieval goes through ``retriever``: the Chroma collection, or with
+    ``AI_RETRIEVER=numpy`` the memory-mapped index exported by
+    ``manage.py build_numpy_index``. Chroma itself is only opened when used, so
+    numpy-backed workers that never write to the index do not load it.
+    """
+
+    def __init__(self):
+        from .embedding_cache import EmbeddingCache
+        from .providers import get_provider
+
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self._chroma_client = None
+        self._collection = None
+        self._numpy_index = None
+        # Configured embedding/generation backend
+        self.provider = get_provider(settings.AI_PROVIDER, **settings.AI_PROVIDER_OPTIONS)
+        # Embedding cache shared with embed_data.py (keyed by model, task type and text hash)
+        self.embedding_cache = EmbeddingCache(
+            os.getenv("EMBEDDING_CACHE_PATH", os.path.join(ROOT_DIR, "embedding_cache.sqlite3")),
+            int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000")),
+        )
+        # Chroma's client is synchronous; async views run its queries on this bounded pool
+        self.chroma_executor = ThreadPoolExecutor(
+            max_workers=settings.AI_CHROMA_THREADS, thread_name_prefix="chroma"
+        )
+        # Warm up: load the collection's segment so the first query does not pay for it
+        if self.retriever is not None:
+            self.retriever.count()
+
+    @property
+    def chroma_client(self):
+        """Persistent Chroma client, opened after any fork."""
+        with self.lock:
+            if self._chroma_client is None:
+                from chromadb import PersistentClient
+                self._chroma_client = PersistentClient(path=CHROMA_PATH)
+            return self._chroma_client
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from chromadb.errors import NotFoundError
+            from .indexing import COLLECTION_NAME
+
+            client = self.chroma_client
+            try:
+                collection = client.get_collection(name=COLLECTION_NAME)
+            except (ValueError, NotFoundError):
+                collection = client.create_collection(name=COLLECTION_NAME)
+            self._collection = collection
+        return self._collection
+
+    @property
+    def retriever(self):
+        """Object with ``query(query_embeddings, n_results, where)``; None if there is no index yet."""
+        if settings.AI_RETRIEVER == "numpy":
+            if self._numpy_index is None:
+                from .vector_index import NumpyIndex
+                self._numpy_index = NumpyIndex.open(settings.AI_NUMPY_INDEX_PATH)
+            return self._numpy_index
+        return self.collection
+
+    def index_version(self) -> str:
+        """Version token of the index answers are retrieved from.
+
+        For the numpy backend this also picks up a newly exported generation.
+        """
+        if settings.AI_RETRIEVER == "numpy":
+            from .vector_index import NumpyIndex, manifest_version, read_manifest
+            manifest = read_manifest(settings.AI_NUMPY_INDEX_PATH)
+            if manifest is None:
+                return ""
+            if self._numpy_index is None or self._numpy_index.version != manifest_version(manifest):
+                self._numpy_index = NumpyIndex(settings.AI_NUMPY_INDEX_PATH, manifest)
+            return self._numpy_index.version
+        from .indexing import index_version
+        return index_version(self.chroma_client)
+
+
+_resources = None
+_lock = threading.Lock()
+
+
+def get_ai() -> AIResources:
+    """This process's AI resources, created on first use."""
+    resources = _resources
+    if resources is not None and resources.pid == os.getpid():
+        return resources
+    return _create()
+
+
+def _create() -> AIResources:
+    global _resources
+    with _lock:
+        if _resources is None or _resources.pid != os.getpid():
+            _resources = AIResources()
+        return _resources
+
+
+async def aget_ai() -> AIResources:
+    """``get_ai()`` for async views; the first call builds off the event loop."""
+    if is_ready():
+        return _resources
+    return await asyncio.to_thread(get_ai)
+
+
+def is_ready() -> bool:
+    return _resources is not None and _resources.pid == os.getpid()
+
+
+def warm_up_in_background():
+    """Start creating the resources on a daemon thread unless they already exist."""
+    if not is_ready():
+        threading.Thread(target=get_ai, name="ai-warm-up", daemon=True).start()
+
+
+def _reset_after_fork():
+    # The parent's lock may have been held at fork time and its resources are
+    # not usable here; start the child from a clean slate.
+    global _resources, _lock
+    _resources = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class EcomappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ecomApp'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - connects the index and catalog cache receivers
@@ -0,0 +1,74 @@
+"""Request coalescing for the async chat path.
+
+Concurrent chats each need a query embedding and a vector search. A
+``MicroBatcher`` holds the items submitted within ``window`` seconds (or until
+``max_size`` are waiting) and hands them to one ``handler(items)`` call, whose
+results are returned to the individual callers. One upstream embedding request
+and one multi-query search then serve a burst of chats.
+"""
+import asyncio
+import weakref
+
+
+class MicroBatcher:
+    """Coalesces concurrent ``await submit(item)`` calls into batched ``handler`` calls.
+
+    ``handler`` is an async callable taking a list of items and returning a list
+    of results in the same order. If it raises, every caller in the batch gets
+    the exception. Pending batches are kept per event loop (see ``limits``).
+    """
+
+    def __init__(self, handler, window: float = 0.005, max_size: int = 64):
+        self.handler = handler
+        self.window = window
+        self.max_size = max_size
+        self.pending = weakref.WeakKeyDictionary()
+        self.tasks = set()
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending.get(loop)
+        if batch is None:
+            batch = self.pending[loop] = []
+            loop.call_later(self.window, self.flush, loop, batch)
+        batch.append((item, future))
+        if len(batch) >= self.max_size:
+            self.flush(loop, batch)
+        return await future
+
+    def flush(self, loop, batch):
+        if self.pending.get(loop) is not batch:
+            return  # already sent because it filled up
+        del self.pending[loop]
+        task = loop.create_task(self.run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        self.largest = max(self.largest, len(batch))
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():  # the caller may have gone away
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest,
+            "window": self.window,
+            "max_size": self.max_size,
+        }
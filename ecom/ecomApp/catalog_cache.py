@@ -0,0 +1,88 @@
+"""Versioned caching of rendered catalog HTML.
+
+* Product cards are cached by the ``{% cache %}`` tag under the product's
+  ``cache_version`` (``updated_at`` and its rating totals) and the vendor or
+  category name shown on it, so a card is only re-rendered after that product,
+  its vendor's username or its category's name changes.
+* Whole result pages are cached under the catalog *generation*, a value that
+  is replaced after every committed Product, Feedback or Category write and
+  every vendor rename (see signals.py). A write therefore retires every cached
+  page at once. Cards of unchanged products stay cached and make the re-render
+  cheap.
+* Each vendor's price range (the vendor_products price inputs) is cached
+  until one of their products is saved or deleted.
+* Cached pages must not hold anything per user. Forms in them carry
+  ``CSRF_MARKER``, replaced by the user's CSRF input after the cache lookup.
+
+All of this needs a cache shared by the worker processes (the file cache by
+default, see CACHES in settings.py). With a per-process cache, a write would
+only retire the pages of the worker that handled it.
+
+The generation is a fresh ``time.time_ns()`` rather than an increment, so
+concurrent bumps cannot be lost on backends without atomic ``incr`` (file
+cache), and an evicted generation never comes back with an old value.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = "catalog_generation"
+# Stands in for {% csrf_token %} in cached pages
+CSRF_MARKER = "<!--csrf_token-->"
+
+
+def price_bounds_key(vendor_id) -> str:
+    return f"vendor_price_bounds:{vendor_id}"
+
+
+def catalog_generation() -> int:
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_catalog_generation():
+    """Retires all cached catalog pages once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set(GENERATION_KEY, time.time_ns(), None))
+
+
+def page_cache_key(name: str, params, *parts) -> str:
+    """Key of a rendered page: ``name``, the generation, extra ``parts`` and the sorted GET ``params``."""
+    query = "&".join(f"{key}={value}" for key, value in sorted(params.items()))
+    digest = hashlib.md5(query.encode()).hexdigest()
+    return ":".join(["catalog_page", name, str(catalog_generation()), *map(str, parts), digest])
+
+
+def cached_page(key: str, render):
+    """The page cached under ``key``, or ``render()``'s output, stored for CATALOG_CACHE_TIMEOUT seconds.
+
+    ``render()`` returns the HTML, or a dict holding it with the other values the page needs.
+    """
+    page = cache.get(key)
+    if page is None:
+        page = render()
+        if settings.CATALOG_CACHE_TIMEOUT:
+            cache.set(key, page, settings.CATALOG_CACHE_TIMEOUT)
+    return page
+
+
+def vendor_price_bounds(vendor_id) -> tuple:
+    """``(lowest, highest)`` price among the vendor's products, ``(0, 0)`` without products."""
+    from django.db.models import Max, Min
+    from .models import Product
+
+    def bounds():
+        prices = Product.objects.filter(vendor_id=vendor_id).aggregate(low=Min('price'), high=Max('price'))
+        return prices['low'] or 0, prices['high'] or 0
+
+    return cache.get_or_set(price_bounds_key(vendor_id), bounds, settings.CATALOG_CACHE_TIMEOUT)
+
+
+def forget_vendor_price_bounds(vendor_id):
+    """Drops the vendor's cached price range once the current transaction commits."""
+    transaction.on_commit(lambda: cache.delete(price_bounds_key(vendor_id)))
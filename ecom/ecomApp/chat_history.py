@@ -0,0 +1,213 @@
+"""Persistent chat memory for the AI assistant.
+
+* Turns are queued in memory and written by a background thread in batches
+  (``bulk_create``), so a chat reply never waits on a database write.
+* ``conversation_context`` reads the last ``AI_CHAT_HISTORY_TURNS`` turns with
+  one query on the (user, timestamp) index, plus turns still waiting in the
+  queue, and the user's rolling summary.
+* After each flush, users with at least ``AI_CHAT_SUMMARY_EVERY`` turns that
+  have fallen out of the window get those turns folded into their
+  ``ChatSummary``, so older context survives without growing the prompt.
+  That calls the model, so it runs on a thread of its own (``ChatSummarizer``)
+  and never holds up the writes.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import ChatMessage, ChatSummary
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "Update the summary of a shopping assistant conversation with the new turns below. "
+    "Keep the customer's needs, preferences and the products discussed; drop small talk. "
+    "Answer with the updated summary only, in at most {max_chars} characters.\n\n"
+    "Current summary:\n{summary}\n\nNew turns:\n{turns}"
+)
+
+
+def format_turns(turns) -> str:
+    return "\n".join(
+        f"{'Customer' if turn['sender'] == 'user' else 'Assistant'}: {turn['message']}" for turn in turns
+    )
+
+
+class ChatHistoryWriter:
+    """Queue of unsaved ChatMessage rows drained by a single background worker."""
+
+    def __init__(self, delay: float = 0.5, batch_size: int = 500):
+        self.delay = delay
+        self.batch_size = batch_size
+        self.reset()
+        self.written = 0
+
+    def reset(self):
+        """Forget the parent's worker and lock after ``fork()``."""
+        self.pending = []
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def add(self, user_id, sender: str, message: str, timestamp=None):
+        with self.condition:
+            self.pending.append(ChatMessage(
+                user_id=user_id, sender=sender, message=message, timestamp=timestamp or timezone.now(),
+            ))
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name="chat-history", daemon=True)
+                self.worker.start()
+            self.condition.notify()
+
+    def pending_for(self, user_id) -> list:
+        """Queued, not yet written turns of one user, oldest first."""
+        with self.condition:
+            return [
+                {"sender": m.sender, "message": m.message, "timestamp": m.timestamp}
+                for m in self.pending if m.user_id == user_id
+            ]
+
+    def take_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+        # Let turns from concurrent chats accumulate into one INSERT.
+        time.sleep(self.delay)
+        with self.condition:
+            return self.pending[:self.batch_size]
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            try:
+                self.write(batch)
+            finally:
+                connection.close()
+
+    def write(self, batch):
+        try:
+            ChatMessage.objects.bulk_create(batch)
+            self.written += len(batch)
+        except Exception:
+            logger.exception("Saving %d chat turns failed", len(batch))
+        # Dequeue only after the write, so readers never miss a turn. A failed
+        # batch is logged and dropped rather than retried forever.
+        with self.condition:
+            del self.pending[:len(batch)]
+        chat_summarizer.enqueue({message.user_id for message in batch})
+
+    def flush(self, timeout: float = 5.0):
+        """Waits until every queued turn is written (used by tests and shutdown hooks)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.condition:
+                if not self.pending:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def stats(self) -> dict:
+        return {"pending": len(self.pending), "written": self.written,
+                "summaries_pending": len(chat_summarizer.pending)}
+
+
+class ChatSummarizer:
+    """Set of user ids whose summary may be due, drained by its own worker thread."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget the parent's worker and lock after ``fork()``."""
+        self.pending = set()
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def enqueue(self, user_ids):
+        with self.condition:
+            self.pending.update(user_ids)
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name="chat-summaries", daemon=True)
+                self.worker.start()
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                user_id = self.pending.pop()
+            try:
+                update_summary(user_id)
+            except Exception:
+                logger.exception("Updating the chat summary of user %s failed", user_id)
+            finally:
+                connection.close()
+
+
+def recent_turns(user_id, limit: int) -> list:
+    """The user's last ``limit`` turns, oldest first: saved ones plus those still queued."""
+    saved = list(
+        ChatMessage.objects.filter(user_id=user_id)
+        .order_by('-timestamp')
+        .values('sender', 'message', 'timestamp')[:limit]
+    )
+    turns = saved[::-1] + chat_history_writer.pending_for(user_id)
+    return turns[-limit:]
+
+
+def conversation_context(user_id) -> str:
+    """History block for the prompt: the rolling summary and the recent turns."""
+    turns = recent_turns(user_id, settings.AI_CHAT_HISTORY_TURNS)
+    summary = ChatSummary.objects.filter(user_id=user_id).values_list('summary', flat=True).first()
+    parts = []
+    if summary:
+        parts.append(f"Earlier in this conversation (summary): {summary}")
+    if turns:
+        parts.append(f"Recent turns:\n{format_turns(turns)}")
+    return "\n\n".join(parts)
+
+
+def update_summary(user_id):
+    """Folds turns that fell out of the history window into the user's summary.
+
+    Only turns newer than ``summarized_until`` are read (an index range scan),
+    and nothing happens until ``AI_CHAT_SUMMARY_EVERY`` of them are outside the
+    window, so the model is called once every few turns at most.
+    """
+    window = settings.AI_CHAT_HISTORY_TURNS
+    state = ChatSummary.objects.filter(user_id=user_id).first()
+    turns = ChatMessage.objects.filter(user_id=user_id)
+    if state is not None:
+        turns = turns.filter(timestamp__gt=state.summarized_until)
+    # Bounded read: a backlog larger than this is folded over several flushes.
+    limit = window + 4 * settings.AI_CHAT_SUMMARY_EVERY
+    turns = list(turns.order_by('timestamp').values('sender', 'message', 'timestamp')[:limit])
+    to_fold = turns[:-window] if window else turns
+    if len(to_fold) < settings.AI_CHAT_SUMMARY_EVERY:
+        return
+
+    from .ai import get_ai
+    max_chars = settings.AI_CHAT_SUMMARY_CHARS
+    summary = get_ai().provider.generate(SUMMARY_PROMPT.format(
+        max_chars=max_chars, summary=state.summary if state else "(none)", turns=format_turns(to_fold),
+    )).strip()[:max_chars]
+    ChatSummary.objects.update_or_create(
+        user_id=user_id, defaults={"summary": summary, "summarized_until": to_fold[-1]["timestamp"]},
+    )
+
+
+chat_history_writer = ChatHistoryWriter(
+    delay=settings.AI_CHAT_WRITE_DELAY,
+    batch_size=settings.AI_CHAT_WRITE_BATCH,
+)
+chat_summarizer = ChatSummarizer()
+os.register_at_fork(after_in_child=chat_history_writer.reset)
+os.register_at_fork(after_in_child=chat_summarizer.reset)
+# Write turns still queued when the process exits normally
+atexit.register(chat_history_writer.flush)
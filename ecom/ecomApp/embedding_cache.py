@@ -0,0 +1,129 @@
+"""Persistent embedding cache shared by the indexing job and the chat views.
+
+Vectors are keyed by (model, task_type, sha256 of the text) and stored as
+float32 blobs in a small SQLite file. The cache is size-capped and evicts the
+least recently used entries; use times are only rewritten once they are
+``touch_interval`` seconds old, so a warm cache serves hits without writing.
+This module has no Django dependency so that
+``embed_data.py`` can import it directly.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+
+# Seconds a hit's last_used may lag behind before it is written back
+TOUCH_INTERVAL = 300
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model}|{task_type}|{digest}"
+
+
+def pack(vector) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack(blob: bytes) -> list:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    """Thread-safe, size-capped LRU cache of embedding vectors on disk."""
+
+    def __init__(self, path, max_entries: int = 100_000, touch_interval: float = TOUCH_INTERVAL):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, task_type: str, texts):
+        """Returns a list aligned with ``texts``: cached vectors, or None for misses."""
+        keys = [cache_key(model, task_type, text) for text in texts]
+        found = {}
+        with self.lock:
+            # Stay well below SQLite's bound-parameter limit.
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update((key, (vector, last_used)) for key, vector, last_used in rows)
+            now = time.time()
+            stale = [(now, key) for key, (_, last_used) in found.items() if last_used <= now - self.touch_interval]
+            if stale:
+                self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", stale)
+                self.conn.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [unpack(found[key][0]) if key in found else None for key in keys]
+
+    def get(self, model: str, task_type: str, text: str):
+        return self.get_many(model, task_type, [text])[0]
+
+    def put_many(self, model: str, task_type: str, texts, vectors):
+        rows = [
+            (cache_key(model, task_type, text), pack(vector), time.time())
+            for text, vector in zip(texts, vectors)
+            if vector is not None
+        ]
+        if not rows:
+            return
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self.size += self.conn.total_changes - before
+            if self.size > self.max_entries:
+                self._evict()
+            self.conn.commit()
+
+    def put(self, model: str, task_type: str, text: str, vector):
+        self.put_many(model, task_type, [text], [vector])
+
+    def _evict(self):
+        """Drops the least recently used entries, leaving 10% headroom below the cap."""
+        keep = int(self.max_entries * 0.9)
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (keep,),
+        )
+        self.size = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4),
+            "entries": self.size,
+            "max_entries": self.max_entries,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,152 @@
+"""Facet counts (category, vendor, price and rating bucket) for the retailer catalog.
+
+* One GROUP BY query per search text builds a small "cube": the number of
+  matching products per (category, vendor, price bucket, rating bucket) cell.
+* The cube is cached per catalog generation (see catalog_cache.py) and
+  normalized search text, for at most ``CATALOG_FACETS_TTL`` seconds. Every
+  combination of facet filters is answered from it in Python.
+* Each facet is counted with the *other* facets' filters applied, so a
+  selected category still lists its siblings with their counts.
+"""
+import hashlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+
+from .catalog_cache import catalog_generation
+from .search import TERM_RE, filter_matches
+
+# (key, label, lower bound inclusive, upper bound exclusive)
+PRICE_BUCKETS = [
+    ("0-100", "Under ₹100", None, 100),
+    ("100-250", "₹100 – ₹250", 100, 250),
+    ("250-500", "₹250 – ₹500", 250, 500),
+    ("500-1000", "₹500 – ₹1000", 500, 1000),
+    ("1000+", "₹1000 and above", 1000, None),
+]
+# Bounds on the average rating; unrated products get their own bucket.
+RATING_BUCKETS = [
+    ("4", "4★ and above", 4, None),
+    ("3", "3★ – 4★", 3, 4),
+    ("2", "2★ – 3★", 2, 3),
+    ("1", "Below 2★", None, 2),
+    ("unrated", "Not yet rated", None, None),
+]
+FACETS = ("category", "vendor", "price", "rating")
+
+
+def price_q(key) -> Q:
+    for bucket, _, low, high in PRICE_BUCKETS:
+        if bucket == key:
+            condition = Q()
+            if low is not None:
+                condition &= Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            return condition
+    return Q()
+
+
+def rating_q(key) -> Q:
+    # avg >= x  <=>  rating_sum >= x * rating_count, which keeps this on the product row.
+    for bucket, _, low, high in RATING_BUCKETS:
+        if bucket == key:
+            if bucket == "unrated":
+                return Q(rating_count=0)
+            condition = Q(rating_count__gt=0)
+            if low is not None:
+                condition &= Q(rating_sum__gte=F('rating_count') * low)
+            if high is not None:
+                condition &= Q(rating_sum__lt=F('rating_count') * high)
+            return condition
+    return Q()
+
+
+def parse_filters(params) -> dict:
+    """Selected facet values from request GET parameters; unknown values are ignored."""
+    filters = {}
+    for name in ("category", "vendor"):
+        value = params.get(name, "")
+        if value.isdigit():
+            filters[name] = int(value)
+    if params.get("price") in {bucket for bucket, *_ in PRICE_BUCKETS}:
+        filters["price"] = params["price"]
+    if params.get("rating") in {bucket for bucket, *_ in RATING_BUCKETS}:
+        filters["rating"] = params["rating"]
+    return filters
+
+
+def apply_filters(queryset, filters: dict):
+    if "category" in filters:
+        queryset = queryset.filter(category_id=filters["category"])
+    if "vendor" in filters:
+        queryset = queryset.filter(vendor_id=filters["vendor"])
+    if "price" in filters:
+        queryset = queryset.filter(price_q(filters["price"]))
+    if "rating" in filters:
+        queryset = queryset.filter(rating_q(filters["rating"]))
+    return queryset
+
+
+def build_cube(queryset) -> list:
+    """``(category, vendor, price, rating, names, count)`` cells of ``queryset`` in one query."""
+    cells = (
+        queryset.order_by()
+        .annotate(
+            price_bucket=Case(*[When(price_q(key), then=Value(key)) for key, *_ in PRICE_BUCKETS],
+                              output_field=CharField()),
+            rating_bucket=Case(*[When(rating_q(key), then=Value(key)) for key, *_ in RATING_BUCKETS],
+                               output_field=CharField()),
+        )
+        .values('category_id', 'category__name', 'vendor_id', 'vendor__username', 'price_bucket', 'rating_bucket')
+        .annotate(n=Count('id'))
+    )
+    return [
+        (c['category_id'], c['vendor_id'], c['price_bucket'], c['rating_bucket'],
+         (c['category__name'], c['vendor__username']), c['n'])
+        for c in cells
+    ]
+
+
+def cached_cube(queryset, search_query: str) -> list:
+    """The cube of the products matching ``search_query``, cached per catalog generation and normalized text."""
+    normalized = " ".join(TERM_RE.findall(search_query.lower()))
+    key = f"catalog_facets:{catalog_generation()}:{hashlib.md5(normalized.encode()).hexdigest()}"
+    cube = cache.get(key)
+    if cube is None:
+        matching = filter_matches(queryset, search_query) if normalized else queryset
+        cube = build_cube(matching)
+        cache.set(key, cube, settings.CATALOG_FACETS_TTL)
+    return cube
+
+
+def facet_counts(cube: list, filters: dict) -> dict:
+    """Options per facet, each ``{"value", "label", "count", "selected"}``, counted from ``cube``."""
+    counters = {name: Counter() for name in FACETS}
+    labels = {"category": {}, "vendor": {}}
+    for category, vendor, price, rating, (category_name, vendor_name), n in cube:
+        cell = {"category": category, "vendor": vendor, "price": price, "rating": rating}
+        labels["category"][category] = category_name or "Uncategorised"
+        labels["vendor"][vendor] = vendor_name
+        # A cell counts toward a facet if it passes the filters on all the other facets.
+        missed = [name for name, value in filters.items() if cell[name] != value]
+        if len(missed) > 1:
+            continue
+        for name in missed or FACETS:
+            counters[name][cell[name]] += n
+
+    def options(name, ordered):
+        return [
+            {"value": value, "label": label, "count": counters[name][value],
+             "selected": name in filters and filters[name] == value}
+            for value, label in ordered if counters[name][value]
+        ]
+
+    return {
+        "category": options("category", sorted(labels["category"].items(), key=lambda item: item[1].lower())),
+        "vendor": options("vendor", sorted(labels["vendor"].items(), key=lambda item: item[1].lower())),
+        "price": options("price", [(key, label) for key, label, *_ in PRICE_BUCKETS]),
+        "rating": options("rating", [(key, label) for key, label, *_ in RATING_BUCKETS]),
+    }
@@ -0,0 +1,94 @@
+"""Near-real-time product-profile updates.
+
+Model signals (see ``signals.py``) put affected product ids on a coalescing
+queue. A daemon thread waits ``AI_INDEX_UPDATE_DELAY`` seconds after the first
+id arrives, so a burst of edits to the same product collapses into a single
+entry, then re-indexes the queued ids in batches through ``indexing.sync_products``.
+
+With ``AI_RETRIEVER=numpy`` answers come from an exported copy of the
+collection, so a batch that changed profiles is followed by a full re-export
+(``vector_index.export_collection``). Edits arriving meanwhile queue up and go
+into the next batch, which keeps exports from piling up.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .indexing import sync_products, update_index_metadata
+
+logger = logging.getLogger(__name__)
+
+
+class IndexUpdateQueue:
+    """Set-backed queue of product ids drained by a single background worker."""
+
+    def __init__(self, delay: float = 2.0, batch_size: int = 256):
+        self.delay = delay
+        self.batch_size = batch_size
+        self.pending = set()
+        self.condition = threading.Condition()
+        self.worker = None
+        self.processed = 0
+
+    def reset(self):
+        """Forget the parent's worker and lock after ``fork()``; ids queued there are not ours."""
+        self.pending = set()
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def enqueue(self, product_ids):
+        with self.condition:
+            self.pending.update(product_ids)
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name="index-updates", daemon=True)
+                self.worker.start()
+            self.condition.notify()
+
+    def take_batch(self):
+        """Blocks until ids are queued, lets the coalescing window pass, then pops a batch."""
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+        # Further edits to the same products during the window are absorbed by the set.
+        time.sleep(self.delay)
+        with self.condition:
+            batch = sorted(self.pending)[:self.batch_size]
+            self.pending.difference_update(batch)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            try:
+                self.process(batch)
+            except Exception:
+                logger.exception("Re-indexing products %s failed", batch)
+            finally:
+                connection.close()
+
+    def process(self, product_ids):
+        # Imported here so the queue does not force AI clients to load at startup.
+        from .ai import get_ai
+        from .views import INDEX_VERSION
+
+        ai = get_ai()
+        stats = sync_products(connection, ai.collection, ai.provider, product_ids, ai.embedding_cache)
+        if stats["upserted"] or stats["removed"]:
+            update_index_metadata(ai.chroma_client)
+            if settings.AI_RETRIEVER == "numpy":
+                from .vector_index import export_collection
+                export_collection(ai.collection, settings.AI_NUMPY_INDEX_PATH)
+            INDEX_VERSION.invalidate()
+        self.processed += len(product_ids)
+        logger.info("Re-indexed %d products: %s", len(product_ids), stats)
+
+
+index_update_queue = IndexUpdateQueue(
+    delay=getattr(settings, 'AI_INDEX_UPDATE_DELAY', 2.0),
+    batch_size=getattr(settings, 'AI_INDEX_UPDATE_BATCH', 256),
+)
+os.register_at_fork(after_in_child=index_update_queue.reset)
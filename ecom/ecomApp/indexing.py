@@ -0,0 +1,483 @@
+"""Product-profile indexing pipeline shared by ``embed_data.py`` and the web app.
+
+Rows stream out of the database through hashing and batching into a bounded
+embedding worker pool, and land in the Chroma ``product_profiles`` collection
+in bulk upserts. Functions take a DB-API connection (a plain ``sqlite3``
+connection in the indexing script, ``django.db.connection`` in the app), so
+this module does not require Django to be set up.
+"""
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+# Embedding pipeline tuning (overridable from the embed_data.py command line)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_RATE_LIMIT = float(os.getenv("EMBED_RATE_LIMIT", "10"))  # batch requests per second, 0 = unlimited
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+CHROMA_WRITE_BATCH = int(os.getenv("CHROMA_WRITE_BATCH", "256"))
+FETCH_SIZE = int(os.getenv("EMBED_FETCH_SIZE", "500"))
+EMBED_TASK_TYPE = "retrieval_document"
+COLLECTION_NAME = "product_profiles"
+# Collection metadata key changed whenever profiles are added, updated or removed;
+# answer caches key on it so they never serve results from an older index.
+INDEX_VERSION_KEY = "index_version"
+# Bump when the document or metadata layout changes, so every profile is
+# rewritten on the next sync (vectors come from the embedding cache).
+PROFILE_SCHEMA = 3
+# Reviews are indexed as separate documents of at most REVIEW_CHUNK_CHARS
+# characters, built from each product's REVIEW_LIMIT most recent comments.
+REVIEW_CHUNK_CHARS = int(os.getenv("REVIEW_CHUNK_CHARS", "800"))
+REVIEW_LIMIT = int(os.getenv("REVIEW_LIMIT", "40"))
+# Separates comments in the aggregated review column (ASCII record separator).
+REVIEW_SEPARATOR = "\x1e"
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls at most ``rate`` per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_at)
+            self.next_at = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def embed_batch(provider, texts, limiter: RateLimiter, max_retries: int = EMBED_MAX_RETRIES):
+    """Embeds a list of documents in one API call, retrying with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        limiter.wait()
+        try:
+            return provider.embed(texts, EMBED_TASK_TYPE)
+        except Exception as e:
+            if attempt == max_retries:
+                logger.error("Error generating embeddings for batch of %d: %s", len(texts), e)
+                return None
+            delay = min(30.0, 0.5 * 2 ** attempt) * (1 + random.random() * 0.25)
+            logger.warning("Embedding batch failed (%s); retrying in %.1fs", e, delay)
+            time.sleep(delay)
+
+
+def batched(iterable, size: int):
+    """Yields lists of up to ``size`` items from ``iterable``."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ChromaWriter:
+    """Buffers embedded profiles and upserts them into Chroma in bulk chunks."""
+
+    def __init__(self, collection, chunk_size: int = CHROMA_WRITE_BATCH):
+        self.collection = collection
+        self.chunk_size = chunk_size
+        self.ids, self.documents, self.embeddings, self.metadatas = [], [], [], []
+        self.written = 0
+
+    def add(self, doc_id, document, embedding, metadata):
+        self.ids.append(doc_id)
+        self.documents.append(document)
+        self.embeddings.append(embedding)
+        self.metadatas.append(metadata)
+        if len(self.ids) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.ids:
+            return
+        try:
+            self.collection.upsert(
+                ids=self.ids, documents=self.documents,
+                embeddings=self.embeddings, metadatas=self.metadatas,
+            )
+            self.written += len(self.ids)
+        except Exception as e:
+            logger.error("Error upserting %d documents to ChromaDB: %s", len(self.ids), e)
+        self.ids, self.documents, self.embeddings, self.metadatas = [], [], [], []
+
+
+def embed_and_store(collection, pending, provider, cache=None, batch_size: int = EMBED_BATCH_SIZE,
+                    workers: int = EMBED_WORKERS, rate_limit: float = EMBED_RATE_LIMIT):
+    """Embeds ``(doc_id, document, metadata)`` tuples and upserts them into ``collection``.
+
+    Documents already in ``cache`` are written straight away; the rest are embedded
+    in batches by a bounded worker pool and added to the cache. At most
+    ``2 * workers`` batches are in flight, so ``pending`` may be a lazy iterable of
+    any length. Returns the number of profiles written.
+    """
+    limiter = RateLimiter(rate_limit)
+    writer = ChromaWriter(collection)
+    in_flight = {}
+
+    def drain(return_when):
+        done, _ = wait(in_flight, return_when=return_when)
+        for future in done:
+            batch = in_flight.pop(future)
+            embeddings = future.result()
+            if not embeddings:
+                continue
+            if cache is not None:
+                cache.put_many(provider.embed_model, EMBED_TASK_TYPE, [doc for _, doc, _ in batch], embeddings)
+            for (doc_id, document, metadata), embedding in zip(batch, embeddings):
+                writer.add(doc_id, document, embedding, metadata)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in batched(pending, batch_size):
+            if cache is not None:
+                cached = cache.get_many(provider.embed_model, EMBED_TASK_TYPE, [doc for _, doc, _ in batch])
+                misses = []
+                for item, embedding in zip(batch, cached):
+                    if embedding is None:
+                        misses.append(item)
+                    else:
+                        writer.add(item[0], item[1], embedding, item[2])
+                batch = misses
+                if not batch:
+                    continue
+            if len(in_flight) >= 2 * workers:
+                drain(FIRST_COMPLETED)
+            in_flight[pool.submit(embed_batch, provider, [doc for _, doc, _ in batch], limiter)] = batch
+        while in_flight:
+            drain(FIRST_COMPLETED)
+    writer.flush()
+    return writer.written
+
+
+def content_hash(text: str) -> str:
+    """Stable fingerprint of a profile document, stored alongside it in Chroma."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def profile_id(product_id) -> str:
+    return f"product_profile_{product_id}"
+
+
+def review_chunk_ids(product_id, start: int, stop: int) -> list:
+    return [f"product_reviews_{product_id}_{n}" for n in range(start, stop)]
+
+
+def doc_product_id(doc_id: str, metadata=None) -> int:
+    """Product a stored document belongs to (profiles written before schema 2 have no metadata)."""
+    if metadata and "product_id" in metadata:
+        return int(metadata["product_id"])
+    return int(doc_id.split("_")[2])
+
+
+def profile_hash(document: str, review_chunks=()) -> str:
+    """Hash stored with a profile: covers its document, its review chunks and the schema."""
+    return content_hash("\n".join((f"schema-{PROFILE_SCHEMA}", document, *review_chunks)))
+
+
+def profile_metadata(product, document: str, review_chunks=()) -> dict:
+    """Filterable fields stored with a profile (see ``query_filters.build_where``).
+
+    Vendor and category are lower-cased so filters can match them exactly.
+    ``review_chunks`` records how many review documents belong to the profile.
+    """
+    return {
+        "kind": "profile",
+        "product_id": product['id'],
+        "content_hash": profile_hash(document, review_chunks),
+        "review_chunks": len(review_chunks),
+        "price": float(product['price']),
+        "quantity": int(product['quantity']),
+        "category": (product['category_name'] or "").lower(),
+        "vendor": (product['vendor_username'] or "").lower(),
+        "avg_rating": round(float(product['avg_rating'] or 0), 2),
+    }
+
+
+def build_document(product) -> str:
+    """Builds the profile text for one product row joined with its feedback aggregate."""
+    # Construct the document text, excluding internal IDs.
+    doc_parts = [
+        f"Product Name: {product['name']}",
+        f"Description: {product['description']}",
+        f"Sold by Vendor: {product['vendor_username']}",
+        f"Category: {product['category_name'] or 'N/A'}",
+        f"Price: Rs. {product['price']:.2f}",
+        f"Available Stock: {product['quantity']}"
+    ]
+
+    avg_rating_text = "Not yet rated"
+    if product['avg_rating']:
+        avg_rating = round(product['avg_rating'], 1)
+        avg_rating_text = f"{avg_rating} out of 5 stars"
+    doc_parts.append(f"Average Rating: {avg_rating_text}")
+
+    # Review text is indexed separately (see build_review_chunks) so the
+    # profile stays the same size however many reviews a product collects.
+    review_text = "No reviews yet"
+    if product['review_count']:
+        review_text = f"{product['review_count']} customer reviews"
+    doc_parts.append(f"Customer Reviews: {review_text}")
+
+    return "\n".join(doc_parts)
+
+
+def build_review_chunks(product, max_chars: int = REVIEW_CHUNK_CHARS) -> list:
+    """Packs the product's recent review comments into documents of at most ``max_chars``.
+
+    Each chunk names the product so it can be matched and understood on its own;
+    a single over-long comment is cut to fit.
+    """
+    if not product['recent_reviews']:
+        return []
+    header = f"Customer reviews of {product['name']} (sold by {product['vendor_username']}):"
+    room = max_chars - len(header) - 3
+    chunks, lines, size = [], [], 0
+    for review in product['recent_reviews'].split(REVIEW_SEPARATOR):
+        review = " ".join(review.split())[:room]
+        if lines and size + len(review) + 3 > room:
+            chunks.append("\n- ".join([header, *lines]))
+            lines, size = [], 0
+        lines.append(review)
+        size += len(review) + 3
+    if lines:
+        chunks.append("\n- ".join([header, *lines]))
+    return chunks
+
+
+def review_metadata(profile: dict, chunk: int) -> dict:
+    """A review chunk carries its profile's filter fields, so filtered searches find it too.
+
+    It also keeps the profile's ``content_hash``, which tells ``plan_changes``
+    whether the chunk was written along with the current profile.
+    """
+    metadata = {key: value for key, value in profile.items() if key != "review_chunks"}
+    metadata.update(kind="reviews", chunk=chunk)
+    return metadata
+
+
+# Products (or a selected subset) with their stored rating totals and their
+# latest reviews collected once per product, so no per-row follow-up queries
+# are needed.
+PRODUCTS_QUERY = """
+    {selected_cte}
+    recent_reviews AS (
+        SELECT product_id, GROUP_CONCAT(review, char(30)) as recent_reviews
+        FROM (
+            SELECT
+                product_id,
+                rating || '/5 - ' || comment as review,
+                ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY created_at DESC, id DESC) as rn
+            FROM ecomApp_feedback
+            WHERE {feedback_filter} AND TRIM(comment) != ''
+        )
+        WHERE rn <= {review_limit}
+        GROUP BY product_id
+    )
+    SELECT
+        p.id, p.name, p.description, p.price, p.quantity, p.available, p.updated_at,
+        c.name as category_name,
+        u.username as vendor_username,
+        CAST(p.rating_sum AS REAL) / NULLIF(p.rating_count, 0) as avg_rating,
+        p.rating_count as review_count, r.recent_reviews
+    FROM ecomApp_product p
+    LEFT JOIN ecomApp_category c ON p.category_id = c.id
+    LEFT JOIN ecomApp_customuser u ON p.vendor_id = u.id
+    LEFT JOIN recent_reviews r ON r.product_id = p.id
+    {product_filter}
+    ORDER BY p.id
+"""
+CHANGED_SINCE_CTE = """
+    WITH selected AS (
+        SELECT id FROM ecomApp_product WHERE updated_at >= ?
+        UNION
+        SELECT product_id FROM ecomApp_feedback WHERE created_at >= ?
+    ),
+"""
+SELECTED_FILTERS = {
+    "feedback_filter": "product_id IN (SELECT id FROM selected)",
+    "product_filter": "WHERE p.id IN (SELECT id FROM selected)",
+    "review_limit": REVIEW_LIMIT,
+}
+
+
+def stream_rows(cursor, fetch_size: int = FETCH_SIZE):
+    """Yields rows of an executed query as dicts, ``fetch_size`` at a time."""
+    columns = [col[0] for col in cursor.description]
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(columns, row))
+    cursor.close()
+
+
+def iter_products(conn, products_since=None, feedback_since=None, fetch_size: int = FETCH_SIZE):
+    """Streams products edited, or reviewed, at or after the given watermarks.
+
+    With no watermarks (first run) every product is a candidate. Unavailable and
+    out-of-stock rows are yielded too so that their profiles can be removed.
+    Rows are pulled ``fetch_size`` at a time, so memory does not grow with the catalog.
+    """
+    cursor = conn.cursor()
+    if products_since is None or feedback_since is None:
+        cursor.execute(PRODUCTS_QUERY.format(
+            selected_cte="WITH", feedback_filter="1", product_filter="", review_limit=REVIEW_LIMIT
+        ))
+    else:
+        cursor.execute(
+            PRODUCTS_QUERY.format(selected_cte=CHANGED_SINCE_CTE, **SELECTED_FILTERS),
+            (products_since, feedback_since),
+        )
+    return stream_rows(cursor, fetch_size)
+
+
+def iter_products_by_id(conn, product_ids, fetch_size: int = FETCH_SIZE):
+    """Streams the rows of specific products; ids without a row are simply absent."""
+    product_ids = list(product_ids)
+    placeholders = ",".join("?" * len(product_ids))
+    cursor = conn.cursor()
+    cursor.execute(
+        PRODUCTS_QUERY.format(
+            selected_cte=f"WITH selected AS (SELECT id FROM ecomApp_product WHERE id IN ({placeholders})),",
+            **SELECTED_FILTERS,
+        ),
+        product_ids,
+    )
+    return stream_rows(cursor, fetch_size)
+
+
+def plan_changes(collection, products, stats, chunk_size: int = CHROMA_WRITE_BATCH):
+    """Turns streamed product rows into ``(doc_id, document, metadata)`` work items.
+
+    Each product yields its profile followed by its review chunks. Stored hashes
+    are looked up one chunk of rows at a time; a product is skipped only if its
+    profile and every one of its review chunks were stored with the current
+    hash, so a chunk whose write failed is retried on the next sync. Surplus
+    review chunks from a longer previous version are deleted. Documents of
+    products that are no longer sellable are deleted as they are found.
+    Counters are accumulated in ``stats``.
+    """
+    for chunk in batched(products, chunk_size):
+        ids = [profile_id(product['id']) for product in chunk]
+        existing = collection.get(ids=ids, include=["metadatas"])
+        stored = {doc_id: meta or {} for doc_id, meta in zip(existing["ids"], existing["metadatas"])}
+        stats["checked"] += len(chunk)
+
+        to_delete = []
+        planned = []
+        for product, doc_id in zip(chunk, ids):
+            previous = stored.get(doc_id)
+            old_chunks = (previous or {}).get("review_chunks", 0)
+            if not product['available'] or product['quantity'] <= 0:
+                if previous is not None:
+                    to_delete.append(doc_id)
+                    to_delete.extend(review_chunk_ids(product['id'], 0, old_chunks))
+                continue
+
+            doc_text = build_document(product)
+            reviews = build_review_chunks(product)
+            metadata = profile_metadata(product, doc_text, reviews)
+            review_ids = review_chunk_ids(product['id'], 0, len(reviews))
+            unchanged = (previous or {}).get("content_hash") == metadata["content_hash"]
+            planned.append((doc_id, doc_text, metadata, review_ids, reviews, unchanged))
+            to_delete.extend(review_chunk_ids(product['id'], len(reviews), old_chunks))
+
+        # Review chunks carry the hash of the profile they were written with.
+        expected = {review_id: metadata["content_hash"]
+                    for _, _, metadata, review_ids, _, unchanged in planned if unchanged
+                    for review_id in review_ids}
+        current = set()
+        if expected:
+            found = collection.get(ids=list(expected), include=["metadatas"])
+            current = {review_id for review_id, meta in zip(found["ids"], found["metadatas"])
+                       if (meta or {}).get("content_hash") == expected[review_id]}
+
+        for doc_id, doc_text, metadata, review_ids, reviews, unchanged in planned:
+            if unchanged and current.issuperset(review_ids):
+                stats["unchanged"] += 1
+                continue
+            stats["pending"] += 1 + len(reviews)
+            yield doc_id, doc_text, metadata
+            for n, (review_id, review_text) in enumerate(zip(review_ids, reviews)):
+                yield review_id, review_text, review_metadata(metadata, n)
+
+        if to_delete:
+            collection.delete(ids=to_delete)
+            stats["removed"] += len(to_delete)
+
+
+def new_stats() -> dict:
+    return {"checked": 0, "unchanged": 0, "pending": 0, "removed": 0}
+
+
+def sync_products(conn, collection, provider, product_ids, cache=None, **pipeline_options):
+    """Re-indexes just ``product_ids``: upserts changed profiles, removes gone ones.
+
+    Products that were deleted outright (no row any more) have their profile
+    removed as well. Returns the stats dict with an extra ``upserted`` count.
+    """
+    product_ids = sorted(set(product_ids))
+    stats = new_stats()
+    stats["upserted"] = 0
+    for chunk in batched(product_ids, CHROMA_WRITE_BATCH):
+        seen = set()
+
+        def rows():
+            for product in iter_products_by_id(conn, chunk):
+                seen.add(product['id'])
+                yield product
+
+        stats["upserted"] += embed_and_store(
+            collection, plan_changes(collection, rows(), stats), provider, cache, **pipeline_options
+        )
+        missing = [pid for pid in chunk if pid not in seen]
+        if missing:
+            stats["removed"] += delete_products(collection, missing)
+    return stats
+
+
+def delete_products(collection, product_ids) -> int:
+    """Removes every document (profile and review chunks) of ``product_ids``."""
+    product_ids = list(product_ids)
+    doc_ids = [profile_id(pid) for pid in product_ids]
+    doc_ids += collection.get(where={"product_id": {"$in": product_ids}}, include=[])["ids"]
+    doc_ids = list(dict.fromkeys(doc_ids))
+    found = collection.get(ids=doc_ids, include=[])["ids"]
+    if found:
+        collection.delete(ids=found)
+    return len(found)
+
+
+def index_version(client) -> str:
+    """Current version token of the profile collection ("" if never bumped)."""
+    metadata = client.get_collection(name=COLLECTION_NAME).metadata or {}
+    return metadata.get(INDEX_VERSION_KEY, "")
+
+
+def update_index_metadata(client, bump_version: bool = True, **values):
+    """Merges ``values`` into the collection metadata, optionally with a new version token.
+
+    Chroma replaces collection metadata wholesale, so the current metadata is
+    re-read from the client (other processes may have changed it) and merged.
+    """
+    collection = client.get_collection(name=COLLECTION_NAME)
+    metadata = dict(collection.metadata or {})
+    metadata.update(values)
+    if bump_version:
+        metadata[INDEX_VERSION_KEY] = f"{time.time():.6f}"
+    collection.modify(metadata=metadata)
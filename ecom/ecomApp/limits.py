@@ -0,0 +1,45 @@
+"""Global concurrency limit for the async AI chat endpoint."""
+import asyncio
+import weakref
+
+
+class LimiterBusy(Exception):
+    """Raised when no chat slot frees up within the limiter's timeout."""
+
+
+class ConcurrencyLimiter:
+    """Caps in-flight chats per process; callers wait up to ``timeout`` seconds for a slot.
+
+    Under ASGI there is one event loop per worker and so one semaphore. Under
+    WSGI Django runs each async view in its own loop, so semaphores are kept per
+    loop rather than shared across them.
+    """
+
+    def __init__(self, limit: int, timeout: float):
+        self.limit = limit
+        self.timeout = timeout
+        self.semaphores = weakref.WeakKeyDictionary()
+        self.active = 0
+        self.rejected = 0
+
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self.semaphores[loop] = asyncio.Semaphore(self.limit)
+        return semaphore
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self.semaphore().acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise LimiterBusy(f"more than {self.limit} chats in progress")
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.semaphore().release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "active": self.active, "rejected": self.rejected}
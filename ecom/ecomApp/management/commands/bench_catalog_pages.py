@@ -0,0 +1,101 @@
+"""Measure browse_products latency with and without the catalog fragment cache."""
+import random
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+
+from ecomApp.catalog_cache import GENERATION_KEY
+from ecomApp.models import Category, CustomUser, Product
+
+WORDS = ["toor", "moong", "basmati", "atta", "besan", "mustard", "turmeric", "chilli", "jaggery",
+         "tea", "poha", "ghee", "loose", "premium", "organic", "classic", "family", "pack", "dal", "rice"]
+NEXT_LINK = re.compile(r'href="\?cursor=([^"&]+)[^"]*">Next<')
+
+
+class Command(BaseCommand):
+    help = ("Renders catalog pages over N synthetic products (rolled back afterwards) with the cache "
+            "disabled, warm, and right after a catalog write; reports p50/p99 latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--vendors", type=int, default=50)
+        parser.add_argument("--rounds", type=int, default=10, help="Passes over the page list per mode.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            client = self.populate(options)
+            urls = self.page_urls(client)
+            self.stdout.write(f"{options['products']} products, {len(urls)} distinct pages x {options['rounds']} rounds")
+            self.stdout.write(f"{'mode':<22} {'p50 ms':>8} {'p99 ms':>8}")
+
+            with override_settings(CATALOG_CACHE_TIMEOUT=0):
+                cache.clear()
+                self.report("uncached", client, urls, options["rounds"])
+            cache.clear()
+            self.time_pages(client, urls, 1)  # warm up
+            self.report("cached", client, urls, options["rounds"])
+
+            def after_write():
+                # What a product or feedback save does: pages expire, cards of untouched products stay
+                cache.set(GENERATION_KEY, time.time_ns(), None)
+            self.report("after each write", client, urls, options["rounds"], before_each=after_write)
+            transaction.set_rollback(True)
+        cache.clear()
+
+    def populate(self, options):
+        rng = random.Random(0)
+        categories = [Category.objects.create(name=f"bench-category-{i}") for i in range(8)]
+        vendors = [
+            CustomUser.objects.create(username=f"bench-vendor-{i}", is_vendor=True)
+            for i in range(options["vendors"])
+        ]
+        retailer = CustomUser.objects.create(username="bench-retailer", is_retailer=True)
+        Product.objects.bulk_create([
+            Product(
+                vendor=rng.choice(vendors), category=rng.choice(categories),
+                name=" ".join(rng.sample(WORDS, 3)), description=" ".join(rng.choices(WORDS, k=20)),
+                price=rng.randint(20, 1500), quantity=rng.randint(1, 500),
+                rating_count=(count := rng.randint(0, 40)), rating_sum=count * rng.randint(1, 5),
+            )
+            for _ in range(options["products"])
+        ], batch_size=1000)
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        client.force_login(retailer)
+        return client
+
+    def page_urls(self, client):
+        """First pages of a few listings plus the next pages reached by following cursors."""
+        urls = []
+        for start in ["/retailer/products/", "/retailer/products/?search=dal", "/retailer/products/?search=organic+tea",
+                      "/retailer/products/?price=100-250", "/retailer/products/?rating=4"]:
+            url = start
+            for _ in range(4):
+                urls.append(url)
+                match = NEXT_LINK.search(client.get(url).content.decode())
+                if match is None:
+                    break
+                url = f"{start}{'&' if '?' in start else '?'}cursor={match.group(1)}"
+        return urls
+
+    def time_pages(self, client, urls, rounds, before_each=None):
+        timings = []
+        for _ in range(rounds):
+            for url in urls:
+                if before_each:
+                    before_each()
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200, (url, response.status_code)
+        return timings
+
+    def report(self, mode, client, urls, rounds, before_each=None):
+        timings = self.time_pages(client, urls, rounds, before_each)
+        p99 = statistics.quantiles(timings, n=100, method="inclusive")[98]
+        self.stdout.write(f"{mode:<22} {statistics.median(timings):8.2f} {p99:8.2f}")
@@ -0,0 +1,120 @@
+"""Compare the Chroma and memory-mapped NumPy retrievers on a synthetic catalog."""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from ecomApp.indexing import COLLECTION_NAME, profile_id
+
+CATEGORIES = ["rice", "dal", "oil", "spices", "flour", "snacks", "sugar", "tea"]
+
+
+def read_rss():
+    """VmRSS split into private (anon) and file-backed (page cache, shareable) MB."""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                values[key] = int(rest.split()[0]) / 1024
+    return values
+
+
+class Command(BaseCommand):
+    help = "Builds both retrievers over N random profiles and reports build time, RSS and query latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=20000)
+        parser.add_argument("--dimensions", type=int, default=768)
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--n-results", type=int, default=5)
+        parser.add_argument("--keep", action="store_true", help="Keep the generated indexes.")
+        # Internal: run the query loop for one backend in a fresh process.
+        parser.add_argument("--worker", choices=["chroma", "numpy"])
+        parser.add_argument("--dir")
+
+    def handle(self, *args, **options):
+        if options["worker"]:
+            return self.worker(options)
+
+        workdir = options["dir"] or tempfile.mkdtemp(prefix="bench_retrievers_")
+        try:
+            builds = self.build(workdir, options)
+            self.stdout.write(
+                f"{options['products']} profiles x {options['dimensions']} dims: "
+                f"chroma build {builds['chroma']:.1f}s, numpy export {builds['numpy']:.1f}s"
+            )
+            self.stdout.write(f"{'backend':<8} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8} {'anon MB':>8} {'file MB':>8}")
+            for backend in ("chroma", "numpy"):
+                out = subprocess.run(
+                    [sys.executable, sys.argv[0], "bench_retrievers", "--worker", backend, "--dir", workdir,
+                     "--queries", str(options["queries"]), "--n-results", str(options["n_results"]),
+                     "--dimensions", str(options["dimensions"])],
+                    capture_output=True, text=True, check=True,
+                ).stdout
+                r = json.loads(out.strip().splitlines()[-1])
+                self.stdout.write(
+                    f"{backend:<8} {r['p50']:8.2f} {r['p99']:8.2f} {r['rss']['VmRSS']:8.0f} "
+                    f"{r['rss']['RssAnon']:8.0f} {r['rss'].get('RssFile', 0):8.0f}"
+                )
+            self.stdout.write("file-backed pages of the numpy index are shared by every worker on the host.")
+        finally:
+            if not options["keep"]:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    def build(self, workdir, options):
+        from chromadb import PersistentClient
+        from ecomApp.vector_index import export_collection
+
+        rng = np.random.default_rng(0)
+        count, dims = options["products"], options["dimensions"]
+        client = PersistentClient(path=os.path.join(workdir, "chroma"))
+        collection = client.create_collection(name=COLLECTION_NAME)
+
+        started = time.perf_counter()
+        for start in range(0, count, 5000):
+            ids = range(start, min(start + 5000, count))
+            collection.add(
+                ids=[profile_id(i) for i in ids],
+                embeddings=rng.standard_normal((len(ids), dims), dtype=np.float32),
+                documents=[f"Product Name: product {i}\nCategory: {CATEGORIES[i % len(CATEGORIES)]}" for i in ids],
+                metadatas=[{
+                    "product_id": i, "price": float(rng.integers(10, 1000)), "quantity": int(rng.integers(0, 500)),
+                    "category": CATEGORIES[i % len(CATEGORIES)], "vendor": f"vendor{i % 50}",
+                    "avg_rating": round(float(rng.uniform(0, 5)), 2),
+                } for i in ids],
+            )
+        chroma_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        export_collection(collection, os.path.join(workdir, "numpy"))
+        return {"chroma": chroma_seconds, "numpy": time.perf_counter() - started}
+
+    def worker(self, options):
+        workdir = options["dir"]
+        if options["worker"] == "chroma":
+            from chromadb import PersistentClient
+            retriever = PersistentClient(path=os.path.join(workdir, "chroma")).get_collection(COLLECTION_NAME)
+        else:
+            from ecomApp.vector_index import NumpyIndex
+            retriever = NumpyIndex.open(os.path.join(workdir, "numpy"))
+
+        rng = np.random.default_rng(1)
+        queries = rng.standard_normal((options["queries"], options["dimensions"]), dtype=np.float32)
+        retriever.query(query_embeddings=[queries[0]], n_results=options["n_results"])  # warm up
+        latencies = []
+        for i, query in enumerate(queries):
+            # Every fourth query carries a filter, as chat questions with constraints do.
+            where = {"$and": [{"price": {"$lte": 300.0}}, {"category": "dal"}]} if i % 4 == 0 else None
+            started = time.perf_counter()
+            retriever.query(query_embeddings=[query], n_results=options["n_results"], where=where)
+            latencies.append((time.perf_counter() - started) * 1000)
+        cuts = statistics.quantiles(latencies, n=100)
+        self.stdout.write(json.dumps({"p50": cuts[49], "p99": cuts[98], "rss": read_rss()}))
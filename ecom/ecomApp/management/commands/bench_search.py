@@ -0,0 +1,133 @@
+"""Compare the old LIKE search with the FTS5 index on a synthetic catalog."""
+import importlib
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecomApp.search import FTS_TABLE, match_expression
+
+WORDS = [
+    "toor", "moong", "urad", "chana", "masoor", "basmati", "sona", "masoori", "atta", "maida",
+    "besan", "sooji", "mustard", "groundnut", "sunflower", "coconut", "turmeric", "chilli",
+    "coriander", "cumin", "garam", "masala", "jaggery", "sugar", "salt", "tea", "coffee",
+    "poha", "rava", "ghee", "loose", "premium", "organic", "classic", "family", "pack",
+]
+CATEGORIES = ["dal", "rice", "flour", "oil", "spices", "sweeteners", "beverages", "staples"]
+QUERIES = ["dal", "toor dal", "basmati rice", "organic turmeric powder", "mus", "vendor_42", "zzz"]
+PAGE_SIZE = 9
+
+SCHEMA = [
+    "CREATE TABLE ecomApp_category (id INTEGER PRIMARY KEY, name TEXT NOT NULL)",
+    "CREATE TABLE ecomApp_customuser (id INTEGER PRIMARY KEY, username TEXT NOT NULL)",
+    """CREATE TABLE ecomApp_product (
+        id INTEGER PRIMARY KEY, vendor_id INTEGER NOT NULL, category_id INTEGER,
+        name TEXT NOT NULL, description TEXT NOT NULL, available BOOL NOT NULL, quantity INTEGER NOT NULL
+    )""",
+]
+
+LIKE_WHERE = """
+    FROM ecomApp_product p
+    LEFT JOIN ecomApp_category c ON c.id = p.category_id
+    JOIN ecomApp_customuser u ON u.id = p.vendor_id
+    WHERE p.available AND p.quantity > 0
+      AND (p.name LIKE :q OR p.description LIKE :q OR c.name LIKE :q OR u.username LIKE :q)
+"""
+FTS_WHERE = f"""
+    FROM ecomApp_product p JOIN {FTS_TABLE} ON {FTS_TABLE}.rowid = p.id
+    WHERE p.available AND p.quantity > 0 AND {FTS_TABLE} MATCH :q
+"""
+
+
+class Command(BaseCommand):
+    help = "Builds an N-product SQLite catalog and reports LIKE vs FTS5 search latency (count + first page)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1_000_000)
+        parser.add_argument("--vendors", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=5, help="Runs of each query per backend.")
+
+    def handle(self, *args, **options):
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_search_"), "catalog.sqlite3")
+        db = sqlite3.connect(path)
+        try:
+            self.populate(db, options)
+            size = os.path.getsize(path)
+            migration = importlib.import_module("ecomApp.migrations.0006_product_search")
+            start = time.perf_counter()
+            for statement in migration.CREATE_SQL:
+                db.execute(statement)
+            db.commit()
+            build = time.perf_counter() - start
+            self.stdout.write(
+                f"{options['products']} products: FTS build {build:.1f}s, "
+                f"DB {size / 2**20:.0f} MB -> {os.path.getsize(path) / 2**20:.0f} MB"
+            )
+            self.stdout.write(self.write_cost(db))
+
+            self.stdout.write(f"{'query':<26} {'matches':>8} {'LIKE p50':>9} {'LIKE p99':>9} {'FTS p50':>9} {'FTS p99':>9}")
+            for query in QUERIES:
+                like_count, like = self.time_query(
+                    db, LIKE_WHERE, "", {"q": f"%{query}%"}, options["repeat"])
+                fts_count, fts = self.time_query(
+                    db, FTS_WHERE, f"ORDER BY {FTS_TABLE}.rank", {"q": match_expression(query)}, options["repeat"])
+                self.stdout.write(
+                    f"{query:<26} {fts_count:>8} {self.p(like, 50):9.1f} {self.p(like, 99):9.1f} "
+                    f"{self.p(fts, 50):9.1f} {self.p(fts, 99):9.1f}"
+                    + (f"  (LIKE matched {like_count})" if like_count != fts_count else "")
+                )
+            self.stdout.write("Latencies in ms. LIKE matches substrings anywhere, FTS matches word prefixes.")
+        finally:
+            db.close()
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+
+    def populate(self, db, options):
+        rng = random.Random(0)
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.executemany("INSERT INTO ecomApp_category VALUES (?, ?)", enumerate(CATEGORIES, 1))
+        db.executemany(
+            "INSERT INTO ecomApp_customuser VALUES (?, ?)",
+            ((i, f"vendor_{i}") for i in range(1, options["vendors"] + 1)),
+        )
+
+        def rows():
+            for i in range(1, options["products"] + 1):
+                category = rng.randrange(len(CATEGORIES))
+                name = " ".join(rng.sample(WORDS, 2) + [CATEGORIES[category]])
+                description = " ".join(rng.choices(WORDS, k=12))
+                yield (i, rng.randint(1, options["vendors"]), category + 1, name, description,
+                       rng.random() > 0.05, rng.randint(0, 500))
+
+        db.executemany("INSERT INTO ecomApp_product VALUES (?, ?, ?, ?, ?, ?, ?)", rows())
+        db.commit()
+
+    def write_cost(self, db):
+        """Time of updating product names with the sync triggers in place."""
+        ids = list(range(1, 1001))
+        start = time.perf_counter()
+        db.executemany("UPDATE ecomApp_product SET name = name || ' x' WHERE id = ?", ((i,) for i in ids))
+        db.commit()
+        elapsed = (time.perf_counter() - start) / len(ids) * 1000
+        return f"index upkeep: {elapsed:.3f} ms per product name update (trigger included)"
+
+    def time_query(self, db, where, order, params, repeat):
+        """What the browse page runs: the paginator's COUNT, then the first page."""
+        timings, count = [], 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = db.execute(f"SELECT COUNT(*) {where}", params).fetchone()[0]
+            db.execute(f"SELECT p.id, p.name {where} {order} LIMIT {PAGE_SIZE}", params).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        return count, timings
+
+    @staticmethod
+    def p(timings, percentile):
+        if len(timings) < 2:
+            return timings[0]
+        return statistics.quantiles(timings, n=100, method="inclusive")[percentile - 1]
@@ -0,0 +1,49 @@
+"""Measure how long a fresh process takes to import the views, with and without AI init."""
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SCRIPT = """
+import os, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ecom.settings")
+started = time.perf_counter()
+import django
+django.setup()
+import ecomApp.views
+imported = time.perf_counter()
+if {init_ai}:
+    from ecomApp.ai import get_ai
+    get_ai()
+print(imported - started, time.perf_counter() - started)
+"""
+
+
+class Command(BaseCommand):
+    help = "Times `import ecomApp.views` in fresh interpreters, and the first get_ai() call after it."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+
+    def handle(self, *args, **options):
+        imports, totals = [], []
+        for _ in range(options["runs"]):
+            imports.append(self.run_once(init_ai=False)[0])
+            totals.append(self.run_once(init_ai=True)[1])
+        self.report("import ecomApp.views", imports)
+        self.report("import + get_ai()", totals)
+
+    def run_once(self, init_ai):
+        out = subprocess.run(
+            [sys.executable, "-c", SCRIPT.format(init_ai=init_ai)],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        return [float(value) for value in out.split()[-2:]]
+
+    def report(self, label, samples):
+        self.stdout.write(
+            f"{label:<22} mean {statistics.mean(samples) * 1000:7.1f} ms   "
+            f"median {statistics.median(samples) * 1000:7.1f} ms   ({len(samples)} runs)"
+        )
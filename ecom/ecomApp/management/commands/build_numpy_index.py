@@ -0,0 +1,24 @@
+"""Export the Chroma profile collection to the memory-mapped NumPy index."""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ecomApp.ai import get_ai
+from ecomApp.vector_index import export_collection
+
+
+class Command(BaseCommand):
+    help = "Writes the product-profile collection to AI_NUMPY_INDEX_PATH for AI_RETRIEVER=numpy."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default=settings.AI_NUMPY_INDEX_PATH)
+        parser.add_argument("--page-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        manifest = export_collection(get_ai().collection, options["path"], options["page_size"])
+        self.stdout.write(
+            f"Exported {manifest['count']} profiles to {options['path']} "
+            f"(generation {manifest['generation']}) in {time.perf_counter() - started:.1f}s."
+        )
@@ -0,0 +1,37 @@
+"""Recompute Product.rating_sum / rating_count from the feedback table."""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from ecomApp.models import Feedback, Product
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-product rating totals from Feedback, or with --check only reports drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Report mismatches without fixing them.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            actual = {
+                row["product"]: (row["total"], row["count"])
+                for row in Feedback.objects.order_by().values("product").annotate(total=Sum("rating"), count=Count("id"))
+            }
+            stale = []
+            for product in Product.objects.select_for_update().only("id", "rating_sum", "rating_count").iterator():
+                expected = actual.get(product.id, (0, 0))
+                if (product.rating_sum, product.rating_count) != expected:
+                    product.rating_sum, product.rating_count = expected
+                    stale.append(product)
+
+            if options["check"]:
+                for product in stale:
+                    self.stdout.write(f"product {product.id}: expected sum={product.rating_sum} count={product.rating_count}")
+                if stale:
+                    raise CommandError(f"{len(stale)} product(s) have stale rating totals.")
+                self.stdout.write("Rating totals are consistent.")
+                return
+
+            Product.objects.bulk_update(stale, ["rating_sum", "rating_count"], batch_size=500)
+        self.stdout.write(f"Fixed rating totals of {len(stale)} product(s).")
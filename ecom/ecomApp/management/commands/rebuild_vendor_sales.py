@@ -0,0 +1,60 @@
+"""Backfill or repair the daily vendor sales rollups from the order tables."""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ecomApp.models import VendorDailySales, VendorProductDailySales
+from ecomApp.sales_rollup import computed_totals
+
+VENDOR_FIELDS = ("orders", "units", "revenue", "pending_orders")
+PRODUCT_FIELDS = ("orders", "units", "revenue")
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily vendor sales rollups from the order items, or with --check only reports drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Report mismatches without fixing them.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            vendor_days, product_days = computed_totals()
+            changes = [
+                self.diff(VendorDailySales, ("vendor_id", "day"), VENDOR_FIELDS, vendor_days),
+                self.diff(VendorProductDailySales, ("vendor_id", "day", "product_id"), PRODUCT_FIELDS, product_days),
+            ]
+            stale = sum(len(missing) + len(wrong) + len(extra) for _, _, missing, wrong, extra in changes)
+
+            if options["check"]:
+                for model, _, missing, wrong, extra in changes:
+                    for problem, rows in (("missing", missing), ("wrong", wrong), ("extra", extra)):
+                        for row in rows:
+                            self.stdout.write(f"{model.__name__} vendor {row.vendor_id} {row.day}: {problem}")
+                if stale:
+                    raise CommandError(f"{stale} rollup row(s) are stale.")
+                self.stdout.write("Sales rollups are consistent.")
+                return
+
+            for model, fields, missing, wrong, extra in changes:
+                model.objects.filter(pk__in=[row.pk for row in extra]).delete()
+                model.objects.bulk_update(wrong, fields, batch_size=500)
+                model.objects.bulk_create(missing, batch_size=500)
+        self.stdout.write(f"Fixed {stale} sales rollup row(s).")
+
+    def diff(self, model, keys, fields, expected: dict):
+        """``(model, fields, missing, wrong, extra)``: rows to create, to update (already corrected) and to delete."""
+        missing, wrong, extra = [], [], []
+        seen = set()
+        for row in model.objects.select_for_update().iterator():
+            key = tuple(getattr(row, name) for name in keys)
+            seen.add(key)
+            values = expected.get(key)
+            if values is None:
+                extra.append(row)
+            elif tuple(getattr(row, name) for name in fields) != values:
+                for name, value in zip(fields, values):
+                    setattr(row, name, value)
+                wrong.append(row)
+        for key, values in expected.items():
+            if key not in seen:
+                missing.append(model(**dict(zip(keys, key)), **dict(zip(fields, values))))
+        return model, fields, missing, wrong, extra
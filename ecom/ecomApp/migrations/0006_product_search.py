@@ -0,0 +1,106 @@
+# Full-text index over product name, description, category and vendor (SQLite FTS5).
+# Triggers keep it in sync with every write, whether from the ORM, bulk updates or raw SQL.
+
+from django.db import migrations
+
+TABLE_SQL = [
+    """
+    CREATE VIRTUAL TABLE ecomApp_product_fts USING fts5(
+        name, description, category, vendor,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    # Default ranking for ORDER BY rank: bm25 with name matches weighted highest,
+    # then category and vendor, then description.
+    """
+    INSERT INTO ecomApp_product_fts (ecomApp_product_fts, rank)
+    VALUES ('rank', 'bm25(10.0, 1.0, 4.0, 4.0)')
+    """,
+]
+
+# SQLite cannot rebuild ecomApp_product (as AlterField/AddField do) while the category and
+# user triggers reference it: such migrations drop TRIGGERS_SQL first and recreate it after.
+# 0010 replaces those two triggers with post_save receivers.
+TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER ecomApp_product_fts_insert AFTER INSERT ON ecomApp_product BEGIN
+        INSERT INTO ecomApp_product_fts (rowid, name, description, category, vendor)
+        SELECT new.id, new.name, new.description,
+               (SELECT name FROM ecomApp_category WHERE id = new.category_id),
+               (SELECT username FROM ecomApp_customuser WHERE id = new.vendor_id);
+    END
+    """,
+    # Product.save() writes every column; only re-index when a searched one changed.
+    """
+    CREATE TRIGGER ecomApp_product_fts_update AFTER UPDATE ON ecomApp_product
+    WHEN old.name IS NOT new.name OR old.description IS NOT new.description
+      OR old.category_id IS NOT new.category_id OR old.vendor_id IS NOT new.vendor_id
+    BEGIN
+        DELETE FROM ecomApp_product_fts WHERE rowid = old.id;
+        INSERT INTO ecomApp_product_fts (rowid, name, description, category, vendor)
+        SELECT new.id, new.name, new.description,
+               (SELECT name FROM ecomApp_category WHERE id = new.category_id),
+               (SELECT username FROM ecomApp_customuser WHERE id = new.vendor_id);
+    END
+    """,
+    """
+    CREATE TRIGGER ecomApp_product_fts_delete AFTER DELETE ON ecomApp_product BEGIN
+        DELETE FROM ecomApp_product_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER ecomApp_category_fts_update AFTER UPDATE OF name ON ecomApp_category BEGIN
+        UPDATE ecomApp_product_fts SET category = new.name
+        WHERE rowid IN (SELECT id FROM ecomApp_product WHERE category_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER ecomApp_customuser_fts_update AFTER UPDATE OF username ON ecomApp_customuser BEGIN
+        UPDATE ecomApp_product_fts SET vendor = new.username
+        WHERE rowid IN (SELECT id FROM ecomApp_product WHERE vendor_id = new.id);
+    END
+    """,
+]
+
+BACKFILL_SQL = [
+    """
+    INSERT INTO ecomApp_product_fts (rowid, name, description, category, vendor)
+    SELECT p.id, p.name, p.description, c.name, u.username
+    FROM ecomApp_product p
+    LEFT JOIN ecomApp_category c ON c.id = p.category_id
+    LEFT JOIN ecomApp_customuser u ON u.id = p.vendor_id
+    """,
+]
+
+CREATE_SQL = TABLE_SQL + TRIGGERS_SQL + BACKFILL_SQL
+
+DROP_TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS ecomApp_customuser_fts_update",
+    "DROP TRIGGER IF EXISTS ecomApp_category_fts_update",
+    "DROP TRIGGER IF EXISTS ecomApp_product_fts_delete",
+    "DROP TRIGGER IF EXISTS ecomApp_product_fts_update",
+    "DROP TRIGGER IF EXISTS ecomApp_product_fts_insert",
+]
+
+DROP_SQL = DROP_TRIGGERS_SQL + ["DROP TABLE IF EXISTS ecomApp_product_fts"]
+
+
+def run_on_sqlite(statements):
+    # Other databases keep using the icontains search (see ecomApp/search.py).
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomApp', '0005_chat_history'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_SQL), run_on_sqlite(DROP_SQL)),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:26
+
+import importlib
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+product_search = importlib.import_module('ecomApp.migrations.0006_product_search')
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('ecomApp', 'Product')
+    Feedback = apps.get_model('ecomApp', 'Feedback')
+    totals = Feedback.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    Product.objects.update(
+        rating_sum=Coalesce(Subquery(totals.annotate(total=Sum('rating')).values('total')), 0),
+        rating_count=Coalesce(Subquery(totals.annotate(total=Count('id')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomApp', '0007_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            product_search.run_on_sqlite(product_search.DROP_TRIGGERS_SQL),
+            product_search.run_on_sqlite(product_search.TRIGGERS_SQL),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(
+            product_search.run_on_sqlite(product_search.TRIGGERS_SQL),
+            product_search.run_on_sqlite(product_search.DROP_TRIGGERS_SQL),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
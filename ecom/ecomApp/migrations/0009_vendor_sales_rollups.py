@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    OrderItem = apps.get_model('ecomApp', 'OrderItem')
+    VendorDailySales = apps.get_model('ecomApp', 'VendorDailySales')
+    VendorProductDailySales = apps.get_model('ecomApp', 'VendorProductDailySales')
+    items = OrderItem.objects.filter(vendor__isnull=False).annotate(day=TruncDate('order__created_at')).order_by()
+    totals = {
+        'orders': Count('order', distinct=True),
+        'units': Sum('quantity'),
+        'revenue': Sum(F('quantity') * F('price_at_order_time'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+    }
+    VendorDailySales.objects.bulk_create([
+        VendorDailySales(vendor_id=row.pop('vendor'), **row)
+        for row in items.values('vendor', 'day').annotate(
+            **totals, pending_orders=Count('order', distinct=True, filter=Q(order__status='pending')),
+        )
+    ], batch_size=500)
+    VendorProductDailySales.objects.bulk_create([
+        VendorProductDailySales(vendor_id=row.pop('vendor'), product_id=row.pop('product'), **row)
+        for row in items.values('vendor', 'day', 'product').annotate(**totals)
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomApp', '0008_product_rating_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('pending_orders', models.PositiveIntegerField(default=0)),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('pending_orders__gt', 0)), fields=['vendor'], name='vendor_sales_pending_idx')],
+                'constraints': [models.UniqueConstraint(fields=('vendor', 'day'), name='vendor_daily_sales_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VendorProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='ecomApp.product')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_daily_sales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('vendor', 'day', 'product'), name='vendor_product_daily_sales_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
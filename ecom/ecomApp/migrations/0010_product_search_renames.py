@@ -0,0 +1,40 @@
+# Category and vendor renames now reach the full-text index from post_save receivers
+# (ecomApp/signals.py), so ecomApp_product keeps no triggers on other tables that a table
+# rebuild could trip over. Only the three triggers on ecomApp_product itself remain.
+
+import importlib
+
+from django.db import migrations
+
+product_search = importlib.import_module('ecomApp.migrations.0006_product_search')
+
+DROP_RENAME_TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS ecomApp_customuser_fts_update",
+    "DROP TRIGGER IF EXISTS ecomApp_category_fts_update",
+]
+RENAME_TRIGGERS_SQL = product_search.TRIGGERS_SQL[3:]
+
+# Picks up any rename the triggers missed
+RESYNC_SQL = [
+    """
+    UPDATE ecomApp_product_fts SET
+        category = (SELECT c.name FROM ecomApp_product p JOIN ecomApp_category c ON c.id = p.category_id
+                    WHERE p.id = ecomApp_product_fts.rowid),
+        vendor = (SELECT u.username FROM ecomApp_product p JOIN ecomApp_customuser u ON u.id = p.vendor_id
+                  WHERE p.id = ecomApp_product_fts.rowid)
+    """,
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomApp', '0009_vendor_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            product_search.run_on_sqlite(DROP_RENAME_TRIGGERS_SQL + RESYNC_SQL),
+            product_search.run_on_sqlite(RENAME_TRIGGERS_SQL),
+        ),
+    ]
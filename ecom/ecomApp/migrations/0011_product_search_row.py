@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:24
+
+import django.db.models.deletion
+import ecomApp.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomApp', '0010_product_search_renames'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchRow',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_row', serialize=False, to='ecomApp.product')),
+                ('index', ecomApp.search.SearchIndexField(db_column='ecomApp_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'ecomApp_product_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -1,11 +1,21 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .search import FTS_TABLE, SearchIndexField
 
 class CustomUser(AbstractUser):
     is_vendor = models.BooleanField(default=False)
     is_retailer = models.BooleanField(default=False)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Vendor directory, paged by (date_joined, id)
+            models.Index(fields=['is_vendor', 'date_joined', 'id'], name='user_vendor_joined_idx'),
+        ]
+
     def __str__(self):
         return self.username
 
@@ -25,10 +35,58 @@ class Product(models.Model):
     available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Running totals of feedback ratings, kept up to date by the Feedback signal
+    # receivers (see add_rating and recount_ratings); `manage.py rebuild_product_ratings`
+    # recomputes them all from the feedback table.
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Catalog pages, keyed by (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def avg_rating(self):
+        """Mean feedback rating, or None when unrated."""
+        return self.rating_sum / self.rating_count if self.rating_count else None
+
+    @property
+    def cache_version(self) -> str:
+        """Changes whenever the product's own fields shown on its card do; names of related rows vary the card keys (see catalog_cache.py)."""
+        return f"{self.updated_at.timestamp()}:{self.rating_sum}:{self.rating_count}"
+
+    def add_rating(self, rating: int):
+        """Counts one new rating in the totals with a single atomic UPDATE."""
+        Product.objects.filter(pk=self.pk).update(
+            rating_sum=models.F('rating_sum') + rating, rating_count=models.F('rating_count') + 1,
+        )
+
+    @classmethod
+    def recount_ratings(cls, product_id):
+        """Recomputes one product's totals from its feedback rows with a single UPDATE."""
+        totals = Feedback.objects.filter(product=models.OuterRef('pk')).order_by().values('product')
+        cls.objects.filter(pk=product_id).update(
+            rating_sum=Coalesce(models.Subquery(totals.annotate(total=models.Sum('rating')).values('total')), 0),
+            rating_count=Coalesce(models.Subquery(totals.annotate(total=models.Count('id')).values('total')), 0),
+        )
+
+class ProductSearchRow(models.Model):
+    """A product's row in the FTS5 search index (see search.py); written by triggers only."""
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                   db_constraint=False, related_name='search_row')
+    index = SearchIndexField(db_column=FTS_TABLE)
+    # bm25 relevance of the row for the current MATCH (lower is better)
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = FTS_TABLE
+
 class Cart(models.Model):
     STATUS_CHOICES = [
         ('active', 'Active'),
@@ -71,6 +129,12 @@ class Order(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
 
+    class Meta:
+        indexes = [
+            # A retailer's order history, newest first, paged by (created_at, id)
+            models.Index(fields=['retailer', 'created_at', 'id'], name='order_retailer_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} - {self.retailer.username} - {self.status}"
 
@@ -99,6 +163,49 @@ class Feedback(models.Model):
         return f"Feedback {self.rating}/5 for Order #{self.order.id}"
 
 
+# Daily sales rollups read by vendor_dashboard, kept up to date by checkout and status
+# changes (see sales_rollup.py); `manage.py rebuild_vendor_sales` recomputes them.
+class VendorDailySales(models.Model):
+    """One vendor's orders, units and revenue on one day (the day the orders were placed)."""
+    vendor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Orders placed that day which are still pending
+    pending_orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'day'], name='vendor_daily_sales_unique'),
+        ]
+        indexes = [
+            # Summing a vendor's pending orders only visits days that have some
+            models.Index(fields=['vendor'], condition=models.Q(pending_orders__gt=0), name='vendor_sales_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.vendor} on {self.day}: {self.orders} orders, ₹{self.revenue}"
+
+class VendorProductDailySales(models.Model):
+    """Orders, units and revenue of one product on one day."""
+    vendor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='product_daily_sales')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # Day before product: the dashboard reads a date range of one vendor's rows
+            models.UniqueConstraint(fields=['vendor', 'day', 'product'], name='vendor_product_daily_sales_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} on {self.day}: {self.units} units"
+
+
 class ChatMessage(models.Model):
     SENDER_CHOICES = [
         ('user', 'User'),
@@ -108,10 +215,27 @@ class ChatMessage(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_messages')
     sender = models.CharField(max_length=10, choices=SENDER_CHOICES)
     message = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the turn happens; turns are written in batches some time later.
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Serves "last N turns of this user" as a single index range scan
+            models.Index(fields=['user', 'timestamp'], name='chatmessage_user_time_idx'),
+        ]
     
     def __str__(self):
         return f"{self.sender}: {self.message[:50]}..."
+
+
+class ChatSummary(models.Model):
+    """Rolling summary of a user's chat turns older than the history window."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_summary')
+    summary = models.TextField(blank=True)
+    # Timestamp of the newest turn folded into the summary
+    summarized_until = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Chat summary for {self.user}"
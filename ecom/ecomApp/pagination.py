@@ -0,0 +1,134 @@
+"""Keyset ("cursor") pagination for list views.
+
+Django's ``Paginator`` runs a ``COUNT(*)`` of the whole filtered query and an
+``OFFSET`` scan on every request, so deep pages get slower the further they
+are. ``CursorPaginator`` orders by a unique key instead (e.g.
+``('-created_at', '-id')``) and fetches the rows after, or before, the edge of
+the page being left:
+
+* ``get_page(token)`` runs one ``LIMIT per_page + 1`` query at any depth.
+* Tokens are signed and opaque. A tampered, stale or foreign token gives the
+  first page.
+* ``page.count`` is only computed if a template asks for it, and is then cached
+  for ``count_timeout`` seconds per query.
+"""
+import datetime
+import decimal
+import functools
+import hashlib
+import operator
+
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+
+
+def jsonable(value):
+    # Full-precision ISO strings: a key rounded to milliseconds would skip or repeat rows.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+class CursorPage:
+    """One page of a ``CursorPaginator``, with the tokens of its neighbours."""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def count(self):
+        return self.paginator.count
+
+
+class CursorPaginator:
+    """Pages through ``queryset`` in ``ordering``, whose last field must make rows unique.
+
+    Ordering fields may be model fields or annotations. They must not be null.
+    """
+
+    def __init__(self, queryset, per_page: int, ordering=('-created_at', '-id'), count_timeout: int = 60):
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        self.count_timeout = count_timeout
+        # Binds tokens to this model and ordering.
+        self.salt = f"cursor:{queryset.model._meta.label}:{','.join(ordering)}"
+
+    @property
+    def count(self):
+        key = "cursor_count:" + hashlib.md5(str(self.queryset.query).encode()).hexdigest()
+        return cache.get_or_set(key, lambda: self.queryset.order_by().count(), self.count_timeout)
+
+    def encode(self, direction: str, obj) -> str:
+        values = [jsonable(getattr(obj, name)) for name, _ in self.fields]
+        return signing.dumps({"d": direction, "k": values}, salt=self.salt, compress=True)
+
+    def decode(self, token):
+        if not token:
+            return None
+        try:
+            position = signing.loads(token, salt=self.salt)
+        except signing.BadSignature:
+            return None
+        values = position.get("k")
+        if position.get("d") not in ("next", "prev") or not isinstance(values, list) or len(values) != len(self.fields):
+            return None
+        return position["d"], values
+
+    def beyond(self, values, forward: bool) -> Q:
+        """Rows after (``forward``) or before the row with key ``values``, in ``ordering``."""
+        conditions, equal = [], Q()
+        for (name, descending), value in zip(self.fields, values):
+            lookup = 'lt' if descending == forward else 'gt'
+            conditions.append(equal & Q(**{f"{name}__{lookup}": value}))
+            equal &= Q(**{name: value})
+        return functools.reduce(operator.or_, conditions)
+
+    def get_page(self, token=None) -> CursorPage:
+        position = self.decode(token)
+        if position is not None and position[0] == "prev":
+            reverse = [name if descending else f"-{name}" for name, descending in self.fields]
+            rows = list(self.queryset.filter(self.beyond(position[1], False)).order_by(*reverse)[:self.per_page + 1])
+            if rows:
+                more_before = len(rows) > self.per_page
+                rows = rows[:self.per_page][::-1]
+                return CursorPage(
+                    rows, self,
+                    next_cursor=self.encode("next", rows[-1]),
+                    previous_cursor=self.encode("prev", rows[0]) if more_before else None,
+                )
+            position = None  # everything before it is gone; start over
+
+        queryset = self.queryset
+        if position is not None:
+            queryset = queryset.filter(self.beyond(position[1], True))
+        rows = list(queryset[:self.per_page + 1])
+        more_after = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return CursorPage(
+            rows, self,
+            next_cursor=self.encode("next", rows[-1]) if more_after else None,
+            previous_cursor=self.encode("prev", rows[0]) if position is not None and rows else None,
+        )
@@ -0,0 +1,91 @@
+"""Assembles the context block of RAG prompts from retrieved documents.
+
+Retrieval returns the nearest product profiles, followed by the nearest review
+chunks (see ``indexing.build_review_chunks``). ``assemble_context`` groups them
+by product in that order, drops repeated texts, and keeps at most
+``chunks_per_product`` review chunks per product. It then fills a token budget: profiles of the top products
+first, then their review chunks by rank. The prompt stays about the same size
+however many reviews a product collects.
+"""
+from .indexing import doc_product_id
+
+# Rough size of a token for English text; good enough for budgeting.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def retrieval_queries(where, max_products: int, chunks_per_product: int) -> list:
+    """``(where, n_results)`` searches for a question: profiles, then review chunks.
+
+    Searching the two kinds separately keeps a product with many matching
+    reviews from crowding every other product out of the results.
+    """
+    queries = [(with_kind(where, "profile"), max_products)]
+    if chunks_per_product:
+        queries.append((with_kind(where, "reviews"), max_products * chunks_per_product))
+    return queries
+
+
+def with_kind(where, kind: str) -> dict:
+    clause = {"kind": kind}
+    return {"$and": [where, clause]} if where else clause
+
+
+def merge_results(results_list) -> dict:
+    """Concatenates single-query results (profiles first) into one result for ``assemble_context``."""
+    merged = {"ids": [[]], "documents": [[]], "metadatas": [[]]}
+    for results in results_list:
+        for key in merged:
+            if results.get(key):
+                merged[key][0].extend(results[key][0])
+    return merged
+
+
+def assemble_context(results, max_products: int, token_budget: int, chunks_per_product: int = 2) -> str:
+    """Context text for the first query in a ``Collection.query``-shaped result."""
+    ids = results["ids"][0] if results.get("ids") else []
+    documents = results["documents"][0] if results.get("documents") else []
+    metadatas = results["metadatas"][0] if results.get("metadatas") else [None] * len(ids)
+
+    products = {}  # product id -> {"profile": text, "reviews": [texts]}, in rank order
+    seen = set()
+    for doc_id, document, metadata in zip(ids, documents, metadatas):
+        if not document or document in seen:
+            continue
+        seen.add(document)
+        product_id = doc_product_id(doc_id, metadata)
+        if product_id not in products:
+            if len(products) >= max_products:
+                continue
+            products[product_id] = {"profile": None, "reviews": []}
+        entry = products[product_id]
+        if (metadata or {}).get("kind") == "reviews":
+            if len(entry["reviews"]) < chunks_per_product:
+                entry["reviews"].append(document)
+        else:
+            entry["profile"] = document
+
+    # Spend the budget on every product's facts before any review text.
+    candidates = [(product_id, entry["profile"]) for product_id, entry in products.items() if entry["profile"]]
+    candidates += [(product_id, text) for product_id, entry in products.items() for text in entry["reviews"]]
+    chosen, used = set(), 0
+    for product_id, text in candidates:
+        # Counted with the separator it is joined with below
+        cost = estimate_tokens(text + "\n\n")
+        if used + cost > token_budget:
+            continue
+        chosen.add(text)
+        used += cost
+    if not chosen and candidates:
+        # Never send an empty context when something was found; cut the best match to fit.
+        return candidates[0][1][:token_budget * CHARS_PER_TOKEN - 1]
+
+    blocks = []
+    for entry in products.values():
+        texts = [text for text in (entry["profile"], *entry["reviews"]) if text in chosen]
+        if texts:
+            blocks.append("\n".join(texts))
+    return "\n\n".join(blocks)
@@ -0,0 +1,199 @@
+"""Embedding and generation backends used by the RAG views and ``embed_data.py``.
+
+The backend is chosen by name (``settings.AI_PROVIDER`` in the web app, the
+``AI_PROVIDER`` environment variable for the indexing script):
+
+* ``gemini`` – Google Generative AI (network access and ``GOOGLE_API_KEY`` required).
+* ``local``  – deterministic, offline provider for benchmarks and load tests:
+  hashed n-gram embeddings and a templated answer with simulated latency.
+
+Like ``embedding_cache``, this module does not depend on Django.
+"""
+import abc
+import asyncio
+import math
+import os
+import re
+import time
+import zlib
+
+
+class Provider(abc.ABC):
+    """Interface shared by all backends; subclasses implement ``embed`` and ``generate``."""
+
+    name = ""
+    # Identifies the vector space; used as part of embedding cache keys.
+    embed_model = ""
+
+    @abc.abstractmethod
+    def embed(self, texts, task_type: str) -> list:
+        """Returns one embedding (list of floats) per text, in order."""
+
+    @abc.abstractmethod
+    def generate(self, prompt: str) -> str:
+        """Returns the model's full answer to ``prompt``."""
+
+    def stream(self, prompt: str):
+        """Yields the answer to ``prompt`` in chunks as they are produced."""
+        yield self.generate(prompt)
+
+    # Async variants for the ASGI chat path. The defaults run the blocking
+    # call in a worker thread; backends with native async clients override them.
+    async def aembed(self, texts, task_type: str) -> list:
+        return await asyncio.to_thread(self.embed, list(texts), task_type)
+
+    async def astream(self, prompt: str):
+        yield await asyncio.to_thread(self.generate, prompt)
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    def __init__(self, api_key=None, embed_model="models/embedding-001", chat_model="gemini-1.5-flash"):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.getenv("GOOGLE_API_KEY"))
+        self.genai = genai
+        self.embed_model = embed_model
+        self.model = genai.GenerativeModel(chat_model)
+
+    def embed(self, texts, task_type: str) -> list:
+        resp = self.genai.embed_content(model=self.embed_model, content=list(texts), task_type=task_type)
+        return resp["embedding"]
+
+    def generate(self, prompt: str) -> str:
+        return self.model.generate_content(prompt).text.strip()
+
+    def stream(self, prompt: str):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. a safety or finish-reason update)
+                continue
+            if text:
+                yield text
+
+    async def aembed(self, texts, task_type: str) -> list:
+        resp = await self.genai.embed_content_async(
+            model=self.embed_model, content=list(texts), task_type=task_type
+        )
+        return resp["embedding"]
+
+    async def astream(self, prompt: str):
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+class LocalProvider(Provider):
+    """Offline provider: same input always gives the same vector and answer.
+
+    Embeddings hash word unigrams and character trigrams into ``dimensions``
+    signed buckets and L2-normalise the result, so lexically similar texts land
+    close together. To imitate a remote API, ``embed_latency`` is slept per
+    embedding call, ``generate_latency`` before the first answer token and
+    ``token_latency`` between subsequent tokens.
+    """
+
+    name = "local"
+
+    def __init__(self, dimensions=768, embed_latency=0.0, generate_latency=0.0, token_latency=0.0):
+        self.dimensions = int(dimensions)
+        self.embed_latency = float(embed_latency)
+        self.generate_latency = float(generate_latency)
+        self.token_latency = float(token_latency)
+        self.embed_model = f"local-ngram-{self.dimensions}"
+
+    def features(self, text: str):
+        words = TOKEN_RE.findall(text.lower())
+        yield from words
+        for word in words:
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3]
+
+    def embed_one(self, text: str) -> list:
+        vector = [0.0] * self.dimensions
+        for feature in self.features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dimensions] += 1.0 if h & 0x80000000 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed(self, texts, task_type: str) -> list:
+        if self.embed_latency:
+            time.sleep(self.embed_latency)
+        return [self.embed_one(text) for text in texts]
+
+    def answer(self, prompt: str) -> str:
+        question = prompt.rsplit("User question:", 1)[-1].strip()
+        names = re.findall(r"^Product Name: (.+)$", prompt, flags=re.MULTILINE)
+        if not names:
+            return f'I could not find any products matching "{question}".'
+        lines = [f'Here is what I found for "{question}":']
+        lines.extend(f"- {name}" for name in names)
+        return "\n".join(lines)
+
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt))
+
+    def tokens(self, prompt: str):
+        return re.findall(r"\S+\s*|\s+", self.answer(prompt))
+
+    def stream(self, prompt: str):
+        if self.generate_latency:
+            time.sleep(self.generate_latency)
+        for i, token in enumerate(self.tokens(prompt)):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            yield token
+
+    async def aembed(self, texts, task_type: str) -> list:
+        if self.embed_latency:
+            await asyncio.sleep(self.embed_latency)
+        return [self.embed_one(text) for text in texts]
+
+    async def astream(self, prompt: str):
+        if self.generate_latency:
+            await asyncio.sleep(self.generate_latency)
+        for i, token in enumerate(self.tokens(prompt)):
+            if i and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield token
+
+
+PROVIDERS = {
+    GeminiProvider.name: GeminiProvider,
+    LocalProvider.name: LocalProvider,
+}
+
+
+def get_provider(name: str = "gemini", **options) -> Provider:
+    """Instantiates the backend registered under ``name``."""
+    try:
+        provider_class = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown AI provider {name!r}; expected one of {sorted(PROVIDERS)}")
+    return provider_class(**options)
+
+
+def provider_from_env() -> Provider:
+    """Backend configured through the same environment variables as the Django settings."""
+    name = os.getenv("AI_PROVIDER", "gemini")
+    options = {}
+    if name == LocalProvider.name:
+        options = {
+            "embed_latency": os.getenv("AI_LOCAL_EMBED_LATENCY", "0"),
+            "generate_latency": os.getenv("AI_LOCAL_GENERATE_LATENCY", "0"),
+            "token_latency": os.getenv("AI_LOCAL_TOKEN_LATENCY", "0"),
+        }
+    return get_provider(name, **options)
@@ -0,0 +1,125 @@
+"""Turn simple constraints in a chat question into a Chroma ``where`` filter.
+
+Recognised constraints (case-insensitive):
+
+* price   – "under Rs 100", "below ₹100", "less than 100", "over 50",
+            "above Rs. 50", "between 50 and 100", "50-100 rupees"
+* rating  – "4+ stars", "at least 4 stars", "rated 4 and above" (minimum rating)
+* stock   – "at least 20 units", "20+ units"
+* vendor  – "from aarav", "by vendor aarav", "sold by aarav" (known vendors only)
+* category – any known category name appearing in the question
+
+Vendor and category names are matched against the catalog's actual names, so a
+phrase like "from the market" is not mistaken for a vendor. The metadata fields
+filtered on are written by ``indexing.profile_metadata``.
+
+``refers_to_history`` tells follow-ups ("is it in stock?", "cheaper ones?")
+from standalone questions, which are answered without the chat history.
+"""
+import re
+
+CURRENCY = r"(?:rs\.?|inr|₹)?\s*"
+NUMBER = r"(\d+(?:\.\d+)?)"
+UNDER_RE = re.compile(rf"(?:\b(?:under|below|less than|cheaper than|upto|up to|within|max(?:imum)?)|<=?)\s*{CURRENCY}{NUMBER}")
+OVER_RE = re.compile(rf"(?:\b(?:over|above|more than|costlier than|min(?:imum)?)|>=?)\s*{CURRENCY}{NUMBER}")
+BETWEEN_RE = re.compile(rf"\bbetween\s*{CURRENCY}{NUMBER}\s*(?:and|-|to)\s*{CURRENCY}{NUMBER}")
+RANGE_RE = re.compile(rf"{CURRENCY}{NUMBER}\s*(?:-|to)\s*{CURRENCY}{NUMBER}\s*(?:rs|rupees|inr|₹)")
+RATING_RE = re.compile(
+    r"\b(?:([1-5](?:\.\d)?)\s*\+?\s*stars?|rated\s*([1-5](?:\.\d)?))"
+)
+QUANTITY_RE = re.compile(r"\b(?:at least\s*)?(\d+)\s*\+?\s*(?:units|pieces|pcs|packs)\b")
+VENDOR_RE = re.compile(r"\b(?:from|by|sold by)\s+(?:vendor\s+|seller\s+)?([\w.@+-]+)")
+LIST_WORDS_RE = re.compile(r"\b(all|list|options|compare|which|show|every)\b")
+SINGLE_WORDS_RE = re.compile(r"\b(cheapest|best|top|lowest|highest)\b")
+# Words that only make sense against earlier turns
+FOLLOW_UP_RE = re.compile(
+    r"\b(it|its|that|those|these|this|them|they|their|one|ones|same|also|another|else|others?|instead"
+    r"|previous|earlier)\b|^\W*(and|but|what about|how about)\b"
+)
+
+
+def parse_constraints(query: str, vendors=(), categories=()) -> dict:
+    """Extracts price/rating/stock/vendor/category constraints from ``query``.
+
+    ``vendors`` and ``categories`` are the known names (any case). Returns a dict
+    with any of: ``price_min``, ``price_max``, ``rating_min``, ``quantity_min``,
+    ``vendor``, ``category`` (names lower-cased).
+    """
+    text = query.lower()
+    constraints = {}
+
+    between = BETWEEN_RE.search(text) or RANGE_RE.search(text)
+    if between:
+        low, high = sorted((float(between.group(1)), float(between.group(2))))
+        constraints["price_min"], constraints["price_max"] = low, high
+    else:
+        under = UNDER_RE.search(text)
+        over = OVER_RE.search(text)
+        if under:
+            constraints["price_max"] = float(under.group(1))
+        if over:
+            constraints["price_min"] = float(over.group(1))
+
+    rating = RATING_RE.search(text)
+    if rating:
+        constraints["rating_min"] = float(rating.group(1) or rating.group(2))
+
+    quantity = QUANTITY_RE.search(text)
+    if quantity:
+        constraints["quantity_min"] = int(quantity.group(1))
+
+    vendor_names = {name.lower() for name in vendors}
+    for match in VENDOR_RE.finditer(text):
+        candidate = match.group(1).rstrip(".,?!")
+        if candidate in vendor_names:
+            constraints["vendor"] = candidate
+            break
+
+    for name in sorted((c.lower() for c in categories), key=len, reverse=True):
+        if re.search(rf"\b{re.escape(name)}\b", text):
+            constraints["category"] = name
+            break
+
+    return constraints
+
+
+def build_where(constraints: dict):
+    """Chroma ``where`` clause for ``constraints`` (None when there are none)."""
+    clauses = []
+    if "price_min" in constraints:
+        clauses.append({"price": {"$gte": constraints["price_min"]}})
+    if "price_max" in constraints:
+        clauses.append({"price": {"$lte": constraints["price_max"]}})
+    if "rating_min" in constraints:
+        clauses.append({"avg_rating": {"$gte": constraints["rating_min"]}})
+    if "quantity_min" in constraints:
+        clauses.append({"quantity": {"$gte": constraints["quantity_min"]}})
+    if "vendor" in constraints:
+        clauses.append({"vendor": constraints["vendor"]})
+    if "category" in constraints:
+        clauses.append({"category": constraints["category"]})
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def refers_to_history(query: str) -> bool:
+    """Whether ``query`` needs the earlier turns to be understood."""
+    return bool(FOLLOW_UP_RE.search(query.lower()))
+
+
+def choose_n_results(query: str, constraints: dict, default: int = 3, wide: int = 8) -> int:
+    """How many profiles to retrieve for ``query``.
+
+    Superlatives ("cheapest", "best") need a few candidates to compare; listing
+    questions ("show all dal from aarav") get more, since a filter already keeps
+    the candidates relevant.
+    """
+    text = query.lower()
+    if LIST_WORDS_RE.search(text):
+        return wide
+    if SINGLE_WORDS_RE.search(text):
+        return default + 2 if constraints else default
+    return default
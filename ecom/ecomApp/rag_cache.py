@@ -0,0 +1,195 @@
+"""In-process caches in front of the RAG pipeline.
+
+* ``LRUCache`` – normalized query -> query embedding, so repeated questions
+  skip the embedding call.
+* ``TTLCache`` – (normalized query, index version) -> final answer, so repeated
+  questions skip retrieval and generation until the entry expires or the
+  product index changes.
+* ``IndexVersion`` – memoizes the index version token for a short interval,
+  so checking it does not cost a Chroma read per request.
+* ``SemanticCache`` – query embedding -> answer, matched by cosine similarity,
+  so paraphrases ("price of toor dal", "toor dal rate?") reuse an answer.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Case-folds, collapses whitespace and drops trailing punctuation."""
+    return WHITESPACE_RE.sub(" ", query).strip().lower().rstrip("?!.").strip()
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with hit/miss counters."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+        }
+
+
+class TTLCache(LRUCache):
+    """LRU mapping whose entries also expire ``ttl`` seconds after being set."""
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 1024):
+        super().__init__(max_entries)
+        self.ttl = ttl
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        super().set(key, (time.monotonic() + self.ttl, value))
+
+
+class IndexVersion:
+    """Caches ``loader()`` (the index version token) for ``refresh`` seconds."""
+
+    def __init__(self, loader, refresh: float = 1.0):
+        self.loader = loader
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.value = None
+        self.expires_at = 0.0
+
+    def get(self) -> str:
+        with self.lock:
+            if self.value is None or time.monotonic() >= self.expires_at:
+                self.value = self.loader()
+                self.expires_at = time.monotonic() + self.refresh
+            return self.value
+
+    def invalidate(self):
+        with self.lock:
+            self.value = None
+
+
+class SemanticCache:
+    """Answers keyed by query embedding; a lookup hits when a cached query is similar enough.
+
+    Embeddings are kept L2-normalised in one preallocated matrix, so a lookup
+    is a single matrix-vector product. An entry only matches lookups with the
+    same ``guard`` (e.g. the parsed filters and result count), so "dal under 100"
+    never answers "dal under 200". All entries are dropped when the index
+    version changes. When full, the least recently used entry is replaced.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 2048):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.matrix = None
+        self.slots = OrderedDict()  # slot -> (guard, answer), least recently used first
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def check_version(self, version):
+        if version != self.version:
+            self.slots.clear()
+            self.version = version
+
+    def get(self, embedding, version, guard=""):
+        """Cached answer of the most similar matching query, or None."""
+        vector = self.normalize(embedding)
+        with self.lock:
+            self.check_version(version)
+            if self.slots and self.matrix is not None and self.matrix.shape[1] == len(vector):
+                # Rows 0..len-1 are the used slots (see set), so a view avoids copying the matrix.
+                scores = self.matrix[:len(self.slots)] @ vector
+                close = np.flatnonzero(scores >= self.threshold)
+                for slot in close[np.argsort(-scores[close])].tolist():
+                    entry_guard, answer = self.slots[slot]
+                    if entry_guard == guard:
+                        self.slots.move_to_end(slot)
+                        self.hits += 1
+                        return answer
+            self.misses += 1
+            return None
+
+    def set(self, embedding, version, answer, guard=""):
+        if not self.max_entries:
+            return
+        vector = self.normalize(embedding)
+        with self.lock:
+            self.check_version(version)
+            if self.matrix is None or self.matrix.shape[1] != len(vector):
+                self.matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                self.slots.clear()
+            if len(self.slots) < self.max_entries:
+                # Slots are only freed all at once (clear), so 0..len-1 are the used ones.
+                slot = len(self.slots)
+            else:
+                slot, _ = self.slots.popitem(last=False)
+            self.matrix[slot] = vector
+            self.slots[slot] = (guard, answer)
+
+    def clear(self):
+        with self.lock:
+            self.slots.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "llm_calls_saved": self.hits,
+            "entries": len(self.slots),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+        }
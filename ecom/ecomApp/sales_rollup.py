@@ -0,0 +1,84 @@
+"""Daily vendor sales rollups (VendorDailySales, VendorProductDailySales).
+
+* Checkout adds each new order to the rows of its day (``record_order``), in
+  the same transaction as the order, with ``F()`` increments.
+* Status changes only move an order in or out of the vendors' pending counts
+  (``record_status_change``). Units and revenue count every order placed,
+  whatever its status, as the dashboard always has.
+* ``manage.py rebuild_vendor_sales`` recomputes both tables from the order
+  items (``computed_totals``). That backfills them and repairs drift, e.g.
+  after orders are edited in the admin.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import OrderItem, VendorDailySales, VendorProductDailySales
+
+REVENUE = Sum(F('quantity') * F('price_at_order_time'), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def add_to_row(model, keys: dict, **deltas):
+    """Adds ``deltas`` to the ``model`` row matching ``keys``, creating the row if there is none."""
+    increments = {name: F(name) + value for name, value in deltas.items()}
+    if model.objects.filter(**keys).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:
+        # Another checkout created it first
+        model.objects.filter(**keys).update(**increments)
+
+
+def record_order(order, items):
+    """Counts a newly placed ``order`` with its OrderItem ``items`` in the rollups."""
+    day = timezone.localdate(order.created_at)
+    vendors, products = {}, {}
+    for item in items:
+        if item.vendor_id is None:
+            continue
+        revenue = item.quantity * item.price_at_order_time
+        for totals, key in ((vendors, item.vendor_id), (products, (item.vendor_id, item.product_id))):
+            units, amount = totals.get(key, (0, 0))
+            totals[key] = (units + item.quantity, amount + revenue)
+    for vendor_id, (units, revenue) in vendors.items():
+        add_to_row(VendorDailySales, {'vendor_id': vendor_id, 'day': day},
+                   orders=1, units=units, revenue=revenue, pending_orders=int(order.status == 'pending'))
+    for (vendor_id, product_id), (units, revenue) in products.items():
+        add_to_row(VendorProductDailySales, {'vendor_id': vendor_id, 'product_id': product_id, 'day': day},
+                   orders=1, units=units, revenue=revenue)
+
+
+def record_status_change(order, old_status: str):
+    """Updates the pending counts of the order's vendors after ``order.status`` changed from ``old_status``."""
+    change = int(order.status == 'pending') - int(old_status == 'pending')
+    if change:
+        vendor_ids = OrderItem.objects.filter(order=order).values('vendor_id')
+        VendorDailySales.objects.filter(vendor_id__in=vendor_ids, day=timezone.localdate(order.created_at)).update(
+            pending_orders=F('pending_orders') + change,
+        )
+
+
+def computed_totals():
+    """Both rollups recomputed from the order items.
+
+    Returns ``{(vendor_id, day): (orders, units, revenue, pending_orders)}`` and
+    ``{(vendor_id, day, product_id): (orders, units, revenue)}``.
+    """
+    items = OrderItem.objects.filter(vendor__isnull=False).annotate(day=TruncDate('order__created_at')).order_by()
+    vendor_days = {
+        (row['vendor'], row['day']): (row['orders'], row['units'], row['revenue'], row['pending'])
+        for row in items.values('vendor', 'day').annotate(
+            orders=Count('order', distinct=True), units=Sum('quantity'), revenue=REVENUE,
+            pending=Count('order', distinct=True, filter=Q(order__status='pending')),
+        )
+    }
+    product_days = {
+        (row['vendor'], row['day'], row['product']): (row['orders'], row['units'], row['revenue'])
+        for row in items.values('vendor', 'day', 'product').annotate(
+            orders=Count('order', distinct=True), units=Sum('quantity'), revenue=REVENUE,
+        )
+    }
+    return vendor_days, product_days
@@ -0,0 +1,116 @@
+"""Product search backed by the SQLite FTS5 index (see migration 0006).
+
+``search_products`` narrows a Product queryset to the rows matching a free-text
+query and orders them by relevance (the index's bm25 ``rank``, name matches
+weighted highest).
+Every word of the query must match, each as a prefix, so "toor da" finds
+"Toor Dal". On databases without the index it falls back to ``icontains``.
+
+Triggers on ecomApp_product keep the index in step with product writes;
+category and vendor renames are copied in by ``sync_related_name``, called from
+the post_save receivers in ``signals.py`` (bulk ``.update()`` renames skip those).
+
+The index table is mapped read-only as ``models.ProductSearchRow``, so queries
+reach it through the ORM: ``search_row__index__match`` joins it and applies
+MATCH, and its ``rank`` column can be annotated, filtered and ordered on.
+"""
+import re
+
+from django.db import connection, models
+from django.db.models import F, Lookup, Q
+
+FTS_TABLE = "ecomApp_product_fts"
+FTS_COLUMNS = ("name", "description", "category", "vendor")
+# Triggers that must exist on ecomApp_product (migrations 0006 and 0010)
+FTS_TRIGGERS = ("ecomApp_product_fts_insert", "ecomApp_product_fts_update", "ecomApp_product_fts_delete")
+# FTS column fed by each related name, and the product foreign key pointing at it
+RELATED_COLUMNS = {"category": "category_id", "vendor": "vendor_id"}
+# Longest query considered, in words; the rest is ignored
+MAX_TERMS = 8
+TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+ICONTAINS_FIELDS = {
+    "name": "name__icontains",
+    "description": "description__icontains",
+    "category": "category__name__icontains",
+    "vendor": "vendor__username__icontains",
+}
+
+
+class SearchIndexField(models.TextField):
+    """The FTS5 table's hidden column named after the table: the left side of a full-table MATCH."""
+
+
+@SearchIndexField.register_lookup
+class Match(Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", [*lhs_params, *rhs_params]
+
+
+def match_expression(text: str, columns=FTS_COLUMNS):
+    """FTS5 MATCH string for ``text`` limited to ``columns`` (None if it has no words).
+
+    Terms are quoted, so user input cannot inject FTS5 operators.
+    """
+    terms = TERM_RE.findall(text.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    expression = " ".join(f'"{term}"*' for term in terms)
+    if tuple(columns) != FTS_COLUMNS:
+        expression = f"{{{' '.join(columns)}}} : ({expression})"
+    return expression
+
+
+def fts_available() -> bool:
+    return connection.vendor == "sqlite"
+
+
+def sync_related_name(column: str, related_id: int, name: str):
+    """Writes a renamed category or vendor into the ``column`` of its products' index rows."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {FTS_TABLE} SET {column} = %s"
+            f" WHERE rowid IN (SELECT id FROM ecomApp_product WHERE {RELATED_COLUMNS[column]} = %s)",
+            [name, related_id],
+        )
+
+
+def filter_matches(queryset, text: str, columns=FTS_COLUMNS):
+    """Products in ``queryset`` matching ``text`` in ``columns``, unordered and unranked."""
+    from .models import ProductSearchRow
+
+    if not fts_available():
+        condition = Q()
+        for column in columns:
+            condition |= Q(**{ICONTAINS_FIELDS[column]: text})
+        return queryset.filter(condition)
+
+    expression = match_expression(text, columns)
+    if expression is None:
+        return queryset.none()
+    # A subquery rather than a join, so grouped and aggregated querysets are unaffected
+    return queryset.filter(id__in=ProductSearchRow.objects.filter(index__match=expression).values("product_id"))
+
+
+def search_products(queryset, text: str, columns=FTS_COLUMNS):
+    """Products in ``queryset`` matching ``text`` in ``columns``, best match first.
+
+    Adds a ``search_rank`` annotation (lower is better) on the FTS path.
+    """
+    if not fts_available():
+        return filter_matches(queryset, text, columns)
+    expression = match_expression(text, columns)
+    if expression is None:
+        queryset = queryset.none()
+    else:
+        queryset = queryset.filter(search_row__index__match=expression)
+    # Joined, so each row's rank is read as the match is scanned. The rank column,
+    # unlike bm25(), also works under the GROUP BY of annotate(); as an annotation
+    # it can be filtered on, which cursor pagination needs.
+    return queryset.annotate(search_rank=F("search_row__rank")).order_by("search_rank", "id")
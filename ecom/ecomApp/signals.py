@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .catalog_cache import bump_catalog_generation, forget_vendor_price_bounds
+from .models import Category, CustomUser, Product, Feedback
+from .search import sync_related_name
+
+
+def schedule_reindex(product_id):
+    """Queue a product profile for re-embedding once the current transaction commits."""
+    if not getattr(settings, 'AI_INDEX_AUTO_UPDATE', False) or product_id is None:
+        return
+    from .index_updates import index_update_queue
+    transaction.on_commit(lambda: index_update_queue.enqueue([product_id]))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    bump_catalog_generation()
+    forget_vendor_price_bounds(instance.vendor_id)
+    schedule_reindex(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    # Saves reach the typeahead index through the catalog generation; deletes leave no row to read.
+    from .typeahead import typeahead_index
+    typeahead_index.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Feedback)
+@receiver(post_delete, sender=Feedback)
+def feedback_changed(sender, instance, **kwargs):
+    bump_catalog_generation()
+    schedule_reindex(instance.product_id)
+
+
+@receiver(post_save, sender=Feedback)
+def feedback_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return  # fixtures carry their own totals
+    if created:
+        instance.product.add_rating(instance.rating)
+    else:
+        # The rating may have been edited; the old value is gone, so count again
+        Product.recount_ratings(instance.product_id)
+
+
+@receiver(post_delete, sender=Feedback)
+def feedback_deleted(sender, instance, origin=None, **kwargs):
+    # Deleting the product itself takes its totals with it
+    if isinstance(origin, Product) or getattr(origin, 'model', None) is Product:
+        return
+    Product.recount_ratings(instance.product_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump_catalog_generation()
+
+
+def renamed(update_fields, field):
+    return update_fields is None or field in update_fields
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, update_fields=None, **kwargs):
+    if not created and renamed(update_fields, 'name'):
+        sync_related_name('category', instance.pk, instance.name)
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logins save only last_login
+    if not created and renamed(update_fields, 'username'):
+        sync_related_name('vendor', instance.pk, instance.username)
+        if instance.is_vendor:
+            # Cached pages show vendor usernames
+            bump_catalog_generation()
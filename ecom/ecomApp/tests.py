@@ -1,3 +1,1447 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import datetime
+import importlib
+import importlib.util
+import io
+import os
+import re
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import chromadb
+import numpy as np
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import views
+from .ai import AIResources
+from .query_filters import build_where, choose_n_results, parse_constraints
+from .batching import MicroBatcher
+from .chat_history import ChatHistoryWriter, ChatSummarizer, conversation_context, recent_turns, update_summary
+from .embedding_cache import EmbeddingCache
+from .facets import cached_cube, facet_counts, parse_filters
+from .index_updates import IndexUpdateQueue
+from .indexing import (
+    COLLECTION_NAME, INDEX_VERSION_KEY, REVIEW_SEPARATOR, ChromaWriter, build_review_chunks, delete_products, profile_id,
+    sync_products,
+)
+from .models import (
+    Cart, CartItem, Category, ChatMessage, ChatSummary, CustomUser, Feedback, Order, OrderItem, Product, VendorDailySales,
+)
+from .sales_rollup import computed_totals
+from .pagination import CursorPaginator
+from .prompting import assemble_context, estimate_tokens
+from .providers import LocalProvider
+from .rag_cache import IndexVersion, SemanticCache
+from .search import FTS_TRIGGERS, filter_matches, search_products
+from .typeahead import TypeaheadIndex
+from .vector_index import NumpyIndex, export_collection
+
+# Tests that go through the catalog caches use this instead of the shared file cache in settings.py
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VendorOrdersQueryCountTests(TestCase):
+    """vendor_orders runs the same number of queries however many orders the vendor has."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = CustomUser.objects.create(username="vendor", is_vendor=True)
+        cls.other_vendor = CustomUser.objects.create(username="other-vendor", is_vendor=True)
+        cls.products = [
+            Product.objects.create(vendor=cls.vendor, name=f"product {i}", price=10 + i, quantity=100)
+            for i in range(3)
+        ]
+        cls.other_product = Product.objects.create(vendor=cls.other_vendor, name="other product", price=5, quantity=100)
+
+    def add_orders(self, count):
+        for i in range(count):
+            retailer = CustomUser.objects.create(username=f"retailer-{Order.objects.count()}", is_retailer=True)
+            order = Order.objects.create(retailer=retailer, total_price=100, status='delivered')
+            for product in [*self.products, self.other_product]:
+                OrderItem.objects.create(order=order, product=product, vendor=product.vendor,
+                                         quantity=2, price_at_order_time=product.price, delivered=True)
+            Feedback.objects.create(order=order, product=self.products[0], vendor=self.vendor,
+                                    retailer=retailer, rating=1 + i % 5, comment="ok")
+
+    def get_orders(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('vendor_orders'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_is_constant(self):
+        self.client.force_login(self.vendor)
+        self.add_orders(2)
+        _, few = self.get_orders()
+        self.add_orders(40)
+        response, many = self.get_orders()
+        self.assertEqual(few, many)
+
+        groups = response.context['orders']
+        self.assertEqual(len(groups), 5)
+        for group in groups:
+            # Only this vendor's items, with the rating given for each
+            self.assertEqual([item.product for item in group['items']], self.products)
+            self.assertEqual(group['items'][0].order_rating, group['feedbacks'][0].rating)
+            self.assertIsNone(group['items'][1].order_rating)
+
+    def test_next_page_query_count(self):
+        self.client.force_login(self.vendor)
+        self.add_orders(12)
+        response, first = self.get_orders()
+        with CaptureQueriesContext(connection) as queries:
+            next_page = self.client.get(reverse('vendor_orders'), {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual(len(queries), first)
+        first_ids = {group['order'].id for group in response.context['orders']}
+        next_ids = {group['order'].id for group in next_page.context['orders']}
+        self.assertEqual(len(next_ids), 5)
+        self.assertFalse(first_ids & next_ids)
+
+
+class VendorSalesRollupTests(TestCase):
+    """Checkout and status changes keep the daily rollups equal to a full recomputation."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendors = [CustomUser.objects.create(username=f"vendor-{i}", is_vendor=True) for i in range(2)]
+        cls.retailer = CustomUser.objects.create(username="retailer", is_retailer=True)
+        cls.products = [
+            Product.objects.create(vendor=vendor, name=f"product {i}", price=10 * (i + 1), quantity=100)
+            for i, vendor in enumerate(cls.vendors * 2)
+        ]
+
+    def check_out(self, quantities):
+        self.client.force_login(self.retailer)
+        cart = Cart.objects.create(retailer=self.retailer, status='active')
+        for product, quantity in zip(self.products, quantities):
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        self.client.post(reverse('checkout'))
+        return Order.objects.latest('id')
+
+    def assertRollupsConsistent(self):
+        call_command('rebuild_vendor_sales', '--check', stdout=io.StringIO())
+
+    def test_checkout_and_status_changes(self):
+        first = self.check_out([1, 2, 3, 4])
+        self.check_out([5, 1, 1, 1])
+        self.assertRollupsConsistent()
+        vendor_days, _ = computed_totals()
+        day = VendorDailySales.objects.get(vendor=self.vendors[0])
+        self.assertEqual((day.orders, day.units, day.revenue, day.pending_orders), (2, 10, 180, 2))
+        self.assertEqual(vendor_days[(self.vendors[0].id, day.day)], (2, 10, 180, 2))
+
+        self.client.force_login(self.vendors[1])
+        self.client.post(reverse('update_order_status', args=[first.id]), {'status': 'processing'})
+        # The order left the pending count of both its vendors
+        self.assertEqual([row.pending_orders for row in VendorDailySales.objects.order_by('vendor')], [1, 1])
+        self.assertRollupsConsistent()
+
+    def test_dashboard_reads_rollups(self):
+        self.check_out([1, 2, 3, 4])
+        self.client.force_login(self.vendors[0])
+        response = self.client.get(reverse('vendor_dashboard'))
+        self.assertEqual(response.context['sales_30'], 100)
+        self.assertEqual(response.context['units_30'], 4)
+        self.assertEqual(response.context['aov_30'], 100)
+        self.assertEqual(response.context['pending_orders'], 1)
+        self.assertEqual([row['product__name'] for row in response.context['top_products']], ["product 2", "product 0"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VendorProductsTests(TestCase):
+    """vendor_products runs a fixed number of queries and keeps its price range current."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = CustomUser.objects.create(username="vendor", is_vendor=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.vendor)
+
+    def add_products(self, count, price=50):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                Product.objects.create(vendor=self.vendor, name=f"product {i}", price=price + i, quantity=i % 15)
+
+    def get_products(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('vendor_products'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_is_constant(self):
+        self.add_products(3)
+        self.get_products()  # caches the price range
+        _, few = self.get_products(sort='price')
+        self.add_products(60)
+        self.get_products()
+        response, many = self.get_products(sort='price')
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.context['products']), 20)
+        self.assertEqual(response.context['total_products'], 63)
+
+    def test_price_range_follows_product_writes(self):
+        self.add_products(2, price=40)
+        response, _ = self.get_products()
+        self.assertEqual((response.context['min_price'], response.context['max_price']), (40, 41))
+        self.add_products(1, price=500)
+        response, _ = self.get_products()
+        self.assertEqual((response.context['min_price'], response.context['max_price']), (40, 500))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CursorPaginatorTests(TestCase):
+    """Cursor pages cover every row once in either direction, with ties broken by id."""
+
+    @classmethod
+    def setUpTestData(cls):
+        vendor = CustomUser.objects.create(username="vendor", is_vendor=True)
+        Product.objects.bulk_create(
+            Product(vendor=vendor, name=f"product {i}", price=10, quantity=1) for i in range(11)
+        )
+        # Pairs of rows share a timestamp, so the id has to settle their order
+        start = timezone.now()
+        for i, product in enumerate(Product.objects.order_by('id')):
+            Product.objects.filter(pk=product.pk).update(created_at=start + datetime.timedelta(seconds=i // 2))
+        cls.expected = list(Product.objects.order_by('-created_at', '-id'))
+
+    def setUp(self):
+        cache.clear()
+        self.paginator = CursorPaginator(Product.objects.all(), per_page=4)
+
+    def walk(self, page, cursor):
+        pages = [page]
+        while cursor(pages[-1]):
+            pages.append(self.paginator.get_page(cursor(pages[-1])))
+        return pages
+
+    def test_forward_walk(self):
+        pages = self.walk(self.paginator.get_page(), lambda page: page.next_cursor)
+        self.assertEqual([len(page) for page in pages], [4, 4, 3])
+        self.assertEqual([row for page in pages for row in page], self.expected)
+        self.assertEqual([(page.has_previous(), page.has_next()) for page in pages],
+                         [(False, True), (True, True), (True, False)])
+
+    def test_backward_walk(self):
+        last = self.walk(self.paginator.get_page(), lambda page: page.next_cursor)[-1]
+        pages = self.walk(last, lambda page: page.previous_cursor)[::-1]
+        self.assertEqual([row for page in pages for row in page], self.expected)
+        # The same pages as on the way forward
+        self.assertEqual([len(page) for page in pages], [4, 4, 3])
+        self.assertFalse(pages[0].has_previous())
+
+    def test_bad_tokens_give_the_first_page(self):
+        token = self.paginator.get_page().next_cursor
+        other_ordering = CursorPaginator(Product.objects.all(), per_page=4, ordering=('price', 'id'))
+        for bad in (token[:-2] + "xx", "garbage", other_ordering.get_page().next_cursor):
+            with self.subTest(token=bad):
+                page = self.paginator.get_page(bad)
+                self.assertEqual(list(page), self.expected[:4])
+                self.assertFalse(page.has_previous())
+
+    def test_count_is_lazy_and_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            page = self.paginator.get_page()
+        self.assertEqual(len(queries), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(page.count, 11)
+        Product.objects.filter(pk=self.expected[0].pk).delete()
+        with self.assertNumQueries(0):
+            # Later requests for the same query reuse it until it expires
+            self.assertEqual(CursorPaginator(Product.objects.all(), per_page=4).count, 11)
+
+
+class ProductSearchIndexTests(TestCase):
+    """The full-text index follows product writes and category or vendor renames."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = CustomUser.objects.create(username="aarav", is_vendor=True)
+        cls.category = Category.objects.create(name="Dal")
+        cls.product = Product.objects.create(vendor=cls.vendor, category=cls.category, name="Toor", price=90, quantity=10)
+
+    def found(self, text, column):
+        return list(search_products(Product.objects.all(), text, columns=(column,)))
+
+    def test_product_triggers_exist(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%%_fts_%%'")
+            triggers = {name for name, in cursor.fetchall()}
+        # Nothing on the category or user tables, so migrations can rebuild ecomApp_product
+        self.assertEqual(triggers, set(FTS_TRIGGERS))
+
+    def test_renames_reach_the_index(self):
+        self.category.name = "Pulses"
+        self.category.save()
+        self.vendor.username = "sita_stores"
+        self.vendor.save()
+        self.assertEqual(self.found("pulses", "category"), [self.product])
+        self.assertEqual(self.found("dal", "category"), [])
+        self.assertEqual(self.found("sita", "vendor"), [self.product])
+        self.assertEqual(self.found("aarav", "vendor"), [])
+
+    def test_product_writes_reach_the_index(self):
+        other = Category.objects.create(name="Rice")
+        self.product.name, self.product.category = "Sona Masoori", other
+        self.product.save()
+        self.assertEqual(self.found("sona", "name"), [self.product])
+        self.assertEqual(self.found("rice", "category"), [self.product])
+        self.product.delete()
+        self.assertEqual(self.found("sona", "name"), [])
+
+
+    def test_name_matches_rank_first(self):
+        described = Product.objects.create(vendor=self.vendor, name="Moong", description="toor blend", price=80,
+                                           quantity=10)
+        Product.objects.create(vendor=self.vendor, name="Rice", price=50, quantity=10)
+        cases = [
+            # query, products in rank order
+            ("toor", [self.product, described]),
+            ("too", [self.product, described]),
+            ("toor blend", [described]),
+            ("basmati", []),
+            ("!!", []),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                found = search_products(Product.objects.all(), text)
+                self.assertEqual(list(found), expected)
+                self.assertEqual(sorted(found.values_list("search_rank", flat=True)),
+                                 list(found.values_list("search_rank", flat=True)))
+                # The unranked filter agrees, and still aggregates over plain product rows
+                self.assertEqual(filter_matches(Product.objects.all(), text).count(), len(expected))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VendorDetailTests(TestCase):
+    """vendor_detail serves its product grid from the page cache with each user's own CSRF input."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = CustomUser.objects.create(username="vendor", is_vendor=True)
+        cls.retailers = [CustomUser.objects.create(username=f"retailer-{i}", is_retailer=True) for i in range(2)]
+        cls.product = Product.objects.create(vendor=cls.vendor, name="Toor Dal", price=90, quantity=5)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.retailers[0])
+
+    def get_page(self):
+        response = self.client.get(reverse('vendor_detail', args=[self.vendor.id]))
+        self.assertEqual(response.status_code, 200)
+        rendered = 'vendor_detail_results.html' in [template.name for template in response.templates]
+        return response, rendered
+
+    def test_cached_grid_gets_each_users_token(self):
+        for retailer, cached in zip(self.retailers, (False, True)):
+            with self.subTest(retailer=retailer.username):
+                self.client = self.client_class(enforce_csrf_checks=True)
+                self.client.force_login(retailer)
+                response, rendered = self.get_page()
+                self.assertEqual(rendered, not cached)
+                html = response.content.decode()
+                self.assertNotIn("<!--csrf_token-->", html)
+                token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', html).group(1)
+                self.client.post(reverse('add_to_cart', args=[self.product.id]), {'csrfmiddlewaretoken': token})
+                self.assertTrue(CartItem.objects.filter(cart__retailer=retailer, product=self.product).exists())
+
+    def test_cache_hit_only_looks_up_the_vendor(self):
+        url = reverse('vendor_detail', args=[self.vendor.id])
+        self.client.get(url, {'search': 'basmati'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'search': 'basmati'})
+        # Besides the session and the users (the retailer and the vendor), nothing is read.
+        tables = {table for query in queries for table in re.findall(r'FROM "(\w+)"', query['sql'])}
+        self.assertEqual(tables, {"django_session", "ecomApp_customuser"})
+        self.assertContains(response, "0 products available")
+        self.assertContains(response, "&quot;basmati&quot; is not available from vendor.")
+
+    def test_writes_retire_the_grid(self):
+        self.get_page()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(vendor=self.vendor, name="Moong Dal", price=80, quantity=5)
+        response, rendered = self.get_page()
+        self.assertTrue(rendered)
+        self.assertContains(response, "Moong Dal")
+
+    def test_renames_rerender_cached_cards(self):
+        category = Category.objects.create(name="Pulses")
+        Product.objects.filter(pk=self.product.pk).update(category=category)
+        # The name as printed on the card, not in the page around it
+        cases = [
+            (category, "name", "Lentils", '<i class="fas fa-tag me-1"></i>Lentils',
+             reverse('vendor_detail', args=[self.vendor.id])),
+            (self.vendor, "username", "dal-mill", "Vendor: dal-mill", reverse('browse_products')),
+        ]
+        for instance, field, name, card_text, url in cases:
+            with self.subTest(field=field):
+                self.client.get(url)
+                with self.captureOnCommitCallbacks(execute=True):
+                    setattr(instance, field, name)
+                    instance.save()
+                self.assertContains(self.client.get(url), card_text)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TypeaheadIndexTests(TestCase):
+    """Suggestions follow catalog writes; the worker's updates are run inline here."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = CustomUser.objects.create(username="aarav", is_vendor=True)
+        cls.category = Category.objects.create(name="Dal")
+        cls.toor = Product.objects.create(vendor=cls.vendor, category=cls.category, name="Toor Dal Loose",
+                                          price=90, quantity=5)
+
+    def setUp(self):
+        cache.clear()
+        self.index = TypeaheadIndex()
+        self.index.update("rebuild")
+
+    def labels(self, text, **kwargs):
+        with mock.patch.object(self.index, 'schedule'):
+            return [(s["type"], s["label"]) for s in self.index.suggest(text, **kwargs)]
+
+    def test_sold_out_products_are_not_suggested(self):
+        Product.objects.create(vendor=self.vendor, name="Masoor Dal", price=70, quantity=0)
+        self.index.update("rebuild")
+        self.assertEqual(self.labels("mas"), [])
+
+    def test_updates_leave_published_refs_alone(self):
+        snapshot = self.index.snapshot
+        refs = dict(snapshot.product_refs)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.toor.name = "Toor Dal Premium"
+            self.toor.save()
+        self.index.update("check")
+        self.index.update(None, removed={self.toor.id})
+        self.assertEqual(snapshot.product_refs, refs)
+        self.assertEqual(self.index.snapshot.product_refs, {})
+
+    def test_lookups_only_schedule_the_build(self):
+        index = TypeaheadIndex()
+        with mock.patch.object(index, 'schedule') as schedule:
+            self.assertEqual(index.suggest("dal"), [])
+            index.suggest("dal")
+        schedule.assert_called_once_with("rebuild")
+
+    def test_suggestions(self):
+        self.assertEqual(self.labels("dal"), [("category", "Dal"), ("product", "Toor Dal Loose")])
+        self.assertEqual(self.labels("dal lo"), [("product", "Toor Dal Loose")])
+        self.assertEqual(self.labels("aa"), [("vendor", "aarav")])
+        self.assertEqual(self.labels("dal", vendor_id=self.vendor.id), [("product", "Toor Dal Loose")])
+        self.assertEqual(self.labels("dal", vendor_id=self.vendor.id + 1), [])
+
+    def test_writes_reach_the_index(self):
+        names = self.index.snapshot.names
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(vendor=self.vendor, name="Moong Dal", price=80, quantity=5)
+            self.toor.name = "Toor Dal Premium"
+            self.toor.save()
+        self.index.update("check")
+        self.assertEqual(self.labels("dal"),
+                         [("category", "Dal"), ("product", "Moong Dal"), ("product", "Toor Dal Premium")])
+        # No category or vendor changed, so their list was kept
+        self.assertIs(self.index.snapshot.names, names)
+
+        self.index.update(None, removed={self.toor.id})
+        self.assertEqual(self.labels("toor"), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(vendor=self.vendor, name="Masoor Dal", price=70, quantity=0)
+        self.index.update("check")
+        self.assertEqual(self.labels("mas"), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "Pulses"
+            self.category.save()
+        self.index.update("check")
+        self.assertEqual(self.labels("pul"), [("category", "Pulses")])
+
+
+def never_answers(started):
+    """Stands in for astream_rag_answer: signals ``started``, then waits until cancelled."""
+    async def answer(query, history=""):
+        started.set()
+        await asyncio.Event().wait()
+        yield ""
+    return answer
+
+
+class ChatLimiterTests(TestCase):
+    """Cancelled chat requests give their limiter slot back."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username="retailer", is_retailer=True)
+
+    def assertNoActiveChats(self):
+        self.assertEqual(views.CHAT_LIMITER.stats()['active'], 0)
+
+    async def test_cancelled_stream_releases_slot(self):
+        started = asyncio.Event()
+        with mock.patch.object(views, 'astream_rag_answer', never_answers(started)):
+            body = views.stream_chat_reply(self.user.id, "cheapest dal", timezone.now())
+            task = asyncio.ensure_future(body.__anext__())
+            await started.wait()
+            self.assertEqual(views.CHAT_LIMITER.stats()['active'], 1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertNoActiveChats()
+
+    async def test_stream_never_iterated_holds_no_slot(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('chat_send'), {'message': "cheapest dal", 'stream': '1'})
+        self.assertTrue(response.streaming)
+        del response
+        self.assertNoActiveChats()
+
+    async def test_cancelled_request_releases_slot(self):
+        await self.async_client.aforce_login(self.user)
+        started = asyncio.Event()
+        with mock.patch.object(views, 'astream_rag_answer', never_answers(started)):
+            task = asyncio.ensure_future(self.async_client.post(reverse('chat_send'), {'message': "cheapest dal"}))
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertNoActiveChats()
+
+
+class QueryFiltersTests(SimpleTestCase):
+    """Constraints read from chat questions and the Chroma filters built from them."""
+
+    VENDORS = ["Aarav", "sita_stores"]
+    CATEGORIES = ["Dal", "Rice", "Basmati Rice"]
+
+    def test_parse_and_build_where(self):
+        cases = [
+            ("dal under Rs 100 from aarav", {"price_max": 100.0, "vendor": "aarav", "category": "dal"},
+             {"$and": [{"price": {"$lte": 100.0}}, {"vendor": "aarav"}, {"category": "dal"}]}),
+            ("rice above ₹50", {"price_min": 50.0, "category": "rice"},
+             {"$and": [{"price": {"$gte": 50.0}}, {"category": "rice"}]}),
+            ("<= 80", {"price_max": 80.0}, {"price": {"$lte": 80.0}}),
+            # Bounds given in either order; the longest category name wins
+            ("between 100 and 50", {"price_min": 50.0, "price_max": 100.0},
+             {"$and": [{"price": {"$gte": 50.0}}, {"price": {"$lte": 100.0}}]}),
+            ("30-60 rupees basmati rice", {"price_min": 30.0, "price_max": 60.0, "category": "basmati rice"},
+             {"$and": [{"price": {"$gte": 30.0}}, {"price": {"$lte": 60.0}}, {"category": "basmati rice"}]}),
+            ("4+ stars tea", {"rating_min": 4.0}, {"avg_rating": {"$gte": 4.0}}),
+            ("rated 3.5 and above", {"rating_min": 3.5}, {"avg_rating": {"$gte": 3.5}}),
+            ("at least 20 units", {"quantity_min": 20}, {"quantity": {"$gte": 20}}),
+            ("sold by Sita_Stores.", {"vendor": "sita_stores"}, {"vendor": "sita_stores"}),
+            # Only known vendors count
+            ("stuff from the market", {}, None),
+            ("plain question", {}, None),
+        ]
+        for query, constraints, where in cases:
+            with self.subTest(query=query):
+                parsed = parse_constraints(query, self.VENDORS, self.CATEGORIES)
+                self.assertEqual(parsed, constraints)
+                self.assertEqual(build_where(parsed), where)
+
+    def test_choose_n_results(self):
+        cases = [
+            ("plain question", {}, 3),
+            ("cheapest dal", {}, 3),
+            ("cheapest dal", {"category": "dal"}, 5),
+            ("show all dal from aarav", {"vendor": "aarav"}, 8),
+        ]
+        for query, constraints, n in cases:
+            with self.subTest(query=query, constraints=constraints):
+                self.assertEqual(choose_n_results(query, constraints), n)
+
+
+class FacetCountsTests(SimpleTestCase):
+    """Facet options counted from a hand-built cube, with each facet ignoring its own filter."""
+
+    # (category, vendor, price bucket, rating bucket, (category name, vendor name), products)
+    CUBE = [
+        (1, 10, "0-100", "4", ("Dal", "aarav"), 3),
+        (1, 20, "100-250", "3", ("Dal", "sita_stores"), 2),
+        (2, 10, "100-250", "4", ("Rice", "aarav"), 5),
+        (None, 20, "1000+", "unrated", (None, "sita_stores"), 1),
+    ]
+
+    def test_facet_counts(self):
+        cases = [
+            ({}, {
+                "category": [(1, 5, False), (2, 5, False), (None, 1, False)],
+                "vendor": [(10, 8, False), (20, 3, False)],
+                "price": [("0-100", 3, False), ("100-250", 7, False), ("1000+", 1, False)],
+                "rating": [("4", 8, False), ("3", 2, False), ("unrated", 1, False)],
+            }),
+            # The selected category still lists its siblings
+            ({"category": 1}, {
+                "category": [(1, 5, True), (2, 5, False), (None, 1, False)],
+                "vendor": [(10, 3, False), (20, 2, False)],
+                "price": [("0-100", 3, False), ("100-250", 2, False)],
+                "rating": [("4", 3, False), ("3", 2, False)],
+            }),
+            ({"category": 1, "vendor": 20}, {
+                "category": [(1, 2, True), (None, 1, False)],
+                "vendor": [(10, 3, False), (20, 2, True)],
+                "price": [("100-250", 2, False)],
+                "rating": [("3", 2, False)],
+            }),
+            ({"price": "100-250", "rating": "4"}, {
+                "category": [(2, 5, False)],
+                "vendor": [(10, 5, False)],
+                "price": [("0-100", 3, False), ("100-250", 5, True)],
+                "rating": [("4", 5, True), ("3", 2, False)],
+            }),
+        ]
+        for filters, expected in cases:
+            with self.subTest(filters=filters):
+                facets = facet_counts(self.CUBE, filters)
+                counts = {name: [(o["value"], o["count"], o["selected"]) for o in options]
+                          for name, options in facets.items()}
+                self.assertEqual(counts, expected)
+
+    def test_labels(self):
+        facets = facet_counts(self.CUBE, {})
+        self.assertEqual([o["label"] for o in facets["category"]], ["Dal", "Rice", "Uncategorised"])
+        self.assertEqual(facets["price"][0]["label"], "Under ₹100")
+
+    def test_parse_filters(self):
+        cases = [
+            ({}, {}),
+            ({"category": "3", "vendor": "12", "price": "250-500", "rating": "unrated"},
+             {"category": 3, "vendor": 12, "price": "250-500", "rating": "unrated"}),
+            # Unknown buckets and non-numeric ids are dropped
+            ({"category": "dal", "vendor": "-1", "price": "0-50", "rating": "5"}, {}),
+            ({"price": "1000+", "q": "dal"}, {"price": "1000+"}),
+        ]
+        for params, filters in cases:
+            with self.subTest(params=params):
+                self.assertEqual(parse_filters(params), filters)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CATALOG_FACETS_TTL=120)
+class CachedCubeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = CustomUser.objects.create(username="mill", is_vendor=True)
+        cls.dal = Category.objects.create(name="Dal")
+        Product.objects.create(vendor=cls.vendor, category=cls.dal, name="toor dal", price=90, quantity=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def products(self, search_query):
+        return sum(cell[-1] for cell in cached_cube(Product.objects.filter(available=True), search_query))
+
+    def test_catalog_writes_retire_cached_cubes(self):
+        self.assertEqual((self.products(""), self.products("dal")), (1, 1))
+        with self.assertNumQueries(0):
+            self.assertEqual((self.products(""), self.products("DAL!")), (1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(vendor=self.vendor, category=self.dal, name="moong dal", price=80, quantity=10)
+        self.assertEqual((self.products(""), self.products("dal")), (2, 2))
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name="toor dal").get().delete()
+        self.assertEqual((self.products(""), self.products("dal")), (1, 1))
+
+def load_embed_data():
+    """The indexing script lives next to the Django project, outside any package."""
+    path = Path(settings.BASE_DIR).parent / "embed_data.py"
+    spec = importlib.util.spec_from_file_location("embed_data", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FlakyProvider(LocalProvider):
+    """LocalProvider that fails every embedding call containing ``broken``."""
+
+    broken = None
+
+    def embed(self, texts, task_type: str) -> list:
+        if self.broken and any(self.broken in text for text in texts):
+            raise RuntimeError("embedding service unavailable")
+        return super().embed(texts, task_type)
+
+
+@override_settings(AI_INDEX_AUTO_UPDATE=False)
+class ProductIndexSyncTests(TestCase):
+    """embed_data.sync and sync_products against an in-memory Chroma, offline."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = CustomUser.objects.create(username="mill", is_vendor=True)
+        retailer = CustomUser.objects.create(username="shop", is_retailer=True)
+        category = Category.objects.create(name="Rice")
+        cls.products = [
+            Product.objects.create(vendor=cls.vendor, category=category, name=f"rice {i}", price=50 + i, quantity=10)
+            for i in range(4)
+        ]
+        cls.reviewed = cls.products[0]
+        order = Order.objects.create(retailer=retailer, total_price=50)
+        Feedback.objects.create(order=order, product=cls.reviewed, vendor=cls.vendor,
+                                retailer=retailer, rating=4, comment="cooks evenly")
+        cls.out_of_stock = Product.objects.create(vendor=cls.vendor, name="sold out", price=10, quantity=0)
+        cls.unavailable = Product.objects.create(vendor=cls.vendor, name="withdrawn", price=10, quantity=5,
+                                                 available=False)
+
+    def setUp(self):
+        self.embed_data = load_embed_data()
+        self.client = chromadb.EphemeralClient()
+        # Ephemeral clients share one store per process
+        try:
+            self.client.delete_collection(name=COLLECTION_NAME)
+        except Exception:
+            pass
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache = EmbeddingCache(Path(cache_dir.name) / "embeddings.sqlite3")
+        self.addCleanup(self.cache.close)
+        self.provider = FlakyProvider(dimensions=16)
+        connection.ensure_connection()
+        self.conn = connection.connection
+
+    def sync(self, **options):
+        with mock.patch("builtins.print"), mock.patch("ecomApp.indexing.time.sleep"):
+            return self.embed_data.sync(self.client, self.conn, self.provider, self.cache, rate_limit=0, **options)
+
+    def stored_ids(self):
+        return set(self.client.get_collection(COLLECTION_NAME).get(include=[])["ids"])
+
+    def watermarks(self):
+        metadata = self.client.get_collection(COLLECTION_NAME).metadata or {}
+        return metadata.get(self.embed_data.PRODUCTS_WATERMARK_KEY), metadata.get(INDEX_VERSION_KEY)
+
+    def test_first_sync_skips_unsellable_products(self):
+        stats = self.sync()
+        expected = {profile_id(p.id) for p in self.products} | {f"product_reviews_{self.reviewed.id}_0"}
+        self.assertEqual(self.stored_ids(), expected)
+        self.assertEqual(stats["upserted"], len(expected))
+
+    def test_incremental_sync_only_touches_changed_rows(self):
+        self.sync()
+        product = self.products[1]
+        product.price = 99
+        product.save()
+        stats = self.sync()
+        self.assertEqual(stats["upserted"], 1)
+        self.assertLess(stats["checked"], Product.objects.count())
+        metadata = self.client.get_collection(COLLECTION_NAME).get(ids=[profile_id(product.id)])["metadatas"][0]
+        self.assertEqual(metadata["price"], 99.0)
+        # Nothing changed since: no upserts and the index version stays put
+        version = self.watermarks()[1]
+        self.assertEqual(self.sync()["upserted"], 0)
+        self.assertEqual(self.watermarks()[1], version)
+
+    def test_watermarks_hold_until_every_profile_is_stored(self):
+        self.provider.broken = "rice 2"
+        with self.assertLogs("ecomApp.indexing", "ERROR"):
+            stats = self.sync()
+        self.assertLess(stats["upserted"], stats["pending"])
+        self.assertIsNone(self.watermarks()[0])
+        self.assertNotIn(profile_id(self.products[2].id), self.stored_ids())
+
+        self.provider.broken = None
+        stats = self.sync()
+        self.assertEqual(stats["upserted"], stats["pending"])
+        self.assertIsNotNone(self.watermarks()[0])
+        self.assertIn(profile_id(self.products[2].id), self.stored_ids())
+
+    def test_prune_removes_deleted_products(self):
+        self.sync()
+        doomed = self.products[3]
+        # A raw delete, as made outside the web app: no signals, no updated_at trail
+        Product.objects.filter(pk=doomed.pk)._raw_delete(Product.objects.db)
+        self.assertEqual(self.sync()["pruned"], 0)
+        self.assertIn(profile_id(doomed.id), self.stored_ids())
+        self.assertEqual(self.sync(prune=True)["pruned"], 1)
+        self.assertNotIn(profile_id(doomed.id), self.stored_ids())
+
+    def test_unsellable_products_are_removed(self):
+        cases = [("out of stock", {"quantity": 0}), ("unavailable", {"available": False})]
+        for label, changes in cases:
+            with self.subTest(label):
+                self.sync(full=True)
+                product = Product.objects.get(pk=self.reviewed.pk)
+                for field, value in changes.items():
+                    setattr(product, field, value)
+                product.save()
+                stats = self.sync()
+                self.assertEqual(stats["removed"], 2)
+                self.assertFalse(self.stored_ids() & {profile_id(product.id), f"product_reviews_{product.id}_0"})
+                Product.objects.filter(pk=product.pk).update(quantity=10, available=True)
+
+    def test_failed_review_chunk_is_retried(self):
+        chunk_id = f"product_reviews_{self.reviewed.id}_0"
+        collection = self.embed_data.open_collection(self.client, full=False)
+        upsert = collection.upsert
+
+        def upsert_without_chunk(ids, **kwargs):
+            if chunk_id in ids:
+                raise RuntimeError("disk full")
+            return upsert(ids=ids, **kwargs)
+
+        @contextlib.contextmanager
+        def failing_upsert():
+            # One document per upsert, so only the chunk's upsert fails
+            init = ChromaWriter.__init__
+            with mock.patch.object(collection, "upsert", upsert_without_chunk), \
+                    mock.patch.object(ChromaWriter, "__init__", lambda writer, c: init(writer, c, chunk_size=1)):
+                yield
+
+        cases = [
+            ("embedding fails", mock.patch.object(self.provider, "broken", "cooks evenly")),
+            ("upsert fails", failing_upsert()),
+        ]
+        for label, failure in cases:
+            with self.subTest(label):
+                delete_products(collection, [self.reviewed.id])
+                with failure, mock.patch("ecomApp.indexing.time.sleep"), self.assertLogs("ecomApp.indexing", "ERROR"):
+                    # One document per embedding request, so only the chunk's request fails
+                    stats = sync_products(self.conn, collection, self.provider, [self.reviewed.id], self.cache,
+                                          rate_limit=0, batch_size=1)
+                self.assertEqual((stats["pending"], stats["upserted"]), (2, 1))
+                self.assertEqual(self.stored_ids(), {profile_id(self.reviewed.id)})
+
+                stats = sync_products(self.conn, collection, self.provider, [self.reviewed.id], self.cache, rate_limit=0)
+                self.assertEqual((stats["unchanged"], stats["upserted"]), (0, 2))
+                self.assertIn(chunk_id, self.stored_ids())
+                stats = sync_products(self.conn, collection, self.provider, [self.reviewed.id], self.cache, rate_limit=0)
+                self.assertEqual((stats["unchanged"], stats["upserted"]), (1, 0))
+
+    def test_sync_products_and_delete_products(self):
+        collection = self.embed_data.open_collection(self.client, full=False)
+        ids = [p.id for p in self.products] + [self.out_of_stock.id]
+        stats = sync_products(self.conn, collection, self.provider, ids, self.cache, rate_limit=0)
+        self.assertEqual(stats["upserted"], len(self.products) + 1)
+
+        # A product deleted outright is removed together with its review chunks
+        Product.objects.filter(pk=self.reviewed.pk).delete()
+        stats = sync_products(self.conn, collection, self.provider, [self.reviewed.id], self.cache, rate_limit=0)
+        self.assertEqual(stats["removed"], 2)
+
+        self.assertEqual(delete_products(collection, [self.products[1].id, self.unavailable.id]), 1)
+        self.assertEqual(self.stored_ids(), {profile_id(p.id) for p in self.products[2:]})
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    MODEL, TASK = "local-ngram-4", "retrieval_query"
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.path = Path(cache_dir.name) / "embeddings.sqlite3"
+        self.now = 1000.0
+        clock = mock.patch("ecomApp.embedding_cache.time.time", lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def open(self, **options):
+        cache = EmbeddingCache(self.path, **options)
+        self.addCleanup(cache.close)
+        return cache
+
+    def put(self, cache, *texts):
+        cache.put_many(self.MODEL, self.TASK, texts, [[float(len(text)), 0.5, -1.0, 0.0] for text in texts])
+
+    def test_hits_misses_and_stats(self):
+        cache = self.open(max_entries=10)
+        self.put(cache, "dal", "basmati")
+        self.assertEqual(cache.get_many(self.MODEL, self.TASK, ["dal", "poha", "basmati"]),
+                         [[3.0, 0.5, -1.0, 0.0], None, [7.0, 0.5, -1.0, 0.0]])
+        # Other models and task types are separate entries
+        self.assertIsNone(cache.get(self.MODEL, "retrieval_document", "dal"))
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 2, "hit_rate": 0.5, "entries": 2, "max_entries": 10})
+        # Entries persist across instances
+        self.assertEqual(self.open().stats()["entries"], 2)
+
+    def test_evicts_least_recently_used_to_ninety_percent(self):
+        cache = self.open(max_entries=10, touch_interval=0)
+        texts = [f"text {i}" for i in range(10)]
+        for text in texts:
+            self.now += 1
+            self.put(cache, text)
+        self.now += 1
+        cache.get_many(self.MODEL, self.TASK, texts[:3])
+        self.put(cache, "newest")
+        self.assertEqual(cache.stats()["entries"], 9)
+        kept = cache.get_many(self.MODEL, self.TASK, texts + ["newest"])
+        self.assertEqual([text for text, vector in zip(texts + ["newest"], kept) if vector is None],
+                         ["text 3", "text 4"])
+
+    def test_hits_only_write_stale_use_times(self):
+        cache = self.open(touch_interval=60)
+        self.put(cache, "dal", "poha")
+        cases = [(30, 0), (60, 1), (90, 0)]
+        for elapsed, writes in cases:
+            with self.subTest(elapsed=elapsed):
+                self.now = 1000.0 + elapsed
+                before = cache.conn.total_changes
+                cache.get(self.MODEL, self.TASK, "dal")
+                self.assertEqual(cache.conn.total_changes - before, writes)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, AI_INDEX_AUTO_UPDATE=True, AI_RETRIEVER="chroma")
+class IndexUpdateQueueTests(TestCase):
+    """Signals feed the re-index queue; the worker's steps run inline here."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = CustomUser.objects.create(username="mill", is_vendor=True)
+        retailer = CustomUser.objects.create(username="shop", is_retailer=True)
+        cls.order = Order.objects.create(retailer=retailer, total_price=50)
+        cls.dal, cls.rice = [
+            Product.objects.create(vendor=cls.vendor, name=name, price=50, quantity=10) for name in ("dal", "rice")
+        ]
+
+    def setUp(self):
+        self.queue = IndexUpdateQueue(delay=0)
+        # Looks alive, so enqueue never starts a real worker thread
+        self.queue.worker = mock.Mock()
+        patcher = mock.patch("ecomApp.index_updates.index_update_queue", self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_saves_collapse_into_one_sync(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for price in (51, 52, 53):
+                self.dal.price = price
+                self.dal.save()
+            self.rice.save()
+            Feedback.objects.create(order=self.order, product=self.dal, vendor=self.vendor,
+                                    retailer=self.order.retailer, rating=5)
+        batch = self.queue.take_batch()
+        self.assertEqual(batch, [self.dal.id, self.rice.id])
+        self.assertFalse(self.queue.pending)
+
+        ai = mock.Mock()
+        with mock.patch("ecomApp.ai.get_ai", return_value=ai), \
+                mock.patch("ecomApp.index_updates.sync_products",
+                           return_value={"upserted": 2, "removed": 0}) as sync, \
+                mock.patch("ecomApp.index_updates.update_index_metadata") as update_metadata, \
+                mock.patch.object(views.INDEX_VERSION, "invalidate") as invalidate:
+            self.queue.process(batch)
+        sync.assert_called_once_with(connection, ai.collection, ai.provider, batch, ai.embedding_cache)
+        update_metadata.assert_called_once_with(ai.chroma_client)
+        invalidate.assert_called_once()
+        self.assertEqual(self.queue.processed, 2)
+
+    def test_unchanged_batch_keeps_index_version(self):
+        with mock.patch("ecomApp.ai.get_ai"), \
+                mock.patch("ecomApp.index_updates.sync_products", return_value={"upserted": 0, "removed": 0}), \
+                mock.patch("ecomApp.index_updates.update_index_metadata") as update_metadata, \
+                mock.patch.object(views.INDEX_VERSION, "invalidate") as invalidate:
+            self.queue.process([self.dal.id])
+        update_metadata.assert_not_called()
+        invalidate.assert_not_called()
+
+
+class IndexVersionTests(SimpleTestCase):
+    """A new index version makes the answer caches miss."""
+
+    def setUp(self):
+        self.version = "v1"
+        patcher = mock.patch.object(views, "INDEX_VERSION", IndexVersion(lambda: self.version, refresh=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(views.ANSWER_CACHE.clear)
+        self.addCleanup(views.SEMANTIC_CACHE.clear)
+
+    def cached(self, query, embedding):
+        version = views.INDEX_VERSION.get()
+        return (views.ANSWER_CACHE.get(views.answer_cache_key(query, version)),
+                views.SEMANTIC_CACHE.get(embedding, version))
+
+    def test_invalidate_drops_cached_answers(self):
+        query, embedding = "Which dal is cheapest?", [0.6, 0.8, 0.0]
+        version = views.INDEX_VERSION.get()
+        views.ANSWER_CACHE.set(views.answer_cache_key(query, version), "Toor dal")
+        views.SEMANTIC_CACHE.set(embedding, version, "Toor dal")
+        self.assertEqual(self.cached(query, embedding), ("Toor dal", "Toor dal"))
+
+        # The index changes; until invalidated the memoized version still serves the old answers
+        self.version = "v2"
+        self.assertEqual(self.cached(query, embedding), ("Toor dal", "Toor dal"))
+        views.INDEX_VERSION.invalidate()
+        self.assertEqual(self.cached(query, embedding), (None, None))
+        self.assertEqual(views.SEMANTIC_CACHE.stats()["entries"], 0)
+
+
+class NumpyIndexTests(SimpleTestCase):
+    """The exported index answers like the Chroma collection it was exported from."""
+
+    PRODUCTS = [
+        # id, name, vendor, category, price, quantity, avg_rating, review chunks
+        (1, "toor dal", "mill", "dal", 120.0, 40, 4.5, 1),
+        (2, "moong dal", "mill", "dal", 95.0, 5, 3.0, 0),
+        (3, "masoor dal", "farm", "dal", 80.0, 12, 0.0, 2),
+        (4, "basmati rice", "farm", "rice", 210.0, 8, 4.8, 1),
+        (5, "sona masoori rice", "mill", "rice", 150.0, 60, 4.1, 0),
+        (6, "poha", "farm", "", 45.0, 100, 2.5, 0),
+    ]
+    REVIEWS = ["", "cooks evenly", "arrived late", "clean grains", "fragrant and long", "good value", "stale"]
+
+    def setUp(self):
+        self.provider = LocalProvider(dimensions=256)
+        client = chromadb.EphemeralClient()
+        try:
+            client.delete_collection(name=COLLECTION_NAME)
+        except Exception:
+            pass
+        self.collection = client.create_collection(name=COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+        self.addCleanup(client.delete_collection, name=COLLECTION_NAME)
+        for pid, name, vendor, category, price, quantity, rating, chunks in self.PRODUCTS:
+            profile = {"kind": "profile", "product_id": pid, "price": price, "quantity": quantity,
+                       "category": category, "vendor": vendor, "avg_rating": rating}
+            self.add(profile_id(pid), f"Product Name: {name}\nSold by Vendor: {vendor}", profile)
+            for n in range(chunks):
+                self.add(f"product_reviews_{pid}_{n}", f"Customer reviews of {name}: {self.REVIEWS[pid + n]}",
+                         {**profile, "kind": "reviews", "chunk": n})
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        self.path = index_dir.name
+
+    def add(self, doc_id, document, metadata):
+        self.collection.add(ids=[doc_id], documents=[document], metadatas=[metadata],
+                            embeddings=self.provider.embed([document], "retrieval_document"))
+
+    def test_query_matches_chroma(self):
+        export_collection(self.collection, self.path)
+        index = NumpyIndex.open(self.path)
+        self.assertEqual(index.count(), self.collection.count())
+        cases = [
+            None,
+            {"kind": "profile"},
+            {"kind": "reviews"},
+            {"price": {"$lte": 100.0}},
+            {"$and": [{"kind": "profile"}, {"vendor": "mill"}, {"quantity": {"$gte": 10}}]},
+            {"$and": [{"category": "dal"}, {"avg_rating": {"$gte": 3.0}}]},
+            {"$or": [{"category": "rice"}, {"price": {"$lt": 50.0}}]},
+            {"vendor": {"$ne": "farm"}},
+            {"category": "tea"},
+        ]
+        # Dense random queries, so no two documents tie on distance
+        queries = np.random.default_rng(0).normal(size=(3, 256)).tolist()
+        for where in cases:
+            with self.subTest(where=where):
+                expected = self.collection.query(query_embeddings=queries, n_results=4, where=where)
+                result = index.query(queries, n_results=4, where=where)
+                self.assertEqual(result["ids"], expected["ids"])
+                self.assertEqual(result["documents"], expected["documents"])
+                for got, want in zip(result["distances"], expected["distances"]):
+                    self.assertEqual(len(got), len(want))
+                    for a, b in zip(got, want):
+                        self.assertAlmostEqual(a, b, places=4)
+
+    def test_reopens_after_export(self):
+        self.collection.modify(metadata={INDEX_VERSION_KEY: "v1"})
+        export_collection(self.collection, self.path)
+        environ = {"EMBEDDING_CACHE_PATH": os.path.join(self.path, "embeddings.sqlite3")}
+        with override_settings(AI_RETRIEVER="numpy", AI_NUMPY_INDEX_PATH=self.path, AI_PROVIDER="local",
+                               AI_PROVIDER_OPTIONS={}), mock.patch.dict(os.environ, environ):
+            ai = AIResources()
+            self.addCleanup(ai.chroma_executor.shutdown)
+            self.addCleanup(ai.embedding_cache.close)
+            first = ai.retriever
+            version = ai.index_version()
+            self.assertTrue(version.startswith("v1/"))
+            self.assertIs(ai.retriever, first)
+
+            self.collection.delete(ids=[profile_id(6)])
+            self.collection.modify(metadata={INDEX_VERSION_KEY: "v2"})
+            export_collection(self.collection, self.path)
+            self.assertTrue(ai.index_version().startswith("v2/"))
+            self.assertIsNot(ai.retriever, first)
+            self.assertEqual(ai.retriever.count(), first.count() - 1)
+            query = self.provider.embed(["poha"], "retrieval_query")
+            self.assertNotIn(profile_id(6), ai.retriever.query(query, n_results=20)["ids"][0])
+            # Readers of the old generation keep their mapping
+            self.assertIn(profile_id(6), first.query(query, n_results=20)["ids"][0])
+
+
+class MicroBatcherTests(SimpleTestCase):
+
+    def run_callers(self, batcher, items):
+        async def main():
+            return await asyncio.gather(*(batcher.submit(item) for item in items), return_exceptions=True)
+        return asyncio.run(main())
+
+    def test_coalesces_concurrent_callers(self):
+        cases = [
+            # callers, max_size, expected batch sizes
+            (1, 64, [1]),
+            (10, 64, [10]),
+            (10, 4, [4, 4, 2]),
+            (8, 4, [4, 4]),
+        ]
+        for callers, max_size, sizes in cases:
+            with self.subTest(callers=callers, max_size=max_size):
+                batches = []
+
+                async def handler(items):
+                    batches.append(list(items))
+                    return [item * 2 for item in items]
+
+                batcher = MicroBatcher(handler, window=0.01, max_size=max_size)
+                self.assertEqual(self.run_callers(batcher, range(callers)), [i * 2 for i in range(callers)])
+                self.assertEqual([len(batch) for batch in batches], sizes)
+                self.assertEqual(batcher.stats()["batches"], len(sizes))
+                self.assertEqual(batcher.stats()["largest_batch"], max(sizes))
+
+    def test_handler_errors_reach_every_caller(self):
+        async def handler(items):
+            raise ConnectionError("embedding service down")
+
+        batcher = MicroBatcher(handler, window=0.01)
+        results = self.run_callers(batcher, ["dal", "rice", "poha"])
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertIsInstance(result, ConnectionError)
+
+        # The next batch is unaffected
+        async def echo(items):
+            return items
+        batcher.handler = echo
+        self.assertEqual(self.run_callers(batcher, ["dal"]), ["dal"])
+
+
+@override_settings(AI_CHAT_HISTORY_TURNS=4, AI_CHAT_SUMMARY_EVERY=3, AI_CHAT_SUMMARY_CHARS=100)
+class ChatHistoryTests(TestCase):
+    """Chat memory with the writer and summarizer queues drained inline."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username="shop", is_retailer=True)
+        cls.start = timezone.now() - datetime.timedelta(hours=1)
+
+    def setUp(self):
+        self.writer = ChatHistoryWriter(delay=0)
+        self.summarizer = ChatSummarizer()
+        # Look alive, so no real worker threads are started
+        self.writer.worker = self.summarizer.worker = mock.Mock()
+        for name, queue in (("chat_history_writer", self.writer), ("chat_summarizer", self.summarizer)):
+            patcher = mock.patch(f"ecomApp.chat_history.{name}", queue)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def save_turns(self, count, first=0):
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user=self.user, sender="user" if n % 2 == 0 else "ai", message=f"turn {n}",
+                        timestamp=self.start + datetime.timedelta(minutes=n))
+            for n in range(first, first + count)
+        ])
+
+    def test_history_window(self):
+        cases = [
+            # saved turns, queued turns, turns in the prompt
+            (0, 0, []),
+            (2, 0, [0, 1]),
+            (6, 0, [2, 3, 4, 5]),
+            (6, 2, [4, 5, 6, 7]),
+            (1, 5, [2, 3, 4, 5]),
+        ]
+        for saved, queued, expected in cases:
+            with self.subTest(saved=saved, queued=queued):
+                ChatMessage.objects.all().delete()
+                self.writer.pending.clear()
+                self.save_turns(saved)
+                for n in range(saved, saved + queued):
+                    self.writer.add(self.user.id, "user", f"turn {n}", self.start + datetime.timedelta(minutes=n))
+                turns = recent_turns(self.user.id, 4)
+                self.assertEqual([turn["message"] for turn in turns], [f"turn {n}" for n in expected])
+                context = conversation_context(self.user.id)
+                self.assertEqual(context.count("turn "), len(expected))
+
+    def test_writer_saves_queued_turns_in_one_batch(self):
+        for n in range(3):
+            self.writer.add(self.user.id, "user", f"turn {n}")
+        batch = self.writer.take_batch()
+        with self.assertNumQueries(1):
+            self.writer.write(batch)
+        self.assertEqual(ChatMessage.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(self.writer.stats()["pending"], 0)
+        self.assertEqual(self.summarizer.pending, {self.user.id})
+
+    def test_summary_trigger(self):
+        ai = mock.Mock()
+        ai.provider.generate.return_value = "Wants cheap dal. " * 20
+        cases = [
+            # new saved turns, turns folded into the summary so far (None: no summary yet)
+            (6, None),   # two turns outside the window of 4
+            (1, 2),      # the third pushes a summary of turns 0-2
+            (2, 2),      # two more outside: not yet
+            (1, 5),
+        ]
+        saved = 0
+        with mock.patch("ecomApp.ai.get_ai", return_value=ai):
+            for new, folded in cases:
+                with self.subTest(saved=saved + new):
+                    self.save_turns(new, first=saved)
+                    saved += new
+                    update_summary(self.user.id)
+                    state = ChatSummary.objects.filter(user=self.user).first()
+                    if folded is None:
+                        self.assertIsNone(state)
+                        continue
+                    self.assertEqual(state.summarized_until, self.start + datetime.timedelta(minutes=folded))
+                    self.assertEqual(len(state.summary), 100)
+        self.assertEqual(ai.provider.generate.call_count, 2)
+        prompt = ai.provider.generate.call_args.args[0]
+        self.assertTrue(prompt.endswith("New turns:\nAssistant: turn 3\nCustomer: turn 4\nAssistant: turn 5"))
+        self.assertIn("(summary): Wants cheap dal.", conversation_context(self.user.id))
+
+
+class PromptContextTests(SimpleTestCase):
+
+    @staticmethod
+    def results(products, reviews_per_product=3, profile_chars=120, review_chars=300):
+        """Query result with every profile first, then every review chunk, like merge_results."""
+        ids, documents, metadatas = [], [], []
+        for pid in products:
+            ids.append(profile_id(pid))
+            documents.append(f"Product Name: product {pid}\n" + "p" * profile_chars)
+            metadatas.append({"kind": "profile", "product_id": pid})
+        for pid in products:
+            for n in range(reviews_per_product):
+                ids.append(f"product_reviews_{pid}_{n}")
+                documents.append(f"Customer reviews of product {pid} ({n}):\n" + "r" * review_chars)
+                metadatas.append({"kind": "reviews", "product_id": pid, "chunk": n})
+        return {"ids": [ids], "documents": [documents], "metadatas": [metadatas]}
+
+    def test_budget_is_never_exceeded(self):
+        results = self.results(range(1, 6))
+        for budget in range(1, 800, 13):
+            for max_products, chunks in ((1, 0), (3, 2), (5, 3)):
+                with self.subTest(budget=budget, max_products=max_products, chunks=chunks):
+                    context = assemble_context(results, max_products, budget, chunks)
+                    self.assertTrue(context)
+                    self.assertLessEqual(estimate_tokens(context), budget)
+
+    def test_profiles_come_before_review_chunks(self):
+        results = self.results([7, 3, 9])
+        profile_tokens = sum(estimate_tokens(doc + "\n\n") for doc in results["documents"][0][:3])
+        cases = [
+            # budget, products kept in order, review chunks kept per product
+            (profile_tokens, [7, 3, 9], [0, 0, 0]),
+            (profile_tokens + 90, [7, 3, 9], [1, 0, 0]),
+            (profile_tokens + 180, [7, 3, 9], [2, 0, 0]),
+            (profile_tokens + 270, [7, 3, 9], [2, 1, 0]),
+            (10_000, [7, 3, 9], [2, 2, 2]),
+        ]
+        for budget, order, kept in cases:
+            with self.subTest(budget=budget):
+                blocks = assemble_context(results, 3, budget, chunks_per_product=2).split("\n\n")
+                self.assertEqual([block.split("\n")[0] for block in blocks],
+                                 [f"Product Name: product {pid}" for pid in order])
+                self.assertEqual([block.count("Customer reviews") for block in blocks], kept)
+                for block in blocks:
+                    # Within a product, its facts come first
+                    self.assertTrue(block.startswith("Product Name:"))
+
+    def test_duplicates_and_extra_products_are_dropped(self):
+        results = self.results([1, 2, 3], reviews_per_product=1)
+        for key in ("ids", "documents", "metadatas"):
+            results[key][0].append(results[key][0][0])
+        context = assemble_context(results, 2, 10_000)
+        self.assertEqual(context.count("Product Name: product 1"), 1)
+        self.assertNotIn("product 3", context)
+
+    def test_build_review_chunks(self):
+        product = {"name": "toor dal", "vendor_username": "mill"}
+        header = "Customer reviews of toor dal (sold by mill):"
+        cases = [
+            # reviews, max_chars, chunks (as review lists)
+            ([], 100, []),
+            (["5/5 - great"], 100, [["5/5 - great"]]),
+            (["5/5 - great  \n taste", "4/5 - ok"], 100, [["5/5 - great taste", "4/5 - ok"]]),
+            (["5/5 - " + "a" * 30, "4/5 - " + "b" * 30], 90, [["5/5 - " + "a" * 30], ["4/5 - " + "b" * 30]]),
+            # An over-long comment is cut to fit a chunk on its own
+            (["1/5 - " + "c" * 200, "2/5 - short"], 100, [["1/5 - " + "c" * 47], ["2/5 - short"]]),
+        ]
+        for reviews, max_chars, expected in cases:
+            with self.subTest(reviews=reviews, max_chars=max_chars):
+                chunks = build_review_chunks({**product, "recent_reviews": REVIEW_SEPARATOR.join(reviews)}, max_chars)
+                self.assertEqual(chunks, ["\n- ".join([header, *lines]) for lines in expected])
+                for chunk in chunks:
+                    self.assertLessEqual(len(chunk), max_chars)
+
+
+class SemanticCacheTests(SimpleTestCase):
+
+    @staticmethod
+    def at(degrees, scale=1.0):
+        """2-d embedding at ``degrees``: cosine similarity to ``at(0)`` is cos(degrees)."""
+        radians = np.radians(degrees)
+        return [scale * np.cos(radians), scale * np.sin(radians)]
+
+    def test_threshold(self):
+        cases = [
+            # threshold, angle from the cached query, hit
+            (0.95, 0, True),
+            (0.95, 15, True),    # cos 15° = 0.966
+            (0.95, 20, False),   # cos 20° = 0.940
+            (0.99, 5, True),     # cos 5° = 0.996
+            (0.99, 10, False),   # cos 10° = 0.985
+            (0.5, 59, True),
+            (0.5, 61, False),
+        ]
+        for threshold, angle, hit in cases:
+            with self.subTest(threshold=threshold, angle=angle):
+                cache = SemanticCache(threshold, max_entries=4)
+                # Length does not matter, only direction
+                cache.set(self.at(0, scale=3.0), "v1", "Toor dal")
+                self.assertEqual(cache.get(self.at(angle), "v1"), "Toor dal" if hit else None)
+                self.assertEqual(cache.stats()["hits"], int(hit))
+
+    def test_guard(self):
+        cache = SemanticCache(0.95, max_entries=4)
+        cache.set(self.at(0), "v1", "under 100", guard="price_max=100")
+        cache.set(self.at(2), "v1", "under 200", guard="price_max=200")
+        cases = [
+            ("price_max=100", "under 100"),
+            ("price_max=200", "under 200"),
+            ("", None),
+            ("price_max=300", None),
+        ]
+        for guard, answer in cases:
+            with self.subTest(guard=guard):
+                self.assertEqual(cache.get(self.at(1), "v1", guard), answer)
+
+    def test_most_similar_entry_wins(self):
+        cache = SemanticCache(0.9, max_entries=4)
+        for angle in (0, 10, 20):
+            cache.set(self.at(angle), "v1", f"answer {angle}")
+        for angle, answer in ((2, "answer 0"), (9, "answer 10"), (24, "answer 20")):
+            with self.subTest(angle=angle):
+                self.assertEqual(cache.get(self.at(angle), "v1"), answer)
+
+    def test_evicts_least_recently_used(self):
+        cache = SemanticCache(0.99, max_entries=3)
+        for angle in (0, 30, 60):
+            cache.set(self.at(angle), "v1", f"answer {angle}")
+        cache.get(self.at(0), "v1")      # 30 is now the least recently used
+        cache.set(self.at(90), "v1", "answer 90")
+        cases = [(0, "answer 0"), (30, None), (60, "answer 60"), (90, "answer 90")]
+        for angle, answer in cases:
+            with self.subTest(angle=angle):
+                self.assertEqual(cache.get(self.at(angle), "v1"), answer)
+        self.assertEqual(cache.stats()["entries"], 3)
+
+    def test_new_index_version_clears_entries(self):
+        cases = [
+            # version of the lookup, answer, entries left
+            ("v1", "Toor dal", 2),
+            ("v2", None, 0),
+            ("v1", None, 0),   # going back does not bring old answers back either
+        ]
+        cache = SemanticCache(0.95, max_entries=4)
+        cache.set(self.at(0), "v1", "Toor dal")
+        cache.set(self.at(45), "v1", "Basmati")
+        for version, answer, entries in cases:
+            with self.subTest(version=version):
+                self.assertEqual(cache.get(self.at(0), version), answer)
+                self.assertEqual(cache.stats()["entries"], entries)
+
+    def test_disabled(self):
+        cache = SemanticCache(0.95, max_entries=0)
+        cache.set(self.at(0), "v1", "Toor dal")
+        self.assertIsNone(cache.get(self.at(0), "v1"))
+
+
+class RatingTotalsTests(TestCase):
+    """Product.rating_sum / rating_count follow every Feedback write."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = CustomUser.objects.create(username="mill", is_vendor=True)
+        cls.retailer = CustomUser.objects.create(username="shop", is_retailer=True)
+        cls.dal, cls.rice = [
+            Product.objects.create(vendor=cls.vendor, name=name, price=50, quantity=10) for name in ("dal", "rice")
+        ]
+
+    def order(self, status="delivered"):
+        return Order.objects.create(retailer=self.retailer, total_price=100, status=status)
+
+    def rate(self, product, rating, order=None):
+        return Feedback.objects.create(order=order or self.order(), product=product, vendor=self.vendor,
+                                       retailer=self.retailer, rating=rating)
+
+    def totals(self, product):
+        product.refresh_from_db()
+        return product.rating_sum, product.rating_count
+
+    def test_add_rating(self):
+        self.dal.add_rating(4)
+        self.dal.add_rating(1)
+        self.assertEqual(self.totals(self.dal), (5, 2))
+        self.assertEqual(self.dal.avg_rating, 2.5)
+        self.assertEqual(self.totals(self.rice), (0, 0))
+        self.assertIsNone(self.rice.avg_rating)
+
+    def test_feedback_writes_keep_totals(self):
+        first = self.rate(self.dal, 5)
+        second = self.rate(self.dal, 3)
+        self.rate(self.rice, 2)
+        self.assertEqual(self.totals(self.dal), (8, 2))
+        second.rating = 1
+        second.save()
+        self.assertEqual(self.totals(self.dal), (6, 2))
+        first.delete()
+        self.assertEqual(self.totals(self.dal), (1, 1))
+        # Cascades from the order count too
+        second.order.delete()
+        self.assertEqual(self.totals(self.dal), (0, 0))
+        self.assertEqual(self.totals(self.rice), (2, 1))
+        self.rice.delete()
+        self.assertFalse(Feedback.objects.exists())
+
+    def test_order_feedback_counts_each_rating_once(self):
+        order = self.order()
+        for product in (self.dal, self.rice):
+            OrderItem.objects.create(order=order, product=product, vendor=self.vendor, quantity=1,
+                                     price_at_order_time=50, delivered=True)
+        items = {item.product_id: item.id for item in order.items.all()}
+        self.client.force_login(self.retailer)
+        self.client.post(reverse('order_feedback', args=[order.id]),
+                         {f"rating_{items[self.dal.id]}": "4", f"rating_{items[self.rice.id]}": "2"})
+        self.assertEqual(self.totals(self.dal), (4, 1))
+        self.assertEqual(self.totals(self.rice), (2, 1))
+
+    def test_backfill_migration(self):
+        self.rate(self.dal, 5)
+        self.rate(self.dal, 2)
+        Product.objects.update(rating_sum=7, rating_count=9)
+        migration = importlib.import_module("ecomApp.migrations.0008_product_rating_totals")
+        migration.backfill_ratings(django_apps, None)
+        self.assertEqual(self.totals(self.dal), (7, 2))
+        self.assertEqual(self.totals(self.rice), (0, 0))
+
+    def test_rebuild_product_ratings(self):
+        self.rate(self.dal, 4)
+        out = io.StringIO()
+        call_command("rebuild_product_ratings", "--check", stdout=out)
+        self.assertIn("consistent", out.getvalue())
+
+        Product.objects.filter(pk=self.dal.pk).update(rating_sum=0, rating_count=0)
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, "1 product(s) have stale rating totals"):
+            call_command("rebuild_product_ratings", "--check", stdout=out)
+        self.assertIn(f"product {self.dal.id}: expected sum=4 count=1", out.getvalue())
+        self.assertEqual(self.totals(self.dal), (0, 0))
+
+        out = io.StringIO()
+        call_command("rebuild_product_ratings", stdout=out)
+        self.assertIn("Fixed rating totals of 1 product(s).", out.getvalue())
+        self.assertEqual(self.totals(self.dal), (4, 1))
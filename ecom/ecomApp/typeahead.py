@@ -0,0 +1,323 @@
+"""In-memory prefix index behind the catalog search box suggestions.
+
+* Every word position of every product name is a key in one sorted list, so
+  "dal lo" finds "Toor Dal Loose". A lookup is a ``bisect`` plus a short scan,
+  with no database query. Only products on sale (available and in stock) are
+  listed. Each vendor's products also get a list of their own, for the search
+  on vendor pages. Category and vendor names live in a small list of their
+  own, rebuilt only when one of them changes.
+* Lookups never build or update anything. They read the current ``Snapshot``
+  and at most wake the ``typeahead`` worker thread, which builds new lists and
+  swaps them in whole. Until the first build finishes, there are no suggestions.
+* The worker rebuilds everything every ``TYPEAHEAD_REBUILD_INTERVAL`` seconds.
+  In between, it follows product writes through the catalog generation (see
+  catalog_cache.py): when that changes, it re-reads only the products updated
+  since its last read. Checks happen at most every
+  ``TYPEAHEAD_REFRESH_INTERVAL`` seconds.
+* Hard deletes are applied at the next update in the deleting process
+  (signals.py). Other processes drop them at the next full rebuild.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.urls import reverse
+
+from .catalog_cache import catalog_generation
+from .search import TERM_RE
+
+logger = logging.getLogger(__name__)
+
+KIND_ORDER = {"product": 0, "category": 1, "vendor": 2}
+# Most entries looked at per list and lookup, which bounds its cost for very short prefixes
+MAX_SCAN = 1000
+# Entries copied per step when a list is rebuilt around changes, so lookups on other
+# threads get the GIL back between steps
+COPY_CHUNK = 65536
+
+
+def normalize(text: str) -> str:
+    return " ".join(TERM_RE.findall(text.lower()))
+
+
+def word_keys(label: str) -> list:
+    """Normalized suffixes of ``label`` starting at each word, the whole name first."""
+    words = TERM_RE.findall(label.lower())
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+def make_ref(label: str, url: str, vendor_id=None) -> tuple:
+    """``(label, url, vendor_id, name key length)``, as kept for each indexed name."""
+    keys = word_keys(label)
+    return label, url, vendor_id, len(keys[0]) if keys else 0
+
+
+def ref_entries(kind: str, ref_id: int, ref: tuple) -> list:
+    return [(key, kind, ref_id) for key in word_keys(ref[0])]
+
+
+def replace_entries(entries: list, stale, fresh) -> list:
+    """A new sorted list: ``entries`` without the ``stale`` entries, plus the ``fresh`` ones.
+
+    Each change is placed with a ``bisect``; the runs of ``entries`` between them
+    are copied over in ``COPY_CHUNK`` slices, which keeps this O(n) without one
+    long sort or copy.
+    """
+    edits = []  # (index in entries, 0 to insert before it or 1 to drop it, entry)
+    for entry in stale:
+        index = bisect.bisect_left(entries, entry)
+        if index < len(entries) and entries[index] == entry:
+            edits.append((index, 1, entry))
+    edits.extend((bisect.bisect_left(entries, entry), 0, entry) for entry in fresh)
+    edits.sort()
+
+    result, position = [], 0
+
+    def copy_to(end):
+        for start in range(position, end, COPY_CHUNK):
+            result.extend(entries[start:min(start + COPY_CHUNK, end)])
+
+    for index, drop, entry in edits:
+        if index < position:
+            continue  # the same stale entry twice
+        copy_to(index)
+        if drop:
+            position = index + 1
+        else:
+            result.append(entry)
+            position = index
+    copy_to(len(entries))
+    return result
+
+
+class Snapshot:
+    """Sorted ``(key, kind, ref_id)`` lists and their refs, never changed once published.
+
+    ``product_refs`` maps a product id to its ref (see ``make_ref``), ``name_refs``
+    maps ``(kind, id)`` for categories and vendors. Updates build new dicts along
+    with the new lists, so a lookup sees the refs of every entry it reads.
+    """
+
+    def __init__(self, products=None, vendor_products=None, product_refs=None, names=None, name_refs=None):
+        self.products = products or []
+        self.vendor_products = vendor_products or {}
+        self.product_refs = product_refs or {}
+        self.names = names or []
+        self.name_refs = name_refs or {}
+
+
+class TypeaheadIndex:
+    """The current ``Snapshot`` plus the worker thread that replaces it."""
+
+    def __init__(self, refresh_interval: float = 5.0, rebuild_interval: float = 600.0):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.reset()
+
+    def reset(self):
+        """Start over with an empty index and no worker (also used after ``fork()``)."""
+        self.snapshot = Snapshot()
+        self.condition = threading.Condition()
+        self.worker = None
+        self.pending = None  # "rebuild" or "check"
+        self.removed = set()
+        # When a rebuild and a check were last requested
+        self.built_at = None
+        self.checked_at = 0.0
+        # Worker state
+        self.generation = None
+        self.watermark = None
+        self.name_rows = None
+
+    # -- scheduling (request threads) ---------------------------------------------
+
+    def schedule(self, job=None, removed=()):
+        with self.condition:
+            if job == "rebuild" or self.pending is None:
+                self.pending = job or self.pending
+            self.removed.update(removed)
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name="typeahead", daemon=True)
+                self.worker.start()
+            self.condition.notify()
+
+    def ensure_fresh(self):
+        """Wakes the worker if a rebuild or a change check is due; never waits for it."""
+        now = time.monotonic()
+        if self.built_at is None or now - self.built_at > self.rebuild_interval:
+            self.built_at = self.checked_at = now
+            self.schedule("rebuild")
+        elif now - self.checked_at > self.refresh_interval:
+            self.checked_at = now
+            self.schedule("check")
+
+    def remove_product(self, product_id: int):
+        # A process that never served a suggestion has nothing to remove it from.
+        if self.built_at is not None:
+            self.schedule(removed=[product_id])
+
+    # -- worker ---------------------------------------------------------------------
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.removed:
+                    self.condition.wait()
+                job, self.pending = self.pending, None
+                removed, self.removed = self.removed, set()
+            try:
+                self.update(job, removed)
+            except Exception:
+                logger.exception("Updating the typeahead index failed")
+            finally:
+                connection.close()
+
+    def update(self, job, removed=()):
+        """Runs one ``job`` ("rebuild", "check" or None) plus the ``removed`` product deletes."""
+        if job == "rebuild":
+            try:
+                self.rebuild()
+            except Exception:
+                self.built_at = None  # the next lookup asks again
+                raise
+            return
+        if self.generation is None:
+            return  # the first build has not finished; it reads current rows anyway
+        generation = catalog_generation() if job == "check" else self.generation
+        if generation != self.generation:
+            self.refresh(generation, removed)
+        elif removed:
+            self.refresh(generation, removed, read=False)
+
+    def rebuild(self):
+        from .models import Product
+        # Read first: a write landing during the build triggers a refresh.
+        generation = catalog_generation()
+        watermark = Product.objects.order_by('-updated_at').values_list('updated_at', flat=True).first()
+        products, vendor_products, refs = [], defaultdict(list), {}
+        rows = Product.objects.filter(available=True, quantity__gt=0).values_list('id', 'name', 'vendor_id')
+        # One sort per list instead of an insort per key
+        for product_id, name, vendor_id in rows:
+            refs[product_id] = ref = make_ref(name, reverse('product_detail', args=[product_id]), vendor_id)
+            entries = ref_entries("product", product_id, ref)
+            products.extend(entries)
+            vendor_products[vendor_id].extend(entries)
+        products.sort()
+        for entries in vendor_products.values():
+            entries.sort()
+        names, name_refs = self.load_names(force=True)
+        self.snapshot = Snapshot(products, dict(vendor_products), refs, names, name_refs)
+        self.generation, self.watermark = generation, watermark
+
+    def refresh(self, generation, removed=(), read=True):
+        """Publishes lists with the products changed since the watermark and without ``removed``."""
+        from .models import Product
+        current = self.snapshot
+        rows = []
+        if read:
+            products = Product.objects.all()
+            if self.watermark is not None:
+                products = products.filter(updated_at__gte=self.watermark)
+            rows = list(products.values('id', 'name', 'vendor_id', 'available', 'quantity', 'updated_at'))
+
+        refs = current.product_refs
+        fresh_refs = {
+            row['id']: make_ref(row['name'], reverse('product_detail', args=[row['id']]), row['vendor_id'])
+            for row in rows if row['available'] and row['quantity'] > 0
+        }
+        changed = set(removed) | {row['id'] for row in rows}
+        stale = defaultdict(list)   # vendor id -> entries to drop
+        fresh = defaultdict(list)   # vendor id -> entries to add
+        for product_id in changed:
+            if product_id in refs:
+                stale[refs[product_id][2]].extend(ref_entries("product", product_id, refs[product_id]))
+            if product_id in fresh_refs:
+                fresh[fresh_refs[product_id][2]].extend(ref_entries("product", product_id, fresh_refs[product_id]))
+
+        vendor_products = dict(current.vendor_products)
+        for vendor_id in stale.keys() | fresh.keys():
+            vendor_products[vendor_id] = replace_entries(
+                vendor_products.get(vendor_id, []), stale[vendor_id], fresh[vendor_id])
+        products = replace_entries(
+            current.products, [e for entries in stale.values() for e in entries],
+            [e for entries in fresh.values() for e in entries],
+        )
+        names, name_refs = self.load_names() if read else (current.names, current.name_refs)
+
+        # Lookups may still be reading the current refs, so the new snapshot gets its own
+        product_refs = {product_id: ref for product_id, ref in refs.items() if product_id not in changed}
+        product_refs.update(fresh_refs)
+        self.snapshot = Snapshot(products, vendor_products, product_refs, names, name_refs)
+        self.generation = generation
+        for row in rows:
+            if self.watermark is None or row['updated_at'] > self.watermark:
+                self.watermark = row['updated_at']
+
+    def load_names(self, force=False):
+        """Category and vendor lists: re-read (they are few), re-sorted only if a name changed."""
+        from .models import Category, CustomUser
+        rows = (
+            tuple(Category.objects.order_by('id').values_list('id', 'name')),
+            tuple(CustomUser.objects.filter(is_vendor=True).order_by('id').values_list('id', 'username')),
+        )
+        if rows == self.name_rows and not force:
+            return self.snapshot.names, self.snapshot.name_refs
+        self.name_rows = rows
+        categories, vendors = rows
+        browse_url = reverse('browse_products')
+        name_refs = {("category", category_id): make_ref(name, f"{browse_url}?category={category_id}")
+                     for category_id, name in categories}
+        name_refs.update({("vendor", vendor_id): make_ref(username, reverse('vendor_detail', args=[vendor_id]))
+                          for vendor_id, username in vendors})
+        names = sorted(entry for (kind, ref_id), ref in name_refs.items() for entry in ref_entries(kind, ref_id, ref))
+        return names, name_refs
+
+    # -- queries ------------------------------------------------------------------
+
+    def suggest(self, text: str, limit: int = 8, vendor_id=None) -> list:
+        """Up to ``limit`` ``{"type", "label", "url"}`` matches for the typed prefix ``text``.
+
+        Names starting with it come first, then shorter names. With ``vendor_id``
+        only that vendor's products are suggested.
+        """
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        self.ensure_fresh()
+        snapshot = self.snapshot
+        if vendor_id is None:
+            sources = [(snapshot.products, snapshot.product_refs, False), (snapshot.names, snapshot.name_refs, True)]
+        else:
+            sources = [(snapshot.vendor_products.get(vendor_id, []), snapshot.product_refs, False)]
+
+        matches = {}
+        for entries, refs, by_kind in sources:
+            index = bisect.bisect_left(entries, (prefix,))
+            stop = min(index + MAX_SCAN, len(entries))
+            found = 0
+            # Scan a few times more entries than needed, so the best ones can be picked.
+            while index < stop and found < limit * 4:
+                key, kind, ref_id = entries[index]
+                if not key.startswith(prefix):
+                    break
+                index += 1
+                label, url, _, name_length = refs[(kind, ref_id) if by_kind else ref_id]
+                starts = len(key) == name_length  # matched at the first word
+                match = (not starts, KIND_ORDER[kind], len(label), label, url)
+                if (kind, ref_id) not in matches:
+                    found += 1
+                matches[(kind, ref_id)] = min(match, matches.get((kind, ref_id), match))
+        ranked = sorted((match, kind) for (kind, _), match in matches.items())[:limit]
+        return [{"type": kind, "label": label, "url": url} for (_, _, _, label, url), kind in ranked]
+
+
+typeahead_index = TypeaheadIndex(
+    refresh_interval=settings.TYPEAHEAD_REFRESH_INTERVAL,
+    rebuild_interval=settings.TYPEAHEAD_REBUILD_INTERVAL,
+)
+os.register_at_fork(after_in_child=typeahead_index.reset)
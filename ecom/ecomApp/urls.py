@@ -21,6 +21,7 @@ urlpatterns = [
     # Retailer product browsing and cart
     path('retailer/products/', views.browse_products, name='browse_products'),
     path('retailer/products/<int:id>/', views.product_detail, name='product_detail'),
+    path('retailer/search/suggest/', views.search_suggestions, name='search_suggestions'),
     path('retailer/cart/', views.cart, name='cart'),
     path('retailer/cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('retailer/cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
@@ -32,6 +33,7 @@ urlpatterns = [
     # RAG AI query
     path('ai/chat/', views.chat_ui, name='chat_ui'),
     path('ai/chat/send/', views.chat_send, name='chat_send'),
+    path('ai/chat/stats/', views.chat_stats, name='chat_stats'),
 
     # Vendor browsing for retailers
     path('retailer/vendors/', views.vendor_list, name='vendor_list'),
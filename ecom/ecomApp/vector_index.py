@@ -0,0 +1,238 @@
+"""Read-only, memory-mapped NumPy index of product profiles.
+
+An alternative to querying Chroma from every web worker. ``export_collection``
+writes the profile collection to a directory of flat files:
+
+* ``<generation>.vectors.npy``   – float32 (n, d), rows L2-normalised
+* ``<generation>.<column>.npy``  – metadata in parallel arrays (price, quantity,
+  avg_rating, product_id, chunk, and kind/category/vendor as codes into the
+  manifest's vocab)
+* ``<generation>.documents.bin`` + ``.doc_offsets.npy`` – UTF-8 profile texts
+* ``manifest.json``              – written last (atomically) and names the generation
+
+Workers open the arrays with ``mmap_mode="r"``, so the vectors are loaded once
+into the page cache and shared by every process on the machine. ``query`` has the
+same shape as ``Collection.query`` and understands the ``where`` clauses built by
+``query_filters.build_where``.
+"""
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from .indexing import INDEX_VERSION_KEY, doc_product_id, profile_id, review_chunk_ids
+
+MANIFEST = "manifest.json"
+# Held while exporting, so two processes never write (and clean up) at once
+EXPORT_LOCK = ".export.lock"
+NUMERIC_COLUMNS = {"price": np.float32, "quantity": np.int64, "avg_rating": np.float32, "product_id": np.int64,
+                   "chunk": np.int32}
+CODED_COLUMNS = ("kind", "category", "vendor")
+COMPARISONS = {
+    "$eq": np.equal, "$ne": np.not_equal,
+    "$gt": np.greater, "$gte": np.greater_equal,
+    "$lt": np.less, "$lte": np.less_equal,
+}
+
+
+def _file(path, generation, name):
+    return os.path.join(path, f"{generation}.{name}")
+
+
+@contextmanager
+def export_lock(path: str):
+    with open(os.path.join(path, EXPORT_LOCK), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def export_collection(collection, path: str, page_size: int = 1000) -> dict:
+    """Writes every profile in ``collection`` to a new index generation under ``path``.
+
+    Pages through the collection so only one page of vectors is held in memory.
+    Returns the new manifest; files of older generations are removed.
+    """
+    os.makedirs(path, exist_ok=True)
+    with export_lock(path):
+        return _export(collection, path, page_size)
+
+
+def _export(collection, path: str, page_size: int) -> dict:
+    generation = f"{time.time():.6f}".replace(".", "")
+    total = collection.count()
+    vectors = None
+    columns = {name: np.zeros(total, dtype=dtype) for name, dtype in NUMERIC_COLUMNS.items()}
+    codes = {name: np.zeros(total, dtype=np.int32) for name in CODED_COLUMNS}
+    vocab = {name: {} for name in CODED_COLUMNS}
+    offsets = np.zeros(total + 1, dtype=np.int64)
+
+    row = 0
+    with open(_file(path, generation, "documents.bin"), "wb") as documents:
+        while row < total:
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=row)
+            if not page["ids"]:
+                break
+            embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    _file(path, generation, "vectors.npy"), mode="w+", dtype=np.float32,
+                    shape=(total, embeddings.shape[1]),
+                )
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            end = row + len(embeddings)
+            vectors[row:end] = embeddings / np.where(norms == 0, 1, norms)
+            for i, (doc_id, document, metadata) in enumerate(
+                    zip(page["ids"], page["documents"], page["metadatas"]), start=row):
+                encoded = (document or "").encode("utf-8")
+                documents.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+                # Profiles embedded before metadata was stored have none; they are
+                # still searchable, they just never pass a filter.
+                metadata = {"kind": "profile", **(metadata or {}), "product_id": doc_product_id(doc_id, metadata)}
+                for name in NUMERIC_COLUMNS:
+                    columns[name][i] = metadata.get(name) or 0
+                for name in CODED_COLUMNS:
+                    codes[name][i] = vocab[name].setdefault(metadata.get(name) or "", len(vocab[name]))
+            row = end
+
+    if vectors is None:
+        vectors = np.lib.format.open_memmap(
+            _file(path, generation, "vectors.npy"), mode="w+", dtype=np.float32, shape=(0, 0)
+        )
+    vectors.flush()
+    del vectors
+    for name, values in {**columns, **codes, "doc_offsets": offsets}.items():
+        np.save(_file(path, generation, f"{name}.npy"), values[:row + 1] if name == "doc_offsets" else values[:row])
+
+    manifest = {
+        "generation": generation,
+        "count": row,
+        INDEX_VERSION_KEY: (collection.metadata or {}).get(INDEX_VERSION_KEY, ""),
+        "vocab": {name: sorted(values, key=values.get) for name, values in vocab.items()},
+    }
+    tmp = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+    # Workers that still map an old generation keep their (unlinked) files open.
+    for name in os.listdir(path):
+        if name not in (MANIFEST, EXPORT_LOCK) and not name.startswith(generation + "."):
+            os.remove(os.path.join(path, name))
+    return manifest
+
+
+def read_manifest(path: str):
+    """Manifest of the current generation at ``path`` (None if nothing was exported)."""
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def manifest_version(manifest: dict) -> str:
+    """Index version token: the exported collection's version plus the generation."""
+    return f"{manifest[INDEX_VERSION_KEY]}/{manifest['generation']}"
+
+
+class NumpyIndex:
+    """Memory-mapped view of one index generation."""
+
+    def __init__(self, path: str, manifest: dict):
+        self.path = path
+        self.manifest = manifest
+        generation = self.manifest["generation"]
+        load = lambda name: np.load(_file(path, generation, f"{name}.npy"), mmap_mode="r")
+        self.vectors = load("vectors")
+        self.columns = {name: load(name) for name in (*NUMERIC_COLUMNS, *CODED_COLUMNS)}
+        self.vocab = {name: {value: code for code, value in enumerate(values)}
+                      for name, values in self.manifest["vocab"].items()}
+        self.doc_offsets = load("doc_offsets")
+        self.documents = np.memmap(_file(path, generation, "documents.bin"), dtype=np.uint8, mode="r") \
+            if self.doc_offsets[-1] else np.zeros(0, dtype=np.uint8)
+
+    @classmethod
+    def open(cls, path: str):
+        """The index at ``path``, or None if it has not been exported yet."""
+        manifest = read_manifest(path)
+        return cls(path, manifest) if manifest else None
+
+    @property
+    def version(self) -> str:
+        return manifest_version(self.manifest)
+
+    def count(self) -> int:
+        return self.manifest["count"]
+
+    def document(self, row: int) -> str:
+        start, end = self.doc_offsets[row], self.doc_offsets[row + 1]
+        return self.documents[start:end].tobytes().decode("utf-8")
+
+    def doc_id(self, row: int) -> str:
+        product_id = self.columns["product_id"][row]
+        if self.manifest["vocab"]["kind"][self.columns["kind"][row]] == "reviews":
+            chunk = self.columns["chunk"][row]
+            return review_chunk_ids(product_id, chunk, chunk + 1)[0]
+        return profile_id(product_id)
+
+    def metadata(self, row: int) -> dict:
+        metadata = {name: self.columns[name][row].item() for name in NUMERIC_COLUMNS}
+        for name in CODED_COLUMNS:
+            metadata[name] = self.manifest["vocab"][name][self.columns[name][row]]
+        return metadata
+
+    def mask(self, where):
+        """Boolean row mask for a Chroma-style ``where`` clause (None selects every row)."""
+        if not where:
+            return None
+        if "$and" in where:
+            return np.logical_and.reduce([self.mask(clause) for clause in where["$and"]])
+        if "$or" in where:
+            return np.logical_or.reduce([self.mask(clause) for clause in where["$or"]])
+        (field, condition), = where.items()
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        (operator, value), = condition.items()
+        if field in CODED_COLUMNS:
+            if operator not in ("$eq", "$ne"):
+                raise ValueError(f"Unsupported operator {operator!r} for {field!r}")
+            value = self.vocab[field].get(value, -1)
+        elif field not in NUMERIC_COLUMNS:
+            raise ValueError(f"Unknown metadata field {field!r}")
+        return COMPARISONS[operator](self.columns[field], value)
+
+    def query(self, query_embeddings, n_results: int = 3, where=None) -> dict:
+        """Top ``n_results`` rows by cosine similarity for each query embedding.
+
+        Returns ``ids``/``documents``/``metadatas``/``distances`` (1 - cosine), one
+        list per query, like ``chromadb.Collection.query``.
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        mask = self.mask(where)
+        rows = np.arange(self.count()) if mask is None else np.flatnonzero(mask)
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if not len(rows):
+            for key in result:
+                result[key] = [[] for _ in queries]
+            return result
+
+        candidates = self.vectors if mask is None else self.vectors[rows]
+        scores = queries @ candidates.T
+        k = min(n_results, len(rows))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for query_scores, picked in zip(scores, top):
+            picked = picked[np.argsort(-query_scores[picked])]
+            hits = rows[picked]
+            result["ids"].append([self.doc_id(row) for row in hits])
+            result["documents"].append([self.document(row) for row in hits])
+            result["metadatas"].append([self.metadata(row) for row in hits])
+            result["distances"].append((1 - query_scores[picked]).tolist())
+        return result
@@ -4,32 +4,31 @@ from django.contrib import messages
 from .models import CustomUser, Product, ChatMessage, Category
 from .forms import ProductForm
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 # AI imports
-import os
-import chromadb
-import google.generativeai as genai
-from chromadb import PersistentClient
-from chromadb.errors import NotFoundError
-
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-# Initialise Gemini model once
-GEMINI_MODEL = genai.GenerativeModel("gemini-1.5-flash")
-
-# Initialize (persistent) Chroma client once per process
-# Compute project root (two levels up from this file)
-ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
-CHROMA_PATH = os.path.join(ROOT_DIR, "chroma_db")
-CHROMA_CLIENT = PersistentClient(path=CHROMA_PATH)
-try:
-    CHROMA_COLLECTION = CHROMA_CLIENT.get_collection(name="product_profiles")
-except (ValueError, NotFoundError):
-    CHROMA_COLLECTION = CHROMA_CLIENT.create_collection(name="product_profiles")
+# The provider, Chroma and the embedding store are created lazily, once per
+# process, by get_ai() (see ai.py); importing this module stays cheap.
+from django.conf import settings
+from .ai import get_ai, aget_ai, warm_up_in_background
+
+# In-memory caches for chat queries: normalized query -> embedding, and
+# (normalized query, index version) -> answer. A new index version (any profile
+# added, changed or removed) makes older answers unreachable.
+from .rag_cache import LRUCache, TTLCache, IndexVersion, SemanticCache, normalize_query
+from .query_filters import parse_constraints, build_where, choose_n_results, refers_to_history
+from .prompting import assemble_context, merge_results, retrieval_queries
+QUERY_EMBEDDING_CACHE = LRUCache(settings.AI_QUERY_EMBEDDING_CACHE_SIZE)
+ANSWER_CACHE = TTLCache(settings.AI_ANSWER_CACHE_TTL, settings.AI_ANSWER_CACHE_SIZE)
+# Paraphrased questions (cosine similarity >= AI_SEMANTIC_CACHE_THRESHOLD) reuse answers
+SEMANTIC_CACHE = SemanticCache(settings.AI_SEMANTIC_CACHE_THRESHOLD, settings.AI_SEMANTIC_CACHE_SIZE)
+# (normalized query, index version) -> retrieved product context. History-free,
+# so follow-up questions, whose answers are not cached, still reuse it.
+CONTEXT_CACHE = TTLCache(settings.AI_ANSWER_CACHE_TTL, settings.AI_ANSWER_CACHE_SIZE)
+INDEX_VERSION = IndexVersion(lambda: get_ai().index_version(), settings.AI_INDEX_VERSION_REFRESH)
 
 import json
-from django.core.paginator import Paginator
 
 def home(request):
     if request.user.is_authenticated:
@@ -86,45 +85,77 @@ def is_retailer(user):
 @user_passes_test(is_retailer, login_url='/')
 
 def browse_products(request):
-    """Retailer browse all products with optional global search."""
-    from django.db.models import Avg, Q
+    """Retailer browse all products with optional global search (ranked, see search.py) and facet filters.
+
+    The results area is cached per catalog generation and query string (see catalog_cache.py).
+    """
+    from django.template.loader import render_to_string
+    from .catalog_cache import cached_page, page_cache_key
+    from .facets import apply_filters, cached_cube, facet_counts, parse_filters
+    from .pagination import CursorPaginator
+    from .search import fts_available, search_products
 
     search_query = request.GET.get('search', '').strip()
 
-    products_qs = Product.objects.filter(available=True, quantity__gt=0)
-    if search_query:
-        products_qs = products_qs.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(category__name__icontains=search_query) |
-            Q(vendor__username__icontains=search_query)
-        )
+    def render_results():
+        filters = parse_filters(request.GET)
+        catalog_qs = Product.objects.filter(available=True, quantity__gt=0)
+        products_qs = apply_filters(catalog_qs, filters).select_related('vendor')
+        ordering = ('created_at', 'id')
+        if search_query:
+            products_qs = search_products(products_qs, search_query)
+            if fts_available():
+                ordering = ('search_rank', 'id')
 
-    products_qs = products_qs.annotate(avg_rating=Avg('feedbacks__rating'))
+        page_obj = CursorPaginator(products_qs, 9, ordering).get_page(request.GET.get('cursor'))
+        facets = facet_counts(cached_cube(catalog_qs, search_query), filters)
 
-    paginator = Paginator(products_qs, 9)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        # Query strings for links that keep the search and the other filters
+        params = request.GET.copy()
+        params.pop('cursor', None)
+        for name, options in facets.items():
+            for option in options:
+                link = params.copy()
+                if option['selected'] or option['value'] is None:
+                    link.pop(name, None)
+                else:
+                    link[name] = option['value']
+                option['query'] = link.urlencode()
+
+        return render_to_string('browse_results.html', {
+            'page_obj': page_obj,
+            'products': page_obj.object_list,
+            'facets': facets,
+            'filter_query': params.urlencode(),
+            'cache_timeout': settings.CATALOG_CACHE_TIMEOUT,
+        })
 
     return render(request, 'browse_products.html', {
-        'page_obj': page_obj,
-        'products': page_obj.object_list,
+        'results': cached_page(page_cache_key('browse', request.GET), render_results),
         'search_query': search_query,
     })
 
+@login_required
+@user_passes_test(is_retailer, login_url='/')
+def search_suggestions(request):
+    """Typeahead JSON for the catalog search boxes, served from the in-memory prefix index."""
+    from .typeahead import typeahead_index
+    vendor = request.GET.get('vendor', '')
+    suggestions = typeahead_index.suggest(
+        request.GET.get('q', ''), vendor_id=int(vendor) if vendor.isdigit() else None
+    )
+    return JsonResponse({'suggestions': suggestions})
+
 @login_required
 @user_passes_test(is_retailer, login_url='/')
 def product_detail(request, id):
     from django.shortcuts import get_object_or_404
-    from .models import Feedback
-    from django.db.models import Avg
     product = get_object_or_404(Product, id=id, available=True)
     feedbacks = product.feedbacks.select_related('retailer')
-    avg_rating = feedbacks.aggregate(avg=Avg('rating'))['avg']
     return render(request, 'product_detail.html', {
         'product': product,
         'feedbacks': feedbacks,
-        'avg_rating': avg_rating
+        'avg_rating': product.avg_rating
     })
 
 @login_required
@@ -223,6 +254,7 @@ def update_cart_quantity(request, item_id):
 @user_passes_test(is_retailer, login_url='/')
 def checkout(request):
     from .models import Cart, CartItem, Order, OrderItem
+    from .sales_rollup import record_order
     from django.db import transaction
     from decimal import Decimal
     
@@ -253,18 +285,20 @@ def checkout(request):
                 status='pending'
             )
             # Create order items and reduce stock
+            order_items = []
             for item in cart_items:
-                OrderItem.objects.create(
+                order_items.append(OrderItem.objects.create(
                     order=order,
                     product=item.product,
                     vendor=item.product.vendor,
                     quantity=item.quantity,
                     price_at_order_time=item.product.price,
                     added_by='AI' if item.auto_added else 'Manual'
-                )
+                ))
                 # Decrease product stock
                 item.product.quantity -= item.quantity
                 item.product.save()
+            record_order(order, order_items)
             # Clear cart and items
             cart_items.delete()
             cart.delete()
@@ -298,11 +332,14 @@ def order_feedback(request, order_id):
     # one feedback per vendor per order
     items = OrderItem.objects.select_related('product').filter(order=order, product__available=True)
     if request.method == 'POST':
-        for item in items:
-            rating = int(request.POST.get(f'rating_{item.id}', '5'))
-            comment = request.POST.get(f'comment_{item.id}', '')
-            Feedback.objects.create(order=order, product=item.product, vendor=item.product.vendor,
-                                    retailer=request.user, rating=rating, comment=comment)
+        from django.db import transaction
+        # Feedback rows and the products' rating totals (see signals.py) are saved together or not at all
+        with transaction.atomic():
+            for item in items:
+                rating = int(request.POST.get(f'rating_{item.id}', '5'))
+                comment = request.POST.get(f'comment_{item.id}', '')
+                Feedback.objects.create(order=order, product=item.product, vendor=item.product.vendor,
+                                        retailer=request.user, rating=rating, comment=comment)
         messages.success(request, 'Thank you for rating the products!')
         return redirect('retailer_order_history')
     return render(request, 'order_feedback.html', {'order': order, 'items': items})
@@ -311,12 +348,10 @@ def retailer_order_history(request):
     from .models import Order, OrderItem
     from decimal import Decimal
     
-    # Get all orders for this retailer
-    orders_qs = Order.objects.filter(retailer=request.user).order_by('-created_at')
-    from django.core.paginator import Paginator
-    paginator = Paginator(orders_qs, 5)
-    page_number = request.GET.get('page')
-    orders = paginator.get_page(page_number)
+    # Get all orders for this retailer, newest first
+    orders_qs = Order.objects.filter(retailer=request.user)
+    from .pagination import CursorPaginator
+    orders = CursorPaginator(orders_qs, 5, ('-created_at', '-id')).get_page(request.GET.get('cursor'))
     
     # Group orders with their items
     orders_with_items = []
@@ -360,31 +395,39 @@ def vendor_overview(request):
 @user_passes_test(is_vendor, login_url='/')
 def vendor_orders(request):
     """List orders for vendor's products"""
+    from django.db.models import Prefetch
     from .models import OrderItem, Order, Feedback
-    order_items = OrderItem.objects.select_related('order', 'product').filter(product__vendor=request.user).order_by('-order__created_at')
-    orders_dict = {}
-    for item in order_items:
-        oid = item.order.id
-        if oid not in orders_dict:
-            orders_dict[oid] = {
-                'order': item.order,
-                'retailer': item.order.retailer,
-                'items': [],
-                'feedbacks': [],
-            }
-        fb = Feedback.objects.filter(order=item.order, product=item.product).first()
-        item.order_rating = fb.rating if fb else None
-        orders_dict[oid]['items'].append(item)
-        orders_dict[oid]['feedbacks'] = Feedback.objects.filter(order=item.order, vendor=request.user)
-    orders_list = list(orders_dict.values())
-    from django.core.paginator import Paginator
-    paginator = Paginator(orders_list, 5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    from .pagination import CursorPaginator
+    # One page of order ids from the database, then this vendor's items and feedback for those
+    # orders in one query each: the query count does not depend on the vendor's history.
+    orders_qs = (
+        Order.objects.filter(items__vendor=request.user).distinct()
+        .select_related('retailer')
+        .prefetch_related(
+            Prefetch('items', to_attr='vendor_items',
+                     queryset=OrderItem.objects.filter(vendor=request.user).select_related('product').order_by('id')),
+            Prefetch('feedbacks', to_attr='vendor_feedbacks',
+                     queryset=Feedback.objects.filter(vendor=request.user).order_by('id')),
+        )
+    )
+    page_obj = CursorPaginator(orders_qs, 5, ('-created_at', '-id')).get_page(request.GET.get('cursor'))
+    orders = []
+    for order in page_obj:
+        ratings = {}
+        for fb in order.vendor_feedbacks:
+            ratings.setdefault(fb.product_id, fb.rating)
+        for item in order.vendor_items:
+            item.order_rating = ratings.get(item.product_id)
+        orders.append({
+            'order': order,
+            'retailer': order.retailer,
+            'items': order.vendor_items,
+            'feedbacks': order.vendor_feedbacks,
+        })
     status_choices = Order.STATUS_CHOICES
     return render(request, 'vendor_orders.html', {
         'page_obj': page_obj,
-        'orders': page_obj.object_list,
+        'orders': orders,
         'status_choices': status_choices,
     })
 
@@ -394,40 +437,46 @@ def vendor_orders(request):
 def vendor_dashboard(request):
     """Vendor Dashboard - Analytics overview only"""
     from .models import Product
-    from django.db.models import Avg
-    total_products = Product.objects.filter(vendor=request.user).count()
-    low_stock_products = Product.objects.filter(vendor=request.user, quantity__lt=10).count()
-    avg_price = Product.objects.filter(vendor=request.user).aggregate(avg=Avg('price'))['avg'] or 0
+    from django.db.models import Avg, Count, Q, Sum
+    # Inventory stats in one pass over the vendor's products; the overall rating
+    # comes from their running totals (see Product.add_rating).
+    inventory = Product.objects.filter(vendor=request.user).aggregate(
+        total=Count('id'), low_stock=Count('id', filter=Q(quantity__lt=10)), avg_price=Avg('price'),
+        rating_sum=Sum('rating_sum'), rating_count=Sum('rating_count'),
+    )
+    total_products = inventory['total']
+    low_stock_products = inventory['low_stock']
+    avg_price = inventory['avg_price'] or 0
     best_priced = Product.objects.filter(vendor=request.user).order_by('price').first()
 
-    # --- Sales & Performance Metrics (last 30 days) ---
+    # --- Sales & Performance Metrics (last 30 days, today included) ---
+    # Read from the daily rollups (see sales_rollup.py): at most 30 rows per vendor
+    # and a few per product, however long the order history is.
     from datetime import timedelta
     from django.utils import timezone
-    from django.db.models import Sum, F, DecimalField, Avg, Count
-    from .models import OrderItem, Order, Feedback
-    now = timezone.now()
-    last_30 = now - timedelta(days=30)
-    last_7 = now - timedelta(days=7)
+    from .models import VendorDailySales, VendorProductDailySales
+    first_day = timezone.localdate() - timedelta(days=29)
 
-    order_items_30 = OrderItem.objects.select_related('order').filter(
-        product__vendor=request.user,
-        order__created_at__gte=last_30
+    sales = VendorDailySales.objects.filter(vendor=request.user, day__gte=first_day).aggregate(
+        revenue=Sum('revenue'), units=Sum('units'), orders=Sum('orders'),
     )
-    sales_30 = order_items_30.aggregate(total=Sum(F('quantity') * F('price_at_order_time'), output_field=DecimalField()))['total'] or 0
-    units_30 = order_items_30.aggregate(total=Sum('quantity'))['total'] or 0
-
-    orders_30 = Order.objects.filter(items__product__vendor=request.user, created_at__gte=last_30).distinct()
-    order_count_30 = orders_30.count()
+    sales_30 = sales['revenue'] or 0
+    units_30 = sales['units'] or 0
+    order_count_30 = sales['orders'] or 0
     aov_30 = (sales_30 / order_count_30) if order_count_30 else 0
 
     # Order pipeline snapshot
-    pending_orders = Order.objects.filter(items__product__vendor=request.user, status='pending').distinct().count()
+    pending_orders = VendorDailySales.objects.filter(vendor=request.user, pending_orders__gt=0).aggregate(
+        total=Sum('pending_orders'))['total'] or 0
 
     # Feedback metrics
-    avg_rating_overall = Feedback.objects.filter(vendor=request.user).aggregate(avg=Avg('rating'))['avg'] or 0
+    avg_rating_overall = (inventory['rating_sum'] / inventory['rating_count']) if inventory['rating_count'] else 0
 
     # Top 5 products by units sold (last 30 days)
-    top_products = list(order_items_30.values('product__name').annotate(units=Sum('quantity')).order_by('-units')[:5])
+    top_products = list(
+        VendorProductDailySales.objects.filter(vendor=request.user, day__gte=first_day)
+        .values('product__name').annotate(units=Sum('units')).order_by('-units')[:5]
+    )
     return render(request, 'vendor_dashboard.html', {
         # Core inventory stats
         'total_products': total_products,
@@ -450,7 +499,10 @@ def vendor_dashboard(request):
 @user_passes_test(is_vendor, login_url='/')
 def update_order_status(request, order_id):
     from .models import Order, OrderItem
+    from .sales_rollup import record_status_change
+    from django.db import transaction
     order = Order.objects.get(id=order_id)
+    old_status = order.status
     # If order already delivered, do not allow further modifications
     if order.status == 'delivered':
         messages.info(request, 'Order already delivered. Status can no longer be changed.')
@@ -467,19 +519,25 @@ def update_order_status(request, order_id):
             # If ALL items in the order are delivered, close the order
             if not OrderItem.objects.filter(order=order, delivered=False).exists():
                 order.status = 'delivered'
-                order.save()
+                with transaction.atomic():
+                    order.save()
+                    record_status_change(order, old_status)
             messages.success(request, "Delivery status updated.")
         else:
             # allow vendor to mark his items processing/dispatched etc.
             order.status = status
-            order.save()
+            with transaction.atomic():
+                order.save()
+                record_status_change(order, old_status)
     return redirect('vendor_dashboard')
 
 @login_required
 @user_passes_test(is_vendor, login_url='/')
 def vendor_products(request):
     from .models import Product, Category
-    from django.db.models import Avg, Min, Max
+    from django.db.models import Avg, Count, Q
+    from .catalog_cache import vendor_price_bounds
+    from .pagination import CursorPaginator
     # Fetch all categories for dropdown
     categories = Category.objects.all()
     # Get filter params
@@ -488,7 +546,7 @@ def vendor_products(request):
     category_id = request.GET.get('category')
     stock = request.GET.get('stock')  # 'in' or 'out'
     sort = request.GET.get('sort')  # 'price', 'date', 'quantity'
-    products = Product.objects.filter(vendor=request.user).annotate(avg_rating=Avg('feedbacks__rating'))
+    products = Product.objects.filter(vendor=request.user)
     # Filter by price
     if price_min:
         products = products.filter(price__gte=price_min)
@@ -502,28 +560,28 @@ def vendor_products(request):
         products = products.filter(quantity__gt=0)
     elif stock == 'out':
         products = products.filter(quantity=0)
-    # Sorting
-    if sort == 'price':
-        products = products.order_by('price')
-    elif sort == 'date':
-        products = products.order_by('-created_at')
-    elif sort == 'quantity':
-        products = products.order_by('quantity')
-    # Analytics
-    total_products = products.count()
-    low_stock_products = products.filter(quantity__lt=10).count()
-    avg_price = products.aggregate(avg=Avg('price'))['avg'] or 0
-    best_priced = products.order_by('price').first()
-    # For price slider range
-    min_price = Product.objects.filter(vendor=request.user).aggregate(min=Min('price'))['min'] or 0
-    max_price = Product.objects.filter(vendor=request.user).aggregate(max=Max('price'))['max'] or 0
+    # Sorting, with id as the tie-breaker the cursor pagination needs
+    ordering = {
+        'price': ('price', 'id'),
+        'quantity': ('quantity', 'id'),
+    }.get(sort, ('-created_at', '-id'))
+    page_obj = CursorPaginator(products, 20, ordering).get_page(request.GET.get('cursor'))
+    # Analytics of all filtered products in one query
+    stats = products.aggregate(
+        total=Count('id'), low_stock=Count('id', filter=Q(quantity__lt=10)), avg_price=Avg('price'),
+    )
+    # For price slider range (cached per vendor, dropped on product writes)
+    min_price, max_price = vendor_price_bounds(request.user.id)
+    params = request.GET.copy()
+    params.pop('cursor', None)
     return render(request, 'vendor_products.html', {
-        'products': products,
+        'page_obj': page_obj,
+        'products': page_obj.object_list,
+        'filter_query': params.urlencode(),
         'categories': categories,
-        'total_products': total_products,
-        'low_stock_products': low_stock_products,
-        'avg_price': avg_price,
-        'best_priced': best_priced,
+        'total_products': stats['total'],
+        'low_stock_products': stats['low_stock'],
+        'avg_price': stats['avg_price'] or 0,
         'min_price': min_price,
         'max_price': max_price,
         'selected_category': category_id or 'all',
@@ -585,10 +643,8 @@ def logout_view(request):
 def vendor_list(request):
     """Display list of all vendors for retailers to browse"""
     vendors_qs = CustomUser.objects.filter(is_vendor=True)
-    from django.core.paginator import Paginator
-    paginator = Paginator(vendors_qs, 9)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    from .pagination import CursorPaginator
+    page_obj = CursorPaginator(vendors_qs, 9, ('date_joined', 'id')).get_page(request.GET.get('cursor'))
     # annotate product_count lazily
     vendors = list(page_obj.object_list)
     for vendor in vendors:
@@ -602,40 +658,65 @@ def vendor_list(request):
 @login_required
 @user_passes_test(lambda u: getattr(u, 'is_retailer', False), login_url='/')
 def vendor_detail(request, vendor_id):
-    """Display specific vendor's products for retailers"""
+    """Display specific vendor's products for retailers.
+
+    The product grid, its count and the category dropdown are cached per catalog generation
+    and query string like browse_products. The add-to-cart forms hold a marker that is replaced by this user's CSRF input on each request.
+    """
     from django.shortcuts import get_object_or_404
-    
+    from django.template.loader import render_to_string
+    from django.template.backends.utils import csrf_input
+    from django.utils.safestring import mark_safe
+    from .catalog_cache import CSRF_MARKER, cached_page, page_cache_key
+
     vendor = get_object_or_404(CustomUser, id=vendor_id, is_vendor=True)
-    products = Product.objects.filter(vendor=vendor, available=True).select_related('category')
-    
-        # Search & filter functionality
-    from django.db.models import Q
     search_query = request.GET.get('search', '').strip()
     category_filter = request.GET.get('category', '').strip()
 
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | Q(description__icontains=search_query)
-        )
-        # Inform user if no matching item found for this vendor
-        if not products.exists():
-            messages.info(request, f'"{search_query}" is not available from {vendor.username}.')
-    
-    if category_filter:
-        products = products.filter(category__name=category_filter)
-    
-    # Get categories for filter dropdown
-    categories = Category.objects.filter(
-        products__vendor=vendor, 
-        products__available=True
-    ).distinct()
-    
+    def render_results():
+        # Every query of the page runs here, so a cache hit only costs the vendor lookup above.
+        products = Product.objects.filter(vendor=vendor, available=True).select_related('category')
+
+        # Search & filter functionality
+        from .search import search_products
+        unmatched = False
+        if search_query:
+            products = search_products(products, search_query, columns=("name", "description"))
+            unmatched = not products.exists()
+
+        if category_filter:
+            products = products.filter(category__name=category_filter)
+
+        # Get categories for filter dropdown
+        categories = Category.objects.filter(
+            products__vendor=vendor,
+            products__available=True
+        ).distinct()
+
+        return {
+            'product_count': products.count(),
+            'categories': list(categories),
+            'unmatched': unmatched,
+            'html': render_to_string('vendor_detail_results.html', {
+                'vendor': vendor,
+                'products': products,
+                'search_query': search_query,
+                'category_filter': category_filter,
+                'cache_timeout': settings.CATALOG_CACHE_TIMEOUT,
+            }),
+        }
+
+    results = cached_page(page_cache_key('vendor', request.GET, vendor.id), render_results)
+    # Inform user if no matching item found for this vendor
+    if results['unmatched']:
+        messages.info(request, f'"{search_query}" is not available from {vendor.username}.')
     return render(request, 'vendor_detail.html', {
         'vendor': vendor,
-        'products': products,
-        'categories': categories,
+        'product_count': results['product_count'],
+        'categories': results['categories'],
         'search_query': search_query,
         'category_filter': category_filter,
+        'results': mark_safe(results['html'].replace(CSRF_MARKER, csrf_input(request))),
         'user': request.user
     })
 
@@ -644,41 +725,365 @@ def vendor_detail(request, vendor_id):
 # ---------------------------
 from django.views.decorators.http import require_http_methods
 
-def generate_rag_answer(query: str) -> str:
-    """Generate RAG answer using Chroma + Gemini, returns text string"""
-    if CHROMA_COLLECTION is None:
-        return "Knowledge base not initialised. Please embed data first."
-    # embedding
-    embed_resp = genai.embed_content(model="models/embedding-001", content=query, task_type="retrieval_query")
-    query_embedding = embed_resp["embedding"]
-    results = CHROMA_COLLECTION.query(query_embeddings=[query_embedding], n_results=3)
-    documents = results["documents"][0] if results["documents"] else []
-    context = "\n".join(documents)
-    prompt = (
+def embed_query(query: str):
+    """Query embedding via the in-memory LRU, then the on-disk cache, then the provider."""
+    key = normalize_query(query)
+    query_embedding = QUERY_EMBEDDING_CACHE.get(key)
+    if query_embedding is not None:
+        return query_embedding
+    ai = get_ai()
+    embed_model = ai.provider.embed_model
+    query_embedding = ai.embedding_cache.get(embed_model, "retrieval_query", key)
+    if query_embedding is None:
+        query_embedding = ai.provider.embed([key], "retrieval_query")[0]
+        ai.embedding_cache.put(embed_model, "retrieval_query", key, query_embedding)
+    QUERY_EMBEDDING_CACHE.set(key, query_embedding)
+    return query_embedding
+
+
+def format_context(results, n_products: int) -> str:
+    """The retrieved profiles and review chunks: at most ``n_products`` products and AI_PROMPT_TOKEN_BUDGET tokens."""
+    return assemble_context(
+        results, n_products, settings.AI_PROMPT_TOKEN_BUDGET, settings.AI_REVIEW_CHUNKS_PER_PRODUCT
+    )
+
+
+def format_rag_prompt(query: str, context: str, history: str = "") -> str:
+    """Wrap the product context (and any chat history) in the assistant prompt."""
+    conversation = f"Conversation so far:\n{history}\n\n" if history else ""
+    return (
         "You are an e-commerce assistant. "
         "Using the following context, answer the user's question as helpfully as possible.\n\n" +
-        f"Context:\n{context}\n\nUser question: {query}"
+        f"Context:\n{context}\n\n{conversation}User question: {query}"
     )
-    chat_resp = GEMINI_MODEL.generate_content(prompt)
-    return chat_resp.text.strip()
+
+
+def catalog_names():
+    """Known vendor and category names for constraint parsing (cached for 5 minutes)."""
+    from django.core.cache import cache
+    names = cache.get('rag_catalog_names')
+    if names is None:
+        names = {
+            'vendors': list(CustomUser.objects.filter(is_vendor=True).values_list('username', flat=True)),
+            'categories': list(Category.objects.values_list('name', flat=True)),
+        }
+        cache.set('rag_catalog_names', names, 300)
+    return names
+
+
+def retrieval_params(query: str):
+    """Chroma ``where`` filter and number of products for the constraints stated in ``query``."""
+    names = catalog_names()
+    constraints = parse_constraints(query, names['vendors'], names['categories'])
+    return build_where(constraints), choose_n_results(query, constraints)
+
+
+def build_rag_prompt(query: str, history: str = "", query_embedding=None, version: str = "") -> str:
+    """Retrieve the closest matching product profiles and wrap them in the assistant prompt."""
+    context_key = (normalize_query(query), version)
+    context = CONTEXT_CACHE.get(context_key)
+    if context is None:
+        if query_embedding is None:
+            query_embedding = embed_query(query)
+        where, n_products = retrieval_params(query)
+        retriever = get_ai().retriever
+        results = merge_results([
+            retriever.query(query_embeddings=[query_embedding], n_results=n_results, where=kind_where)
+            for kind_where, n_results in retrieval_queries(where, n_products, settings.AI_REVIEW_CHUNKS_PER_PRODUCT)
+        ])
+        context = format_context(results, n_products)
+        CONTEXT_CACHE.set(context_key, context)
+    return format_rag_prompt(query, context, history)
+
+
+def answer_cache_key(query: str, version: str):
+    return normalize_query(query), version
+
+
+def semantic_guard(retrieval) -> str:
+    """What must match exactly for a paraphrase to reuse an answer: filters and result count."""
+    return content_hash(json.dumps(retrieval, sort_keys=True))
+
+
+def relevant_history(query: str, history: str) -> str:
+    """The chat context ``query`` is answered with: none for standalone questions.
+
+    Their answers then depend only on the question and the index, so they can be
+    cached and shared; follow-ups get the history and skip the answer caches.
+    """
+    return history if history and refers_to_history(query) else ""
+
+
+def generate_rag_answer(query: str) -> str:
+    """Generate RAG answer using Chroma + the configured AI provider, returns text string"""
+    return "".join(stream_rag_answer(query)).strip()
+
+
+def stream_rag_answer(query: str, history: str = ""):
+    """Yield the RAG answer in chunks as the provider produces them.
+
+    A cached answer is yielded in one piece; a freshly generated one is cached
+    once the stream completes. ``history`` is the chat context from
+    ``chat_history.conversation_context``; it is only used for follow-up
+    questions (see ``relevant_history``), whose answers are not cached.
+    """
+    if get_ai().retriever is None:
+        yield "Knowledge base not initialised. Please embed data first."
+        return
+    version = INDEX_VERSION.get()
+    history = relevant_history(query, history)
+    if history:
+        yield from get_ai().provider.stream(build_rag_prompt(query, history, version=version))
+        return
+    answer_key = answer_cache_key(query, version)
+    answer = ANSWER_CACHE.get(answer_key)
+    if answer is not None:
+        yield answer
+        return
+    query_embedding = embed_query(query)
+    guard = semantic_guard(retrieval_params(query))
+    answer = SEMANTIC_CACHE.get(query_embedding, version, guard)
+    if answer is not None:
+        ANSWER_CACHE.set(answer_key, answer)
+        yield answer
+        return
+    chunks = []
+    for chunk in get_ai().provider.stream(build_rag_prompt(query, "", query_embedding, version)):
+        chunks.append(chunk)
+        yield chunk
+    answer = "".join(chunks).strip()
+    ANSWER_CACHE.set(answer_key, answer)
+    SEMANTIC_CACHE.set(query_embedding, version, answer, guard)
+
+
+# ---------------------------
+# Async RAG path (served without blocking a thread under ASGI)
+# ---------------------------
+import asyncio
+from asgiref.sync import sync_to_async
+from functools import partial
+from .limits import ConcurrencyLimiter, LimiterBusy
+from .batching import MicroBatcher
+from .chat_history import chat_history_writer, conversation_context
+from .indexing import content_hash
+from django.utils import timezone
+
+CHAT_LIMITER = ConcurrencyLimiter(settings.AI_MAX_CONCURRENT_CHATS, settings.AI_CHAT_QUEUE_TIMEOUT)
+CHAT_BUSY_MESSAGE = "The assistant is busy, please try again shortly."
+
+
+async def embed_queries(keys):
+    """Batch handler: embeddings for normalized queries.
+
+    The on-disk cache is read once for the whole batch and the misses go to the
+    provider in a single request; repeated queries in a batch are embedded once.
+    """
+    ai = await aget_ai()
+    embed_model = ai.provider.embed_model
+    unique = list(dict.fromkeys(keys))
+    vectors = await asyncio.to_thread(ai.embedding_cache.get_many, embed_model, "retrieval_query", unique)
+    found = {key: vector for key, vector in zip(unique, vectors) if vector is not None}
+    missing = [key for key in unique if key not in found]
+    if missing:
+        fresh = await ai.provider.aembed(missing, "retrieval_query")
+        await asyncio.to_thread(ai.embedding_cache.put_many, embed_model, "retrieval_query", missing, fresh)
+        found.update(zip(missing, fresh))
+    return [found[key] for key in keys]
+
+
+async def query_retriever(requests):
+    """Batch handler: one multi-query search per distinct (n_results, where).
+
+    Each request is ``(query_embedding, n_results, where)``; each result has the
+    shape of a single-query ``Collection.query`` result.
+    """
+    ai = await aget_ai()
+    loop = asyncio.get_running_loop()
+    groups = {}
+    for i, (_, n_results, where) in enumerate(requests):
+        groups.setdefault((n_results, json.dumps(where, sort_keys=True)), []).append(i)
+
+    async def search(n_results, where, positions):
+        embeddings = [requests[i][0] for i in positions]
+        results = await loop.run_in_executor(
+            ai.chroma_executor,
+            partial(ai.retriever.query, query_embeddings=embeddings, n_results=n_results, where=where),
+        )
+        return positions, results
+
+    answers = [None] * len(requests)
+    searches = [search(n_results, requests[positions[0]][2], positions)
+                for (n_results, _), positions in groups.items()]
+    for positions, results in await asyncio.gather(*searches):
+        for row, i in enumerate(positions):
+            answers[i] = {key: [values[row]] for key, values in results.items()
+                          if key != "included" and isinstance(values, list)}
+    return answers
+
+
+# Chats arriving within AI_BATCH_WINDOW seconds share one embedding call and one search
+EMBED_BATCHER = MicroBatcher(embed_queries, settings.AI_BATCH_WINDOW, settings.AI_BATCH_MAX_SIZE)
+RETRIEVAL_BATCHER = MicroBatcher(query_retriever, settings.AI_BATCH_WINDOW, settings.AI_BATCH_MAX_SIZE)
+
+
+async def aembed_query(query: str):
+    """Async counterpart of ``embed_query``; cache misses are batched with concurrent chats."""
+    key = normalize_query(query)
+    query_embedding = QUERY_EMBEDDING_CACHE.get(key)
+    if query_embedding is not None:
+        return query_embedding
+    query_embedding = await EMBED_BATCHER.submit(key)
+    QUERY_EMBEDDING_CACHE.set(key, query_embedding)
+    return query_embedding
+
+
+async def abuild_rag_prompt(query: str, history: str = "", query_embedding=None, version: str = "") -> str:
+    """Async counterpart of ``build_rag_prompt``."""
+    context_key = (normalize_query(query), version)
+    context = CONTEXT_CACHE.get(context_key)
+    if context is None:
+        if query_embedding is None:
+            query_embedding = await aembed_query(query)
+        where, n_products = await sync_to_async(retrieval_params)(query)
+        results = merge_results(await asyncio.gather(*[
+            RETRIEVAL_BATCHER.submit((query_embedding, n_results, kind_where))
+            for kind_where, n_results in retrieval_queries(where, n_products, settings.AI_REVIEW_CHUNKS_PER_PRODUCT)
+        ]))
+        context = format_context(results, n_products)
+        CONTEXT_CACHE.set(context_key, context)
+    return format_rag_prompt(query, context, history)
+
+
+async def astream_rag_answer(query: str, history: str = ""):
+    """Async counterpart of ``stream_rag_answer``."""
+    ai = await aget_ai()
+    if ai.retriever is None:
+        yield "Knowledge base not initialised. Please embed data first."
+        return
+    version = await asyncio.to_thread(INDEX_VERSION.get)
+    history = relevant_history(query, history)
+    if history:
+        async for chunk in ai.provider.astream(await abuild_rag_prompt(query, history, version=version)):
+            yield chunk
+        return
+    answer_key = answer_cache_key(query, version)
+    answer = ANSWER_CACHE.get(answer_key)
+    if answer is not None:
+        yield answer
+        return
+    query_embedding = await aembed_query(query)
+    guard = semantic_guard(await sync_to_async(retrieval_params)(query))
+    answer = SEMANTIC_CACHE.get(query_embedding, version, guard)
+    if answer is not None:
+        ANSWER_CACHE.set(answer_key, answer)
+        yield answer
+        return
+    chunks = []
+    async for chunk in ai.provider.astream(await abuild_rag_prompt(query, "", query_embedding, version)):
+        chunks.append(chunk)
+        yield chunk
+    answer = "".join(chunks).strip()
+    ANSWER_CACHE.set(answer_key, answer)
+    SEMANTIC_CACHE.set(query_embedding, version, answer, guard)
 
 
 @login_required
 @require_http_methods(["GET"])
 def chat_ui(request):
     """Render the chat interface page"""
+    # Start loading the AI clients while the user types the first question
+    warm_up_in_background()
     return render(request, "chat.html")
 
 @login_required
 @csrf_exempt
 @require_http_methods(["POST"])
-def chat_send(request):
-    """AJAX endpoint to receive user message and return AI reply"""
+async def chat_send(request):
+    """AJAX endpoint to receive user message and return AI reply.
+
+    With ``stream=1`` the reply is sent as a chunked ``text/plain`` body, written
+    token by token as the model generates it; otherwise as JSON once complete.
+    The view is async: under ASGI, waiting on the model does not hold a thread.
+    At most ``AI_MAX_CONCURRENT_CHATS`` chats run at once per process.
+    The user's recent turns and summary go into the prompt; the new turns are
+    saved in the background once the reply is complete.
+    """
     user_msg = request.POST.get("message", "").strip()
     if not user_msg:
         return JsonResponse({"error": "empty message"}, status=400)
-    answer = generate_rag_answer(user_msg)
-    return JsonResponse({"reply": answer})
+    user = await request.auser()
+    asked_at = timezone.now()
+    if request.POST.get("stream") == "1":
+        response = StreamingHttpResponse(stream_chat_reply(user.id, user_msg, asked_at),
+                                         content_type="text/plain; charset=utf-8")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # stop nginx from buffering the stream
+        return response
+    try:
+        await CHAT_LIMITER.acquire()
+    except LimiterBusy:
+        return JsonResponse({"error": CHAT_BUSY_MESSAGE}, status=503)
+    # try/finally rather than except Exception: a cancelled request raises CancelledError
+    try:
+        history = await sync_to_async(conversation_context)(user.id)
+        chunks = [chunk async for chunk in astream_rag_answer(user_msg, history)]
+    finally:
+        CHAT_LIMITER.release()
+    reply = "".join(chunks).strip()
+    save_chat_turn(user.id, user_msg, asked_at, reply)
+    return JsonResponse({"reply": reply})
+
+
+async def stream_chat_reply(user_id, user_msg: str, asked_at):
+    """Streamed chat body; takes a limiter slot once streaming starts and holds it until the stream ends.
+
+    The slot is taken here rather than in the view: a client that disconnects
+    before the body is iterated never starts this generator, so its ``finally``
+    would never run. When no slot frees up in time the busy message is the body.
+    An error after the first byte is reported inline, and the turn is not saved.
+    """
+    try:
+        await CHAT_LIMITER.acquire()
+    except LimiterBusy:
+        yield CHAT_BUSY_MESSAGE
+        return
+    chunks = []
+    try:
+        history = await sync_to_async(conversation_context)(user_id)
+        async for chunk in astream_rag_answer(user_msg, history):
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        yield f"\n⚠️ {e}"
+        return
+    finally:
+        CHAT_LIMITER.release()
+    save_chat_turn(user_id, user_msg, asked_at, "".join(chunks).strip())
+
+
+def save_chat_turn(user_id, user_msg: str, asked_at, reply: str):
+    """Queues the question and the reply for the background history writer."""
+    chat_history_writer.add(user_id, "user", user_msg, asked_at)
+    chat_history_writer.add(user_id, "ai", reply)
+
+
+@login_required
+@user_passes_test(lambda u: u.is_staff, login_url='/')
+@require_http_methods(["GET"])
+def chat_stats(request):
+    """Hit/miss counters of the assistant's caches (staff only)."""
+    return JsonResponse({
+        "index_version": INDEX_VERSION.get(),
+        "query_embeddings": QUERY_EMBEDDING_CACHE.stats(),
+        "answers": ANSWER_CACHE.stats(),
+        "semantic_answers": SEMANTIC_CACHE.stats(),
+        "retrieved_contexts": CONTEXT_CACHE.stats(),
+        "embedding_store": get_ai().embedding_cache.stats(),
+        "chat_limiter": CHAT_LIMITER.stats(),
+        "embed_batches": EMBED_BATCHER.stats(),
+        "retrieval_batches": RETRIEVAL_BATCHER.stats(),
+        "chat_history": chat_history_writer.stats(),
+    })
 
 
 def ask_ai(request):
@@ -689,7 +1094,7 @@ def ask_ai(request):
             messages.error(request, "Please enter a question.")
             return redirect("ask_ai")
 
-        if CHROMA_COLLECTION is None:
+        if get_ai().retriever is None:
             messages.error(request, "Knowledge base not initialised. Please embed data first.")
             return redirect("ask_ai")
 
@@ -1,114 +1,161 @@
 import os
+import sys
+import logging
+import time
 import sqlite3
-import google.generativeai as genai
+import argparse
 from chromadb import PersistentClient
 
+# Shared helpers live in the Django app; they do not require Django to be set up.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ecom"))
+from ecomApp.embedding_cache import EmbeddingCache
+from ecomApp.providers import provider_from_env
+from ecomApp.indexing import (
+    COLLECTION_NAME, CHROMA_WRITE_BATCH, EMBED_BATCH_SIZE, EMBED_WORKERS, EMBED_RATE_LIMIT,
+    batched, doc_product_id, embed_and_store, iter_products, new_stats, plan_changes, update_index_metadata,
+)
+
 # --- Configuration ---
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# The embedding backend is selected by AI_PROVIDER ('gemini' by default, 'local' for offline runs)
 DB_PATH = os.path.join("ecom", "db.sqlite3") if os.path.exists("ecom/db.sqlite3") else "db.sqlite3"
 CHROMA_PATH = "chroma_db"
-# Use a new collection to avoid mixing old and new data structures
-COLLECTION_NAME = "product_profiles"
-
-# --- ChromaDB Client ---
-client = PersistentClient(path=CHROMA_PATH)
-# Delete old collection if it exists, to ensure a fresh start
-try:
-    client.delete_collection(name=COLLECTION_NAME)
-    print(f"Deleted existing collection: '{COLLECTION_NAME}'")
-except Exception:
-    pass # Collection didn't exist, which is fine
-
-collection = client.create_collection(name=COLLECTION_NAME)
-print(f"Recreated collection: '{COLLECTION_NAME}'")
-
-# --- Embedding Function ---
-def get_embedding(text: str):
-    """Generates an embedding for the given text using the Google AI API."""
-    try:
-        resp = genai.embed_content(
-            model="models/embedding-001",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return resp["embedding"]
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
-        return None
+# Collection-level metadata keys holding the high-water marks of the last sync
+PRODUCTS_WATERMARK_KEY = "products_synced_at"
+FEEDBACK_WATERMARK_KEY = "feedback_synced_at"
+# Same file the web app reads, so vectors survive collection resets and rebuilds
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
 
-# --- Main Data Processing Logic ---
-def main():
-    """Fetches product data, combines it with related info, and embeds it."""
-    conn = sqlite3.connect(DB_PATH)
-    # Use Row factory to access columns by name for better readability
-    conn.row_factory = sqlite3.Row
+
+def open_collection(client, full: bool):
+    """Returns the profile collection, dropping it first when a full rebuild is requested."""
+    if full:
+        # Delete old collection if it exists, to ensure a fresh start
+        try:
+            client.delete_collection(name=COLLECTION_NAME)
+            print(f"Deleted existing collection: '{COLLECTION_NAME}'")
+        except Exception:
+            pass # Collection didn't exist, which is fine
+        collection = client.create_collection(name=COLLECTION_NAME)
+        print(f"Recreated collection: '{COLLECTION_NAME}'")
+        return collection
+    return client.get_or_create_collection(name=COLLECTION_NAME)
+
+
+def current_watermarks(cursor):
+    """Newest Product.updated_at and Feedback.created_at, read before syncing."""
+    cursor.execute("SELECT MAX(updated_at) FROM ecomApp_product")
+    products_at = cursor.fetchone()[0]
+    cursor.execute("SELECT MAX(created_at) FROM ecomApp_feedback")
+    feedback_at = cursor.fetchone()[0]
+    return products_at or "", feedback_at or ""
+
+
+def prune_deleted(conn, collection, page_size: int = CHROMA_WRITE_BATCH):
+    """Removes profiles and review chunks whose product row no longer exists (hard deletes).
+
+    Deleted rows leave no updated_at trail, so this pages through the indexed ids
+    and checks each page against the product table; nothing is re-embedded here.
+    Its cost grows with the collection, so it only runs with ``--prune``: the
+    web app's delete signals already remove deleted products (see index_updates.py).
+    """
     cursor = conn.cursor()
+    stale = []
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+        wanted = {doc_id: doc_product_id(doc_id, meta) for doc_id, meta in zip(page["ids"], page["metadatas"])}
+        placeholders = ",".join("?" * len(wanted))
+        cursor.execute(f"SELECT id FROM ecomApp_product WHERE id IN ({placeholders})", list(wanted.values()))
+        found = {row[0] for row in cursor.fetchall()}
+        stale.extend(doc_id for doc_id, pid in wanted.items() if pid not in found)
+    for chunk in batched(stale, page_size):
+        collection.delete(ids=chunk)
+    return len(stale)
+
 
-    # 1. Fetch all available products with their vendor and category.
-    cursor.execute(
-        """
-        SELECT
-            p.id, p.name, p.description, p.price, p.quantity,
-            c.name as category_name,
-            u.username as vendor_username
-        FROM ecomApp_product p
-        LEFT JOIN ecomApp_category c ON p.category_id = c.id
-        LEFT JOIN ecomApp_customuser u ON p.vendor_id = u.id
-        WHERE p.available = 1 AND p.quantity > 0
-        """
+# --- Main Data Processing Logic ---
+def sync(client, conn, provider, cache, full: bool = False, prune: bool = False,
+         batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS, rate_limit: float = EMBED_RATE_LIMIT):
+    """Brings the profile collection of the Chroma ``client`` in line with the product table.
+
+    Only products touched since the last run are considered; of those, a
+    profile is re-embedded only if its document hash differs from the stored one.
+    Rows stream from the DB-API connection ``conn`` through hashing and batching
+    into the embedding pool. Returns the sync counters plus ``upserted`` and ``pruned``.
+    """
+    started = time.perf_counter()
+    collection = open_collection(client, full)
+
+    state = collection.metadata or {}
+    # Read the new watermarks up front so writes made during the sync are picked up next time.
+    products_at, feedback_at = current_watermarks(conn.cursor())
+    stats = new_stats()
+    products = iter_products(conn, state.get(PRODUCTS_WATERMARK_KEY), state.get(FEEDBACK_WATERMARK_KEY))
+
+    # Generate embeddings in batches (reusing cached vectors) and upsert them into ChromaDB.
+    upserted = embed_and_store(collection, plan_changes(collection, products, stats), provider, cache,
+                               batch_size=batch_size, workers=workers, rate_limit=rate_limit)
+    # A full rebuild starts from an empty collection, so there is nothing to prune.
+    pruned = prune_deleted(conn, collection) if prune and not full else 0
+
+    changed = bool(upserted or stats["removed"] or pruned)
+    if upserted == stats["pending"]:
+        update_index_metadata(client, bump_version=changed, **{
+            PRODUCTS_WATERMARK_KEY: products_at,
+            FEEDBACK_WATERMARK_KEY: feedback_at,
+        })
+    else:
+        # Keep the old watermarks so the failed profiles are retried next run.
+        print(f"{stats['pending'] - upserted} profiles failed to embed; watermarks not advanced.")
+        if changed:
+            update_index_metadata(client)
+    elapsed = time.perf_counter() - started
+    print(
+        f"\nSync complete: {stats['checked']} checked, {upserted} upserted, "
+        f"{stats['unchanged']} unchanged, {stats['removed'] + pruned} removed. "
+        f"{collection.count()} product profiles stored in '{COLLECTION_NAME}'."
+    )
+    print(f"Embedded {upserted} docs in {elapsed:.1f}s ({upserted / elapsed if elapsed else 0:.1f} docs/sec).")
+    cache_stats = cache.stats()
+    print(
+        f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['entries']} entries."
+    )
+    return {**stats, "upserted": upserted, "pruned": pruned}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed product profiles into ChromaDB.")
+    parser.add_argument(
+        "--full", action="store_true",
+        help="Drop the collection and re-embed every product instead of syncing changes."
     )
-    products = cursor.fetchall()
-    print(f"Found {len(products)} products to process...")
-
-    # 2. For each product, build a comprehensive text document.
-    for product in products:
-        # Fetch average rating and all feedback comments for this product.
-        cursor.execute(
-            """
-            SELECT
-                AVG(rating) as avg_rating,
-                GROUP_CONCAT(comment, '; ') as all_comments
-            FROM ecomApp_feedback
-            WHERE product_id = ?
-            """,
-            (product['id'],)
-        )
-        feedback_data = cursor.fetchone()
-
-        # 3. Construct the document text, excluding internal IDs.
-        doc_parts = [
-            f"Product Name: {product['name']}",
-            f"Description: {product['description']}",
-            f"Sold by Vendor: {product['vendor_username']}",
-            f"Category: {product['category_name'] or 'N/A'}",
-            f"Price: Rs. {product['price']:.2f}",
-            f"Available Stock: {product['quantity']}"
-        ]
-
-        avg_rating_text = "Not yet rated"
-        if feedback_data and feedback_data['avg_rating']:
-            avg_rating = round(feedback_data['avg_rating'], 1)
-            avg_rating_text = f"{avg_rating} out of 5 stars"
-        doc_parts.append(f"Average Rating: {avg_rating_text}")
-
-        feedback_text = "No reviews yet"
-        if feedback_data and feedback_data['all_comments']:
-            feedback_text = feedback_data['all_comments']
-        doc_parts.append(f"Customer Feedback Summary: {feedback_text}")
-
-        doc_text = "\n".join(doc_parts)
-        doc_id = f"product_profile_{product['id']}"
-
-        # 4. Generate embedding and add to ChromaDB.
-        embedding = get_embedding(doc_text)
-        if embedding:
-            try:
-                collection.add(documents=[doc_text], embeddings=[embedding], ids=[doc_id])
-            except Exception as e:
-                print(f"Error adding document {doc_id} to ChromaDB: {e}")
-
-    conn.close()
-    print(f"\nEmbedding process complete. {collection.count()} product profiles stored in '{COLLECTION_NAME}'.")
+    parser.add_argument(
+        "--prune", action="store_true",
+        help="Also remove profiles of products deleted outside the web app (scans the whole collection)."
+    )
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="Documents per embedding request.")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS,
+                        help="Concurrent embedding requests.")
+    parser.add_argument("--rate-limit", type=float, default=EMBED_RATE_LIMIT,
+                        help="Maximum embedding requests per second (0 disables the limit).")
+    args = parser.parse_args()
+    # Embedding retries and failures are reported through logging (ecomApp/indexing.py).
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    client = PersistentClient(path=CHROMA_PATH)
+    conn = sqlite3.connect(DB_PATH)
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+    try:
+        sync(client, conn, provider_from_env(), cache, full=args.full, prune=args.prune,
+             batch_size=args.batch_size, workers=args.workers, rate_limit=args.rate_limit)
+    finally:
+        cache.close()
+        conn.close()
 
 if __name__ == "__main__":
     main()